@@ -1,10 +1,27 @@
-import sys, os, re, json, base64, html, uuid, requests,ctypes
+import sys, os, re, json, base64, hashlib, html, uuid, requests,ctypes
 from datetime import datetime
 from PyQt6 import QtWidgets, QtCore, QtGui
-from functions.wallpaper_color import get_desktop_base_color, windows_is_dark_mode
-from functions.clipboard import clipboard_output, insert_to_cursor
+from functions.theme import shared_theme
+from functions.theme_providers import default_theme_provider
+from functions.clipboard import ClipboardCatcher, human_readable_size, insert_to_cursor
 from functions.secondmenu import show_rich_context_menu
 from functions.modules import FindReplaceDialog , TrayManager
+from functions.autosave import AutoSaver
+from functions.config import ConfigStore
+from functions.persistence import PersistenceWorker, file_lock, read_json, write_atomic
+from functions.blocks import BlockChangeTracker, BlockHtmlCache, apply_unit_edits, apply_unit_edits_to_list, board_html, document_head, join_fragments, selection_format, split_html, unit_edits
+from functions.loader import BoardLoader
+from functions.watcher import BoardWatcher, local_units, merge_units
+from functions.undo import UndoHistory, UndoHistoryDialog, UndoLog, undo_log_path_for
+from functions.archive import ARCHIVE_SCHEME, ClipboardArchive, archive_dir_for
+from functions.timeline import BoardTimeline, versions_dir_for
+from functions.tray_icon import Activity
+from functions.dirsize import DirSizeScanner, parse_placeholder, placeholder_cursors as size_placeholders, retarget_placeholder, update_placeholder
+from functions.image_cache import ImageCache, image_cache_dir
+from functions.image_fetch import FETCH_SCHEME, ImageFetcher, placeholder_cursors, placeholder_image, placeholder_url, replace_image_source, swap_placeholder
+from functions.journal import BoardJournal, finish_replay, journal_path_for, replay_journal
+from functions.sqlite_store import SqliteBoard, SqliteBoardStore, sqlite_path_for
+from functions.blobstore import BlobStore, BLOB_SCHEME, blob_dir_for, store_inline_images, inline_blob_images
 from datetime import datetime
 from functions.telegram import send_html_message, get_saved_messages_html, send_file_to_saved, download_large_file
 import asyncio, threading, subprocess
@@ -25,22 +42,73 @@ class DesktopTextBoard(QtWidgets.QTextEdit):
         super().__init__()
         self.show_raw = False
         self.history_file = "textboard_history.json"
-        self.auto_save_timer = None
+        self.auto_saver = None
+        self.storage_format = "json"
+        self.compression = "none"
+        self.archive_max_age_days = 7
+        self.archive_max_kb = 4096
+        self.undo_budget_mb = 8
+        self.undo_log_mb = 64
+        self.image_cache_mb = 64
+        self._undo_log_index = None
+        self.block_tracker = None
+        self.block_cache = None
+        self.board_store = None
+        self._journal_seq = 0
+        self._store_needs_checkpoint = False
+        self.board_loader = None
+        # Board units as the save file held them when we last read or wrote it
+        # (the base of merge_external), None when unknown.
+        self.sync_base = None
         self.clipboard_catch_enabled = False
-        self.clipboard_timer = None
-        self.last_clipboard = [image, html, text, files] = [None] * 4
+        self.clipboard_catcher = None
         self.bg_snippet_threads = {}
+        self.activity = Activity(self)
+        self.tray = None
         self.opacity = 1.0
         self.disable_transparency = False
+        self.persistence = PersistenceWorker(self)
+        self.persistence.failed.connect(self.on_persistence_failed)
+        self.config = ConfigStore(get_config_path(), self.persistence, parent=self)
+        self.watcher = BoardWatcher(self, self.persistence)
+        self.watcher.changed.connect(self.merge_external)
         self.setup_ui()
         self.load_config()
-        self.load_file()
+        self.blob_store = BlobStore(blob_dir_for(self.history_file), self.persistence)
+        self.image_fetcher = ImageFetcher(
+            self,
+            cache=ImageCache(
+                image_cache_dir(), self.image_cache_mb * 1024 * 1024, self.persistence
+            ),
+        )
+        self.image_fetcher.fetched.connect(self.on_image_fetched)
+        self.image_fetcher.failed.connect(self.on_image_failed)
+        self._fetch_cursors = {}
+        self._size_cursors = {}
+        self.dir_scanner = DirSizeScanner(self)
+        self.dir_scanner.progress.connect(self.on_dir_size)
+        self.archive = ClipboardArchive(
+            self,
+            archive_dir_for(self.history_file),
+            self.persistence,
+            self.archive_max_age_days,
+            self.archive_max_kb,
+        )
+        self.timeline = BoardTimeline(
+            self, versions_dir_for(self.history_file), self.persistence
+        )
         self.setup_auto_save()
+        self.load_file()
         self.setup_clipboard_catch()
+        shared_theme(
+            default_theme_provider(
+                self.config.get_str("wallpaper_path"),
+                self.config.get_str("theme_settings_file"),
+                QtWidgets.QApplication.instance(),
+            )
+        )
         self.set_theme()
-        self.theme_timer = QtCore.QTimer(self)
-        self.theme_timer.timeout.connect(self.set_theme)
-        self.theme_timer.start(1000)
+        shared_theme().changed.connect(self.set_theme)
         self.update_opacity()
         self.is_error = False
 
@@ -123,61 +191,11 @@ class DesktopTextBoard(QtWidgets.QTextEdit):
     def _titlebar_mouse_release(self, event):
         self._drag_pos = None
 
+    # Called once at startup and then only when the shared theme changes.
     def set_theme(self):
-        desktop_color = get_desktop_base_color()
-        is_dark_mode = windows_is_dark_mode()
-        red = desktop_color.red()
-        green = desktop_color.green()
-        blue = desktop_color.blue()
-        if is_dark_mode:
-            color = QtGui.QColor(
-                max(0, red - 30), max(0, green - 30), max(0, blue - 30)
-            )
-            border_color = QtGui.QColor(
-                max(0, red - 50), max(0, green - 50), max(0, blue - 50)
-            )
-            font_color = QtGui.QColor(200, 200, 200)
-            selection_color = QtGui.QColor(
-                max(0, red - 80), max(0, green - 80), max(0, blue - 80)
-            )
-            selection_bg_color = QtGui.QColor(30, 30, 30)
-        else:
-            color = QtGui.QColor(
-                max(0, red + 30), max(0, green + 30), max(0, blue + 30)
-            )
-            border_color = QtGui.QColor(
-                max(0, red + 50), max(0, green + 50), max(0, blue + 50)
-            )
-            font_color = QtGui.QColor(30, 30, 30)
-            selection_color = QtGui.QColor(
-                max(0, red + 80), max(0, green + 80), max(0, blue + 80)
-            )
-            selection_bg_color = QtGui.QColor(240, 240, 240)
-        self.toolTipStyle = f"QToolTip {{ background-color: {color.name()}; color: {font_color.name()}; border: 1px solid {border_color.name()}; padding: 5px; }}"
-        self.setStyleSheet(
-            """
-            QTextEdit {
-                background: """
-            + color.name()
-            + """;
-                color: """
-            + font_color.name()
-            + """;
-                font-family: 'Consolas', 'Courier New', monospace;
-                font-size: 15px;
-                padding: 12px;
-                border: 1.5px solid """
-            + border_color.name()
-            + """;
-                selection-background-color: """
-            + selection_bg_color.name()
-            + """;
-                selection-color: """
-            + selection_color.name()
-            + """;
-            }
-        """
-        )
+        theme = shared_theme()
+        self.toolTipStyle = theme.stylesheet("tooltip")
+        self.setStyleSheet(theme.stylesheet("editor"))
 
     def update_opacity(self):
         if getattr(self, "disable_transparency", False):
@@ -189,93 +207,441 @@ class DesktopTextBoard(QtWidgets.QTextEdit):
         if not getattr(self, "disable_transparency", False):
             self.opacity = min(1.0, self.opacity + 0.1)
             self.update_opacity()
-            self.save_config()
+            self.config.set("opacity", self.opacity)
 
     def decrease(self):
         if not getattr(self, "disable_transparency", False):
             self.opacity = max(0.1, self.opacity - 0.1)
             self.update_opacity()
-            self.save_config()
+            self.config.set("opacity", self.opacity)
 
     def load_config(self):
-        config_path = get_config_path()
-        self._last_search = ""
-        self._last_replace_find = ""
-        self._last_replace_replace = ""
-        self.opacity = 1.0
-        self.disable_transparency = False
-        if os.path.exists(config_path):
-            try:
-                with open(config_path, "r", encoding="utf-8") as f:
-                    config = json.load(f)
-                font = QtGui.QFont()
-                font.fromString(config.get("font", "Consolas,15,-1,5,50,0,0,0,0,0"))
-                self.setFont(font)
-                self.history_file = config.get("history_file", self.history_file)
-                self._last_search = config.get("last_search", "")
-                self._last_replace_find = config.get("last_replace_find", "")
-                self._last_replace_replace = config.get("last_replace_replace", "")
-                self.disable_transparency = config.get("disable_transparency", False)
-                self.opacity = float(config.get("opacity", 1.0))
-            except Exception as e:
-                if not self.is_error:
-                    self.is_error = True
-                    self.setHtml(
-                        f"<p style='color: red;'>Error loading config: {e}</p>"
-                    )
+        try:
+            self.config.load()
+        except Exception as e:
+            if not getattr(self, "is_error", False):
+                self.is_error = True
+                self.setHtml(f"<p style='color: red;'>Error loading config: {e}</p>")
+        config = self.config
+        if config.values:
+            font = QtGui.QFont()
+            font.fromString(config.get_str("font"))
+            self.setFont(font)
+        self.history_file = config.get_str("history_file")
+        self.disable_transparency = config.get_bool("disable_transparency")
+        self.opacity = config.get_float("opacity")
+        self.storage_format = config.get_str("storage_format")
+        self.compression = config.get_str("compression")
+        self.archive_max_age_days = config.get_int("archive_max_age_days")
+        self.archive_max_kb = config.get_int("archive_max_kb")
+        self.undo_budget_mb = config.get_int("undo_budget_mb")
+        self.undo_log_mb = config.get_int("undo_log_mb")
+        self.image_cache_mb = config.get_int("image_cache_mb")
         self.setWindowOpacity(self.opacity if not self.disable_transparency else 1.0)
 
+    # Hands the current settings to the ConfigStore, which writes them out
+    # after a short delay (or on config.flush()).
     def save_config(self, font=None, history_file=None):
-        config_path = get_config_path()
-        config = {
-            "font": (font or self.font()).toString(),
-            "history_file": history_file or self.history_file,
-            "last_search": getattr(self, "_last_search", ""),
-            "last_replace_find": getattr(self, "_last_replace_find", ""),
-            "last_replace_replace": getattr(self, "_last_replace_replace", ""),
-            "opacity": getattr(self, "opacity", 1.0),
-            "disable_transparency": getattr(self, "disable_transparency", False),
-        }
-        try:
-            with open(config_path, "w", encoding="utf-8") as f:
-                json.dump(config, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            self.setHtml(f"<p style='color: red;'>Error saving config: {e}</p>")
+        self.config.update(
+            {
+                "font": (font or self.font()).toString(),
+                "history_file": history_file or self.history_file,
+                "opacity": self.opacity,
+                "disable_transparency": self.disable_transparency,
+                "storage_format": self.storage_format,
+                "compression": self.compression,
+                "archive_max_age_days": self.archive_max_age_days,
+                "archive_max_kb": self.archive_max_kb,
+                "undo_budget_mb": self.undo_budget_mb,
+                "undo_log_mb": self.undo_log_mb,
+                "image_cache_mb": self.image_cache_mb,
+            }
+        )
 
+    # The board store is attached once the board has loaded (on_board_loaded).
     def setup_auto_save(self):
-        self.auto_save_timer = QtCore.QTimer()
-        self.auto_save_timer.timeout.connect(self.save_file)
-        self.auto_save_timer.start(3000)
-        self.textChanged.connect(self.save_file)
+        self.block_cache = BlockHtmlCache(self.document(), self)
+        self.block_tracker = BlockChangeTracker(self.document(), self, self.block_cache)
+        self.auto_saver = AutoSaver(self, self.save_file, serialize=self.block_cache.html)
+        self.auto_saver.dirty_changed.connect(lambda dirty: self.activity.set("save", dirty))
+        self.undo_log = UndoLog(
+            undo_log_path_for(self.history_file),
+            self.persistence,
+            max_bytes=self.undo_log_mb * 1024 * 1024,
+            parent=self,
+        )
+        self.undo_log.indexed.connect(self.on_undo_log_indexed)
+        self.undo_history = UndoHistory(
+            self,
+            self.block_tracker,
+            budget_bytes=self.undo_budget_mb * 1024 * 1024,
+            log=self.undo_log,
+        )
+        self.block_cache.warmed.connect(self.start_undo_history)
+
+    def on_undo_log_indexed(self, index):
+        self._undo_log_index = index
+        self.start_undo_history()
+
+    # The undo history mirrors the board as fragments; start it once the cache
+    # holds all of them (so that costs nothing extra) and the undo log of the
+    # last session has been indexed.
+    def start_undo_history(self):
+        if self.undo_history.ready or self._undo_log_index is None:
+            return
+        if self.board_loader is not None or not self.block_cache.is_warm:
+            return
+        self.undo_history.start(self.block_cache.fragments(), self._undo_log_index)
+
+    # "json" rewrites the whole board on every save; "journal" appends
+    # block-level records and only occasionally writes a full checkpoint;
+    # "sqlite" keeps one row per block and updates only the changed rows.
+    def set_storage_format(self, storage_format, checkpoint=True):
+        if checkpoint:
+            self.finish_loading()
+        if self.board_store:
+            self.board_store.detach(self.block_tracker)
+            if isinstance(self.board_store, BoardJournal):
+                self._journal_seq = self.board_store.seq
+            self.board_store = None
+        self.storage_format = storage_format
+        if storage_format == "journal":
+            self.board_store = BoardJournal(
+                self,
+                self.history_file,
+                self.persistence,
+                seq=self._journal_seq,
+                compression=self.compression,
+            )
+        elif storage_format == "sqlite":
+            self.board_store = SqliteBoard(self, self.history_file, self.persistence)
+        if self.board_store:
+            self.board_store.attach(self.block_tracker)
+            self.auto_saver.hash_content = False
+            if checkpoint or self._store_needs_checkpoint:
+                self._store_needs_checkpoint = False
+                self.board_store.compact()
+        else:
+            self.auto_saver.hash_content = True
+            if checkpoint:
+                self.flush_file(force=True)
+        self.watcher.watch(self.board_files())
+
+    def board_files(self):
+        if self.storage_format == "sqlite":
+            path = sqlite_path_for(self.history_file)
+            return [path, path + "-wal"]
+        if self.storage_format == "journal":
+            return [self.history_file, journal_path_for(self.history_file)]
+        return [self.history_file]
 
     def load_file(self):
-        if os.path.exists(self.history_file):
-            try:
-                with open(self.history_file, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                    self.setHtml(data.get("text", ""))
-            except Exception as e:
-                self.setHtml(f"<p style='color: red;'>Error loading file: {e}</p>")
+        # Warm the head cache here: QTextDocument is only touched on the GUI
+        # thread.
+        document_head()
+        self.undo_log.open()
+        self.auto_saver.paused = True
+        self.block_tracker.suspend()
+        self.board_loader = BoardLoader(self, self.read_board, prepare=self.finish_board)
+        self.board_loader.finished.connect(self.on_board_loaded)
+        self.board_loader.start()
+
+    # Runs on the loader thread. Besides the board HTML (split into top-level
+    # units) it reports what on_board_loaded needs to decide whether the stored
+    # copy has to be rewritten. A journal tail that can only be replayed with a
+    # QTextDocument is left in "pending" for finish_board.
+    def read_board(self):
+        board = {
+            "html": "",
+            "fragments": None,
+            "seq": 0,
+            "replayed": 0,
+            "pending": [],
+            "from_json": False,
+        }
+        sqlite_path = sqlite_path_for(self.history_file)
+        fragments = None
+        if self.storage_format == "sqlite" and os.path.exists(sqlite_path):
+            fragments = SqliteBoardStore(sqlite_path).read_fragments()
+        if fragments:
+            board.update(html=join_fragments(fragments), fragments=fragments)
+        elif os.path.exists(self.history_file):
+            with file_lock(self.history_file):
+                data = read_json(self.history_file)
+                if self.storage_format == "journal":
+                    html, fragments, seq, replayed, pending = replay_journal(
+                        data, journal_path_for(self.history_file)
+                    )
+            if self.storage_format == "journal":
+                board.update(
+                    html=html, fragments=fragments, seq=seq, replayed=replayed, pending=pending
+                )
+            else:
+                board["html"] = board_html(data)
+                # First start on sqlite: import the JSON board into the db.
+                board["from_json"] = self.storage_format == "sqlite"
+        # Boards saved before the blob store existed carry base64 images
+        # inline; move them out once so later saves stay small.
+        html = store_inline_images(board["html"], self.blob_store)
+        board["migrated"] = html != board["html"]
+        board["head"], board["units"] = split_html(html) if html else ("", [])
+        if board["pending"]:
+            board["checkpoint"] = html
+        return board
+
+    # The GUI-thread half of read_board: replays the pending journal tail
+    # onto its checkpoint (see journal.finish_replay). Only boards whose
+    # checkpoint predates stored fragments get here, once; the checkpoint
+    # written after loading them has fragments.
+    def finish_board(self, board):
+        if not board["pending"]:
+            return board
+        html, fragments, seq = finish_replay(board.pop("checkpoint"), board["pending"])
+        board.update(
+            html=html,
+            fragments=fragments,
+            seq=seq,
+            replayed=len(board["pending"]),
+            pending=[],
+        )
+        board["head"], board["units"] = split_html(html) if html else ("", [])
+        return board
+
+    def on_board_loaded(self, board):
+        edited = self.board_loader.user_edited
+        self.board_loader = None
+        if board is not None:
+            self._journal_seq = board["seq"]
+            self.sync_base = board["units"]
+            # Fold a replayed journal tail into a fresh checkpoint, and
+            # re-checkpoint whenever the loaded document does not line up
+            # block for block with the stored fragments.
+            fragments = board["fragments"]
+            self._store_needs_checkpoint = (
+                edited
+                or board["from_json"]
+                or board["migrated"]
+                or bool(board["replayed"])
+                or (fragments is None and self.storage_format == "journal" and bool(board["html"]))
+                or (fragments is not None and len(fragments) != self.document().blockCount())
+            )
+        self.block_tracker.resume()
+        self.auto_saver.paused = False
+        self.set_storage_format(self.storage_format, checkpoint=False)
+        if board is not None and not self.board_store and (edited or board["migrated"]):
+            self.auto_saver.mark_dirty()
+        else:
+            self.auto_saver.mark_clean()
+        self.block_cache.warm()
+        self.archive.start()
+        self.timeline.start()
+        self.resume_dir_sizes()
+
+    # Another process changed the save file. Its version is merged in unit by
+    # unit (watcher.merge_units) and only the changed blocks of the document
+    # are replaced, so scroll position, cursor and layout of the rest stay put.
+    # Where both sides changed the same units ours wins and theirs is kept in a
+    # .conflict copy next to the save file.
+    def merge_external(self):
+        if self.board_loader is not None or self.is_error:
+            return
+        try:
+            board = self.finish_board(self.read_board())
+        except Exception:
+            # Half-written or locked; the next change notification retries.
+            return
+        remote = board["units"]
+        dirty = self.auto_saver.is_dirty()
+        starts, local = local_units(self.block_cache)
+        edits, conflict = merge_units(self.sync_base if dirty else local, local, remote)
+        scroll = self.verticalScrollBar().value()
+        if edits and not apply_unit_edits(self.document(), starts, local, edits):
+            merged = apply_unit_edits_to_list(local, edits)
+            self.setHtml(join_fragments(merged, self.document()))
+        self.verticalScrollBar().setValue(scroll)
+        self.sync_base = remote
+        if conflict:
+            stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+            path = os.path.splitext(self.history_file)[0] + f".conflict-{stamp}.html"
+            text = join_fragments(remote, self.document())
+            self.persistence.submit(
+                path, lambda: write_atomic(path, lambda f: f.write(text))
+            )
+        in_sync = not dirty and not conflict
+        if self.board_store:
+            if isinstance(self.board_store, BoardJournal):
+                self.board_store.seq = max(self.board_store.seq, board["seq"])
+            fragments = board["fragments"]
+            if in_sync and fragments is not None and len(fragments) == self.document().blockCount():
+                # The store already holds this version.
+                self.board_store.pending = []
+            else:
+                self.board_store.compact()
+            self.auto_saver.mark_clean()
+        elif in_sync:
+            self.auto_saver.last_hash = hashlib.sha1(
+                self.block_cache.html().encode("utf-8")
+            ).hexdigest()
+            self.auto_saver.mark_clean()
+        if conflict:
+            QtWidgets.QMessageBox.warning(
+                self,
+                "Board changed elsewhere",
+                "The save file was changed by another program while you were editing "
+                f"the same part of the board. Your version was kept; the other one was "
+                f"saved to {path}.",
+            )
+
+    def finish_loading(self):
+        if self.board_loader is not None:
+            self.board_loader.finish_now()
 
-    def save_file(self):
+    def set_history_file(self, history_file):
+        if history_file == self.history_file:
+            return
+        self.finish_loading()
+        self.history_file = history_file
+        self.blob_store.relocate(blob_dir_for(history_file))
+        self.archive.relocate(archive_dir_for(history_file))
+        self.timeline.relocate(versions_dir_for(history_file))
+        self.undo_history.relocate_log(undo_log_path_for(history_file))
+
+    def loadResource(self, resource_type, url):
+        if url.scheme() == BLOB_SCHEME:
+            data = self.blob_store.get(url.path())
+            if data is not None:
+                return QtGui.QImage.fromData(data)
+        if url.scheme() == FETCH_SCHEME:
+            self.image_fetcher.request(placeholder_url(url.toString()))
+            return placeholder_image()
+        return super().loadResource(resource_type, url)
+
+    # Remembers the placeholders pasted between positions start and end, so
+    # filling them in later does not need a look through the whole board.
+    def track_placeholders(self, start, end):
+        document = self.document()
+        for name, cursors in placeholder_cursors(document, start, end).items():
+            self._fetch_cursors.setdefault(name, []).extend(cursors)
+        for job_id, cursors in size_placeholders(document, start, end).items():
+            self._size_cursors.setdefault(job_id, []).extend(cursors)
+
+    # A fetched image (or the original URL, for one that failed) replaces its
+    # placeholder without becoming an undo step.
+    def swap_fetched(self, url, src):
+        name = f"{FETCH_SCHEME}:{url}"
+        cursors = self._fetch_cursors.pop(QtCore.QUrl(name).toString(), None)
+        with self.undo_history.background():
+            if cursors is None or not swap_placeholder(cursors, name, src):
+                replace_image_source(self.document(), name, src)
+
+    def on_image_fetched(self, url, data):
+        self.swap_fetched(url, self.blob_store.url(self.blob_store.put(data)))
+
+    def on_image_failed(self, url, reason):
+        self.swap_fetched(url, url)
+
+    # Fills in a folder size placeholder (see clipboard.size_html) without
+    # making an undo step. Its cursors are only looked for again when they lost
+    # it (an undo may have brought it back); a scan whose placeholder is gone
+    # is cancelled.
+    def on_dir_size(self, job_id, total, finished):
+        text = human_readable_size(total) if finished else f"≥ {human_readable_size(total)}, scanning…"
+        self.fill_dir_size(job_id, text, finished)
+
+    def fill_dir_size(self, job_id, text, final):
+        with self.undo_history.background():
+            cursors = self._size_cursors.get(job_id, [])
+            filled = update_placeholder(cursors, job_id, text, final)
+            if not filled:
+                cursors = size_placeholders(self.document()).get(job_id, [])
+                self._size_cursors[job_id] = cursors
+                filled = update_placeholder(cursors, job_id, text, final)
+        if final or not filled:
+            self._size_cursors.pop(job_id, None)
+        if not filled:
+            self.dir_scanner.cancel(job_id)
+
+    # Stops the folder scans, leaving what each had counted as final text.
+    def stop_dir_sizes(self):
+        for job_id, total in self.dir_scanner.stop().items():
+            self.fill_dir_size(job_id, f"≥ {human_readable_size(total)} (incomplete)", True)
+
+    # Placeholders left in the loaded board by a session that never finished
+    # them are scanned again; those that do not name a folder any more lose
+    # the marker.
+    def resume_dir_sizes(self):
+        for job_id, cursors in size_placeholders(self.document()).items():
+            _, path = parse_placeholder(selection_format(cursors[0]).anchorHref())
+            if path and os.path.isdir(path):
+                new_id = self.dir_scanner.scan(path)
+                with self.undo_history.background():
+                    retarget_placeholder(cursors, new_id, path)
+                self._size_cursors[new_id] = cursors
+            else:
+                self._size_cursors[job_id] = cursors
+                self.fill_dir_size(job_id, "size unknown", True)
+
+    def save_file(self, html=None):
+        if not self.is_error:
+            self.undo_history.persist()
+            if self.timeline.due():
+                if html is None:
+                    html = self.block_cache.html()
+                self.timeline.snapshot(html)
+        if not self.is_error and self.board_store:
+            self.board_store.flush()
+            return True
         if not self.is_error:
             try:
                 data = {
-                    "text": self.toHtml(),
+                    "text": html if html is not None else self.block_cache.html(),
                     "last_updated": datetime.now().isoformat(),
                     "app_version": "2.0",
                 }
-                with open(self.history_file, "w", encoding="utf-8") as f:
-                    json.dump(data, f, ensure_ascii=False, indent=2)
+                self.persistence.write_json(self.history_file, data, self.compression, lock=True)
+                self.sync_base = split_html(data["text"])[1]
             except Exception as e:
                 self.is_error = True
                 self.setHtml(f"<p style='color: red;'>Error saving file: {e}</p>")
+                return False
+        return not self.is_error
+
+    # Only a failed write of the board itself stops saving and shows the error
+    # in place of the board; blobs, archive segments, undo log, versions,
+    # config and caches share the worker but losing one of those writes must
+    # not cost the text on screen, so they are only reported.
+    def on_persistence_failed(self, path, message):
+        board_files = {os.path.abspath(p) for p in [self.history_file, *self.board_files()]}
+        if os.path.abspath(path) in board_files:
+            if not self.is_error:
+                self.is_error = True
+                self.setHtml(f"<p style='color: red;'>Error saving file: {message}</p>")
+            return
+        self.report_problem(f"Could not write {path}: {message}")
+
+    def report_problem(self, message):
+        if self.tray is not None:
+            self.tray.showMessage(
+                "Desktop TextBoard", message, QtWidgets.QSystemTrayIcon.MessageIcon.Warning
+            )
+        else:
+            print(message, file=sys.stderr)
+
+    def flush_file(self, force=False):
+        self.finish_loading()
+        if self.auto_saver:
+            return self.auto_saver.flush(force=force)
+        return self.save_file()
 
     def closeEvent(self, event):
-        self.save_file()
+        self.stop_dir_sizes()
+        self.flush_file()
         self.save_config()
-        if self.auto_save_timer:
-            self.auto_save_timer.stop()
+        self.config.flush()
+        if self.auto_saver:
+            self.auto_saver.stop()
+        self.image_fetcher.stop()
+        self.persistence.flush()
         super().closeEvent(event)
 
     def wheelEvent(self, event):
@@ -289,131 +655,64 @@ class DesktopTextBoard(QtWidgets.QTextEdit):
         else:
             super().wheelEvent(event)
 
-    def on_text_changed(self):
-        current_text = self.toHtml()
-        timestamp = datetime.now().isoformat()
-        if self.history and self.history[-1]["text"] == current_text:
-            return
-        entry = {
-            "text": current_text,
-            "timestamp": timestamp,
-            "cursor_position": self.textCursor().position(),
-        }
-        if self.history_index < len(self.history) - 1:
-            self.history = self.history[: self.history_index + 1]
-        self.history.append(entry)
-        self.history_index = len(self.history) - 1
-        if len(self.history) > self.max_history:
-            self.history.pop(0)
-            self.history_index -= 1
-
+    # Undo/redo go through the block-delta history once it is running (see
+    # on_cache_warmed); until then Qt's own stack covers the first edits.
     def undo(self):
-        if self.history_index > 0:
-            self.history_index -= 1
-            self.restore_from_history()
+        if self.undo_history.ready:
+            self.undo_history.undo()
+        else:
+            super().undo()
 
     def redo(self):
-        if self.history_index < len(self.history) - 1:
-            self.history_index += 1
-            self.restore_from_history()
-
-    def restore_from_history(self):
-        if 0 <= self.history_index < len(self.history):
-            entry = self.history[self.history_index]
-            self.textChanged.disconnect(self.on_text_changed)
-            self.setHtml(entry["text"])
-            if "cursor_position" in entry:
-                cursor = self.textCursor()
-                cursor.setPosition(
-                    min(entry["cursor_position"], len(self.toPlainText()))
-                )
-                self.setTextCursor(cursor)
-            self.textChanged.connect(self.on_text_changed)
-
-    def load_history(self):
-        try:
-            if os.path.exists(self.history_file):
-                with open(self.history_file, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                    self.history = data.get("history", [])
-                    self.history_index = len(self.history) - 1
-                    if self.history:
-                        last_entry = self.history[-1]
-                        self.setHtml(last_entry["text"])
-                        if "cursor_position" in last_entry:
-                            cursor = self.textCursor()
-                            cursor.setPosition(
-                                min(
-                                    last_entry["cursor_position"],
-                                    len(self.toPlainText()),
-                                )
-                            )
-                            self.setTextCursor(cursor)
-        except Exception as e:
-            self.is_error = True
-            self.setHtml(f"<p style='color: red;'>Error loading history: {e}</p>")
-            self.history = []
-            self.history_index = -1
-
-    def save_history(self):
-        try:
-            data = {
-                "history": self.history,
-                "current_index": self.history_index,
-                "last_updated": datetime.now().isoformat(),
-                "app_version": "2.0",
-            }
-            with open(self.history_file, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            self.setHtml(f"<p style='color: red;'>Error saving history: {e}</p>")
+        if self.undo_history.ready:
+            self.undo_history.redo()
+        else:
+            super().redo()
+
+    # Puts an earlier version of the board (see BoardTimeline) back. Only the
+    # units that differ are replaced, so the restore is one undo step.
+    def restore_version(self, html):
+        self.finish_loading()
+        starts, local = local_units(self.block_cache)
+        units = split_html(html)[1]
+        edits = unit_edits(local, units)
+        if edits and not apply_unit_edits(self.document(), starts, local, edits):
+            self.setHtml(join_fragments(units, self.document()))
+
+    # Jumps to the board as it was after history step `number`.
+    def restore_from_history(self, number):
+        if self.undo_history.ready:
+            self.undo_history.goto(number)
+
+    def show_undo_history(self):
+        if not self.undo_history.ready:
+            QtWidgets.QMessageBox.information(
+                self, "Undo history", "The undo history is not running yet."
+            )
+            return
+        dialog = UndoHistoryDialog(self, self.undo_history)
+        if dialog.exec() and dialog.number is not None:
+            self.restore_from_history(dialog.number)
 
     def setup_clipboard_catch(self):
-        if self.clipboard_timer is None:
-            self.clipboard_timer = QtCore.QTimer(self)
-            self.clipboard_timer.setSingleShot(False)
-            self.clipboard_timer.timeout.connect(self.check_clipboard)
+        self.clipboard_catcher = ClipboardCatcher(self)
+        self.clipboard_catcher.caught.connect(self.insert_clipboard)
         self.set_clipboard_catch(self.clipboard_catch_enabled)
 
     def set_clipboard_catch(self, enabled: bool):
         self.clipboard_catch_enabled = enabled
-        if enabled:
-            self.last_clipboard = [None] * 4
-            self.clipboard_timer.start(1000)
-        else:
-            self.clipboard_timer.stop()
-
-    def check_clipboard(self):
-        clipboard = QtWidgets.QApplication.clipboard()
-        html_data = (
-            clipboard.mimeData().html() if clipboard.mimeData().hasHtml() else None
-        )
-        image_data = (
-            clipboard.mimeData().imageData()
-            if clipboard.mimeData().hasImage()
-            else None
-        )
-        files_data = (
-            clipboard.mimeData().urls() if clipboard.mimeData().hasUrls() else None
-        )
-        text = clipboard.mimeData().text() if clipboard.mimeData().hasText() else None
-        image = QtGui.QImage(image_data) if image_data else None
-        if (
-            text != self.last_clipboard[2]
-            or image != self.last_clipboard[1]
-            or html_data != self.last_clipboard[0]
-            or files_data != self.last_clipboard[3]
-        ):
-            content = clipboard_output(self, clipboard)
-            self.last_clipboard = [html_data, image, text, files_data]
-            ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            header = f'<pre style="color: #00ff00;background: #000000">--- {ts} - clipboard ---</pre><br>'
-            footer = f'<br><pre style="color: #00ff00;background: #000000"> --- end ---</pre><br>'
-            self.moveCursor(QtGui.QTextCursor.MoveOperation.End)
-            self.textCursor().insertHtml(header)
-            self.textCursor().insertHtml(content)
-            self.textCursor().insertHtml(footer)
-            return
+        self.clipboard_catcher.set_enabled(enabled)
+
+    def insert_clipboard(self, content):
+        ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        header = f'<pre style="color: #00ff00;background: #000000">--- {ts} - clipboard ---</pre><br>'
+        footer = f'<br><pre style="color: #00ff00;background: #000000"> --- end ---</pre><br>'
+        self.moveCursor(QtGui.QTextCursor.MoveOperation.End)
+        start = self.textCursor().position()
+        self.textCursor().insertHtml(header)
+        self.textCursor().insertHtml(content)
+        self.textCursor().insertHtml(footer)
+        self.track_placeholders(start, self.textCursor().position())
 
     def is_clipboard_catch_enabled(self):
         return self.clipboard_catch_enabled
@@ -447,6 +746,7 @@ class DesktopTextBoard(QtWidgets.QTextEdit):
             import threading
 
             def run_background(span_id):
+                self.activity.begin("snippet")
                 try:
                     process = subprocess.Popen(
                         [sys.executable, script_path],
@@ -510,6 +810,8 @@ class DesktopTextBoard(QtWidgets.QTextEdit):
                         )
 
                     QtCore.QTimer.singleShot(0, show_error)
+                finally:
+                    self.activity.end("snippet")
             if script_base.startswith("loop_") and False:
                 span_id = str(uuid.uuid4().int)[:8]
                 threading.Thread(
@@ -563,6 +865,12 @@ class DesktopTextBoard(QtWidgets.QTextEdit):
                 cursor = self.textCursor()
                 cursor.insertText(text)
             return
+        if ctrl and not alt and key in (QtCore.Qt.Key.Key_Z, QtCore.Qt.Key.Key_Y):
+            if key == QtCore.Qt.Key.Key_Z and not shift:
+                self.undo()
+            else:
+                self.redo()
+            return
         if ctrl and key == QtCore.Qt.Key.Key_R:
             restart_script()
         if (
@@ -644,14 +952,21 @@ class DesktopTextBoard(QtWidgets.QTextEdit):
                 return
             elif line_text.startswith("[p]") or line_text.startswith("[P]"):
                 def run():
-                    asyncio.run(send_file_to_saved(line_text))
+                    self.activity.begin("upload")
+                    try:
+                        asyncio.run(send_file_to_saved(line_text))
+                    finally:
+                        self.activity.end("upload")
                 Thread(target=run, daemon=True).start()
                 return
             elif line_text.startswith("[gt]"):
                 def insert_messages_table(html):
                     cursor = self.textCursor()
                     cursor.movePosition(QtGui.QTextCursor.MoveOperation.End)
-                    cursor.insertHtml("<br><b>Saved Messages:</b><br>" + html)
+                    cursor.insertHtml(
+                        "<br><b>Saved Messages:</b><br>"
+                        + store_inline_images(html, self.blob_store)
+                    )
 
                 get_saved_messages_html(callback=insert_messages_table)
                 return
@@ -733,14 +1048,8 @@ class DesktopTextBoard(QtWidgets.QTextEdit):
             if key == QtCore.Qt.Key.Key_C:
                 self.copy()
                 return
-            elif key == QtCore.Qt.Key.Key_Z:
-                super().undo()
-                return
-            elif key == QtCore.Qt.Key.Key_Y:
-                super().redo()
-                return
             elif key == QtCore.Qt.Key.Key_S:
-                self.save_file()
+                self.flush_file(force=True)
                 return
 
         if event.text() in (">", "/", "."):
@@ -767,7 +1076,9 @@ class DesktopTextBoard(QtWidgets.QTextEdit):
     def copy(self):
         cursor = self.textCursor()
         if cursor.hasSelection():
-            selected_html = cursor.selection().toHtml()
+            selected_html = inline_blob_images(
+                cursor.selection().toHtml(), self.blob_store
+            )
             selected_text = cursor.selectedText()
             clipboard = QtWidgets.QApplication.clipboard()
             mime = QtCore.QMimeData()
@@ -847,6 +1158,9 @@ class DesktopTextBoard(QtWidgets.QTextEdit):
             if char_format.isAnchor():
                 import webbrowser
                 hrefs = char_format.anchorHref()
+                if hrefs.startswith(ARCHIVE_SCHEME + ":"):
+                    self.archive.open_stub(hrefs, cursor.blockNumber())
+                    return
                 if not hrefs.startswith("teletelegram_msg_id"):
                     id=hrefs.split("=")[-1]
                     if id.isdigit():
@@ -0,0 +1,227 @@
+import json, os, re, shutil, uuid
+from datetime import datetime, timedelta
+from PyQt6 import QtCore, QtGui, QtWidgets
+from functions.blocks import join_fragments, replace_block
+from functions.blobstore import inline_blob_images
+from functions.journal import append_lines
+
+# Clipboard-catch sections (header ... content ... footer, see
+# insert_clipboard) that are older than `max_age_days`, or that push the live
+# sections over `max_live_kb`, are moved into dated segment files
+# <history>_archive/<YYYY-MM-DD>.jsonl. The board keeps a one-line stub linking
+# to archive:<day>/<id>; clicking it opens the section and can restore it.
+# A section only leaves the board once its segment append has been fsynced;
+# if the append fails the section stays and the next run tries again.
+
+ARCHIVE_SCHEME = "archive"
+HEADER_RE = re.compile(r"--- (\d{4}-\d\d-\d\d \d\d:\d\d:\d\d) - clipboard ---$")
+FOOTER_TEXT = "--- end ---"
+
+
+def archive_dir_for(history_file):
+    return os.path.splitext(os.path.abspath(history_file))[0] + "_archive"
+
+
+# Returns (header block, footer block, timestamp, header offset) for every
+# complete clipboard-catch section, in document order. The header is inserted
+# at the end of the board, so it can share its block with earlier text; the
+# offset is where it starts in that block (0 when only line breaks precede it,
+# those go into the archive with the section).
+def find_sections(doc):
+    sections = []
+    start = None
+    block = doc.begin()
+    while block.isValid():
+        text = block.text().rstrip()
+        match = HEADER_RE.search(text)
+        if match:
+            start = block.blockNumber()
+            offset = match.start() if text[: match.start()].strip("\u2028 ") else 0
+            ts = datetime.strptime(match.group(1), "%Y-%m-%d %H:%M:%S")
+        elif text.strip() == FOOTER_TEXT and start is not None:
+            sections.append((start, block.blockNumber(), ts, offset))
+            start = None
+        block = block.next()
+    return sections
+
+
+class ClipboardArchive(QtCore.QObject):
+    # (day, written) from the worker once a segment append is done.
+    _appended = QtCore.pyqtSignal(str, bool)
+
+    def __init__(
+        self, editor, root, worker, max_age_days=7, max_live_kb=4096, interval_ms=600000
+    ):
+        super().__init__(editor)
+        self.editor = editor
+        self.root = root
+        self.worker = worker
+        self.max_age_days = max_age_days
+        self.max_live_kb = max_live_kb
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(interval_ms)
+        self.timer.timeout.connect(self.run)
+        # day -> sections waiting for their segment append, see run().
+        self._pending = {}
+        self._appended.connect(self._on_appended)
+
+    def start(self):
+        self.timer.start()
+        self.run()
+
+    def segment_path(self, day):
+        return os.path.join(self.root, day + ".jsonl")
+
+    def _section_html(self, first, last):
+        cache = self.editor.block_cache
+        return join_fragments(cache.range_fragments(first, last), self.editor.document())
+
+    # Archives whatever is over the limits; returns the number of sections
+    # sent to the archive. They are replaced by their stubs in _on_appended.
+    def run(self):
+        if getattr(self.editor, "board_loader", None) is not None or self._pending:
+            return 0
+        doc = self.editor.document()
+        sections = find_sections(doc)
+        if not sections:
+            return 0
+        cutoff = None
+        if self.max_age_days > 0:
+            cutoff = datetime.now() - timedelta(days=self.max_age_days)
+        sizes = [len(self._section_html(first, last)) for first, last, _, _ in sections]
+        live = sum(sizes)
+        budget = self.max_live_kb * 1024 if self.max_live_kb > 0 else None
+        chosen = []
+        for index, (_, _, ts, _) in enumerate(sections):
+            if (cutoff is not None and ts < cutoff) or (budget is not None and live > budget):
+                chosen.append(index)
+                live -= sizes[index]
+        if not chosen:
+            return 0
+        lines = {}
+        cursor = QtGui.QTextCursor(doc)
+        # Back to front, so the block numbers of earlier sections stay valid.
+        for index in reversed(chosen):
+            first, last, ts, offset = sections[index]
+            if offset:
+                cursor.setPosition(doc.findBlockByNumber(first).position() + offset)
+                cursor.insertBlock()
+                first += 1
+                last += 1
+            html = self._section_html(first, last)
+            day = ts.strftime("%Y-%m-%d")
+            entry = {"id": uuid.uuid4().hex, "ts": ts.isoformat(sep=" "), "html": html}
+            lines.setdefault(day, []).insert(0, json.dumps(entry, ensure_ascii=False) + "\n")
+            start = doc.findBlockByNumber(first)
+            end = doc.findBlockByNumber(last)
+            # Qt keeps the selection on the section while the board is edited.
+            section = QtGui.QTextCursor(doc)
+            section.setPosition(start.position())
+            section.setPosition(
+                end.position() + end.length() - 1, QtGui.QTextCursor.MoveMode.KeepAnchor
+            )
+            self._pending.setdefault(day, []).append(
+                (section, section.selectedText(), entry, max(1, len(html) // 1024))
+            )
+        root = self.root
+        for day, day_lines in lines.items():
+            path = self.segment_path(day)
+            text = "".join(day_lines)
+
+            def write(path=path, text=text, day=day):
+                try:
+                    os.makedirs(root, exist_ok=True)
+                    append_lines(path, text)
+                except Exception:
+                    self._appended.emit(day, False)
+                    raise
+                self._appended.emit(day, True)
+
+            self.worker.submit(None, write, path=path)
+        return len(chosen)
+
+    # Swaps the sections of `day` for their stubs once the segment holds
+    # them. A failed append leaves them on the board (the worker reports it);
+    # a section edited in the meantime stays too, its archived copy unused.
+    def _on_appended(self, day, written):
+        sections = self._pending.pop(day, [])
+        if not written:
+            return
+        for section, text, entry, size_kb in sections:
+            if section.selectedText() != text:
+                continue
+            section.beginEditBlock()
+            section.removeSelectedText()
+            section.setBlockFormat(QtGui.QTextBlockFormat())
+            section.setBlockCharFormat(QtGui.QTextCharFormat())
+            section.setCharFormat(QtGui.QTextCharFormat())
+            section.insertHtml(
+                f'<span style="color:gray">📦 </span><a href="{ARCHIVE_SCHEME}:{day}/{entry["id"]}">'
+                f"clipboard {entry['ts']} ({size_kb} KB, archived)</a>"
+            )
+            section.endEditBlock()
+
+    def read(self, href):
+        day, _, entry_id = href[len(ARCHIVE_SCHEME) + 1 :].partition("/")
+        self.worker.flush(5)
+        path = self.segment_path(day)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("id") == entry_id:
+                    return entry
+        return None
+
+    # Puts an archived section back in place of the stub in `block_number`.
+    def restore(self, block_number, entry):
+        replace_block(self.editor.document(), block_number, entry["html"])
+
+    def open_stub(self, href, block_number):
+        entry = self.read(href)
+        if entry is None:
+            QtWidgets.QMessageBox.warning(
+                self.editor, "Archive", f"Archived section not found: {href}"
+            )
+            return
+        dialog = ArchiveViewer(self.editor, entry, getattr(self.editor, "blob_store", None))
+        if dialog.exec():
+            self.restore(block_number, entry)
+
+    # Copies the segments into a new root (used when the save file moves).
+    def relocate(self, root):
+        if os.path.abspath(root) == os.path.abspath(self.root):
+            return
+        old_root = self.root
+        self.root = root
+
+        def copy_segments():
+            if os.path.isdir(old_root):
+                shutil.copytree(old_root, root, dirs_exist_ok=True)
+
+        self.worker.submit(("relocate", root), copy_segments)
+
+
+class ArchiveViewer(QtWidgets.QDialog):
+    def __init__(self, parent, entry, store=None):
+        super().__init__(parent)
+        self.setWindowTitle(f"Archived clipboard {entry['ts']}")
+        self.resize(700, 500)
+        layout = QtWidgets.QVBoxLayout(self)
+        self.view = QtWidgets.QTextBrowser()
+        self.view.setOpenExternalLinks(True)
+        self.view.setHtml(inline_blob_images(entry["html"], store))
+        layout.addWidget(self.view)
+        self.button_box = QtWidgets.QDialogButtonBox(
+            QtWidgets.QDialogButtonBox.StandardButton.Close
+        )
+        restore_button = self.button_box.addButton(
+            "Restore", QtWidgets.QDialogButtonBox.ButtonRole.AcceptRole
+        )
+        restore_button.clicked.connect(self.accept)
+        self.button_box.rejected.connect(self.reject)
+        layout.addWidget(self.button_box)
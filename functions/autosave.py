@@ -0,0 +1,88 @@
+import hashlib
+from PyQt6 import QtCore
+
+
+# Coalesces bursts of edits into a single save. Every document change bumps a
+# generation counter; the save runs once the editor has been idle for
+# `idle_ms`, but never later than `max_latency_ms` after the first unsaved
+# edit. A content hash of the last written HTML lets us skip writes when the
+# document ends up unchanged (e.g. typing and deleting the same character).
+# `serialize` produces that HTML (defaults to editor.toHtml).
+class AutoSaver(QtCore.QObject):
+    # Emitted when unsaved edits appear (True) or have all been saved (False).
+    dirty_changed = QtCore.pyqtSignal(bool)
+
+    def __init__(self, editor, save, idle_ms=1000, max_latency_ms=5000, serialize=None):
+        super().__init__(editor)
+        self.editor = editor
+        self.save = save
+        self.serialize = serialize or editor.toHtml
+        self.generation = 0
+        self.saved_generation = 0
+        self.last_hash = None
+        self.hash_content = True
+        # While paused (e.g. the board is still loading) edits are counted but
+        # nothing is written.
+        self.paused = False
+        self.idle_timer = QtCore.QTimer(self)
+        self.idle_timer.setSingleShot(True)
+        self.idle_timer.setInterval(idle_ms)
+        self.idle_timer.timeout.connect(self.flush)
+        self.latency_timer = QtCore.QTimer(self)
+        self.latency_timer.setSingleShot(True)
+        self.latency_timer.setInterval(max_latency_ms)
+        self.latency_timer.timeout.connect(self.flush)
+        editor.document().contentsChanged.connect(self.mark_dirty)
+
+    def mark_dirty(self):
+        was_dirty = self.is_dirty()
+        self.generation += 1
+        if not was_dirty:
+            self.dirty_changed.emit(True)
+        self.idle_timer.start()
+        if not self.latency_timer.isActive():
+            self.latency_timer.start()
+
+    def is_dirty(self):
+        return self.generation != self.saved_generation
+
+    def mark_clean(self):
+        self.idle_timer.stop()
+        self.latency_timer.stop()
+        self._saved(self.generation)
+
+    def _saved(self, generation):
+        was_dirty = self.is_dirty()
+        self.saved_generation = generation
+        if was_dirty and not self.is_dirty():
+            self.dirty_changed.emit(False)
+
+    def flush(self, force=False):
+        self.idle_timer.stop()
+        self.latency_timer.stop()
+        if self.paused:
+            return False
+        if not force and not self.is_dirty():
+            return False
+        generation = self.generation
+        if not self.hash_content:
+            # The save callback persists incrementally (e.g. a journal), so
+            # there is no full document to serialize or compare.
+            if self.save(None) is False:
+                return False
+            self._saved(generation)
+            return True
+        html = self.serialize()
+        digest = hashlib.sha1(html.encode("utf-8")).hexdigest()
+        if not force and digest == self.last_hash:
+            self._saved(generation)
+            return False
+        if self.save(html) is False:
+            return False
+        self.last_hash = digest
+        self._saved(generation)
+        return True
+
+    def stop(self):
+        self.idle_timer.stop()
+        self.latency_timer.stop()
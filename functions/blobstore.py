@@ -0,0 +1,147 @@
+import base64, hashlib, os, re, shutil, threading
+from PyQt6 import QtCore
+from functions.persistence import write_atomic
+
+# Images are stored once under <history>_blobs/<2 hex>/<sha256> and the
+# document refers to them as <img src="blob:<sha256>">, so saving a board never
+# re-serializes image bytes and identical pastes share one file.
+
+BLOB_SCHEME = "blob"
+_DATA_URI = re.compile(r'src="data:image/[\w.+-]+;base64,([^"]+)"')
+_BLOB_URI = re.compile(r'src="blob:([0-9a-f]{64})"')
+
+
+def blob_dir_for(history_file):
+    return os.path.splitext(os.path.abspath(history_file))[0] + "_blobs"
+
+
+def encode_png(image):
+    buffer = QtCore.QBuffer()
+    buffer.open(QtCore.QIODevice.OpenModeFlag.WriteOnly)
+    image.save(buffer, "PNG")
+    return bytes(buffer.data())
+
+
+class BlobStore:
+    def __init__(self, root, worker=None):
+        self.root = root
+        self.worker = worker
+        self._lock = threading.Lock()
+        # Blobs handed to the worker but not yet on disk.
+        self._pending = {}
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def url(self, digest):
+        return f"{BLOB_SCHEME}:{digest}"
+
+    def put(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        with self._lock:
+            if digest in self._pending or os.path.exists(path):
+                return digest
+            self._pending[digest] = data
+        if self.worker is not None:
+            self.worker.submit(path, lambda: self._write(digest, path, data))
+        else:
+            self._write(digest, path, data)
+        return digest
+
+    def _write(self, digest, path, data):
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_atomic(path, lambda f: f.write(data), binary=True)
+        finally:
+            with self._lock:
+                self._pending.pop(digest, None)
+
+    def get(self, digest):
+        with self._lock:
+            data = self._pending.get(digest)
+        if data is not None:
+            return data
+        try:
+            with open(self.path(digest), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put_image(self, image):
+        return self.url(self.put(encode_png(image)))
+
+    # Copies every blob into a new root (used when the save file moves).
+    def relocate(self, root):
+        if os.path.abspath(root) == os.path.abspath(self.root):
+            return
+        old_root = self.root
+        self.root = root
+
+        def copy_blobs():
+            if os.path.isdir(old_root):
+                shutil.copytree(old_root, root, dirs_exist_ok=True)
+
+        if self.worker is not None:
+            self.worker.submit(("relocate", root), copy_blobs)
+        else:
+            copy_blobs()
+
+
+# This function moves inline base64 images in HTML into the blob store.
+def store_inline_images(html, store):
+    if store is None or "base64," not in html:
+        return html
+
+    def replacer(match):
+        try:
+            data = base64.b64decode(match.group(1))
+        except ValueError:
+            return match.group(0)
+        return f'src="{store.url(store.put(data))}"'
+
+    return _DATA_URI.sub(replacer, html)
+
+
+# Image type of blob bytes by their magic number; the store keeps raw bytes
+# of whatever was pasted or fetched (PNG, JPEG, GIF, WebP, ...).
+_IMAGE_TYPES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+    (b"\x00\x00\x01\x00", "image/x-icon"),
+)
+
+
+def image_mime_type(data):
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:12] in (b"ftypavif", b"ftypavis"):
+        return "image/avif"
+    head = data[:256].lstrip()
+    if head.startswith(b"<svg") or (head.startswith(b"<?xml") and b"<svg" in head):
+        return "image/svg+xml"
+    for magic, mime in _IMAGE_TYPES:
+        if data.startswith(magic):
+            return mime
+    return "image/png"
+
+
+# This function turns blob references back into data URIs, for HTML that
+# leaves the board (clipboard, other applications).
+def inline_blob_images(html, store):
+    if store is None or "blob:" not in html:
+        return html
+
+    def replacer(match):
+        data = store.get(match.group(1))
+        if data is None:
+            return match.group(0)
+        encoded = base64.b64encode(data).decode("utf-8")
+        return f'src="data:{image_mime_type(data)};base64,{encoded}"'
+
+    return _BLOB_URI.sub(replacer, html)
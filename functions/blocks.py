@@ -0,0 +1,534 @@
+import difflib, re
+from PyQt6 import QtCore, QtGui
+
+# Block-level view of a QTextDocument. A board is stored as a list with one
+# HTML fragment per QTextBlock. Tables and lists span several blocks but can
+# only be exported as a whole, so their HTML is kept on the first block of the
+# span and the remaining blocks hold "" (they are skipped when joining).
+
+EMPTY_BLOCK_HTML = '<p style="-qt-paragraph-type:empty; margin-top:0px; margin-bottom:0px; margin-left:0px; margin-right:0px; -qt-block-indent:0; text-indent:0px;"><br /></p>'
+_BODY = re.compile(r"<body[^>]*>\n?(.*)</body>", re.DOTALL)
+_LEADING_EMPTY = re.compile(r'^<p style="-qt-paragraph-type:empty;[^"]*"><br /></p>\n?(?=<[ou]l)')
+
+
+def _top_frame(block):
+    root = block.document().rootFrame()
+    frame = QtGui.QTextCursor(block).currentFrame()
+    if frame is None or frame == root:
+        return None
+    while frame.parentFrame() != root:
+        frame = frame.parentFrame()
+    return frame
+
+
+# The empty paragraph Qt's HTML importer adds after every table belongs to the
+# table, otherwise each save/load round trip would grow the board.
+def _is_frame_trailer(block):
+    return (
+        block.isValid()
+        and block.length() == 1
+        and block.textList() is None
+        and _top_frame(block) is None
+        and block.previous().isValid()
+        and _top_frame(block.previous()) is not None
+    )
+
+
+def _same_list(block, text_list):
+    return (
+        block.isValid()
+        and block.textList() == text_list
+        and _top_frame(block) is None
+    )
+
+
+# Returns the (first, last) block numbers of the unit `block` belongs to: the
+# enclosing top-level table/frame, a run of items of one list, or just the
+# block itself. Units partition the document.
+def block_span(block):
+    doc = block.document()
+    frame = _top_frame(block)
+    if frame is None and _is_frame_trailer(block):
+        frame = _top_frame(block.previous())
+    if frame is not None:
+        first = doc.findBlock(frame.firstPosition()).blockNumber()
+        last = doc.findBlock(frame.lastPosition()).blockNumber()
+        if _is_frame_trailer(doc.findBlockByNumber(last + 1)):
+            last += 1
+        return first, last
+    text_list = block.textList()
+    if text_list is not None:
+        first = last = block
+        while _same_list(first.previous(), text_list):
+            first = first.previous()
+        while _same_list(last.next(), text_list):
+            last = last.next()
+        return first.blockNumber(), last.blockNumber()
+    return block.blockNumber(), block.blockNumber()
+
+
+# A selection inside a single block exports only character formats, so a
+# paragraph span is selected from the end of the previous block (the block
+# format comes along) and the exported remnant of that block is dropped again.
+def span_html(doc, first, last):
+    start = doc.findBlockByNumber(first)
+    end = doc.findBlockByNumber(last)
+    cursor = QtGui.QTextCursor(doc)
+    in_frame = QtGui.QTextCursor(start).currentFrame() != doc.rootFrame()
+    cursor.setPosition(max(0, start.position() - 1))
+    cursor.setPosition(
+        end.position() + end.length() - 1, QtGui.QTextCursor.MoveMode.KeepAnchor
+    )
+    fragment = QtGui.QTextDocumentFragment(cursor)
+    if fragment.isEmpty():
+        return EMPTY_BLOCK_HTML
+    html = fragment.toHtml()
+    html = html.replace("<!--StartFragment-->", "").replace("<!--EndFragment-->", "")
+    if first > 0 and not in_frame:
+        html = "\n".join(split_html(html)[1][1:])
+    else:
+        match = _BODY.search(html)
+        html = _LEADING_EMPTY.sub("", match.group(1) if match else "")
+    return html or EMPTY_BLOCK_HTML
+
+
+# Fragments for blocks first..last; the range must start and end on span
+# boundaries.
+def range_fragments(doc, first, last, cache=None):
+    if cache is not None:
+        return cache.range_fragments(first, last)
+    fragments = []
+    block = doc.findBlockByNumber(first)
+    while block.isValid() and block.blockNumber() <= last:
+        span_first, span_last = block_span(block)
+        fragments.append(span_html(doc, span_first, span_last))
+        fragments.extend([""] * (span_last - span_first))
+        block = doc.findBlockByNumber(span_last).next()
+    return fragments
+
+
+def document_fragments(doc, cache=None):
+    return range_fragments(doc, 0, doc.blockCount() - 1, cache)
+
+
+# Cursors selecting every fragment between positions start and end (the whole
+# document by default) whose character format satisfies `match`. Qt keeps a
+# cursor's selection on its text while the document around it is edited, so a
+# fragment found once can be changed later without scanning again; a
+# selection that has collapsed means the text was deleted.
+def fragment_cursors(doc, match, start=0, end=None):
+    if end is None:
+        end = doc.characterCount()
+    cursors = []
+    block = doc.findBlock(start)
+    while block.isValid() and block.position() <= end:
+        it = block.begin()
+        while not it.atEnd():
+            fragment = it.fragment()
+            it += 1
+            position = fragment.position()
+            if position + fragment.length() <= start or position >= end:
+                continue
+            if match(fragment.charFormat()):
+                cursor = QtGui.QTextCursor(doc)
+                cursor.setPosition(position)
+                cursor.setPosition(
+                    position + fragment.length(), QtGui.QTextCursor.MoveMode.KeepAnchor
+                )
+                cursors.append(cursor)
+        block = block.next()
+    return cursors
+
+
+# The character format of the text `cursor` selects (charFormat() on a
+# selection reports the character before its moving end).
+def selection_format(cursor):
+    probe = QtGui.QTextCursor(cursor.document())
+    probe.setPosition(cursor.selectionStart() + 1)
+    return probe.charFormat()
+
+
+# Span lengths per block: n on the first block of an n-block span, 0 on the
+# blocks it covers.
+def document_spans(doc):
+    spans = []
+    block = doc.begin()
+    while block.isValid():
+        first, last = block_span(block)
+        spans.append(last - first + 1)
+        spans.extend([0] * (last - first))
+        block = doc.findBlockByNumber(last).next()
+    return spans
+
+
+_heads = {}
+
+
+# The <head>/<body> preamble Qt writes for a document with this default font;
+# it carries the pre-wrap whitespace rule the fragments rely on.
+def document_head(doc=None):
+    font = doc.defaultFont() if doc is not None else QtGui.QFont()
+    key = font.toString()
+    if key not in _heads:
+        empty = QtGui.QTextDocument()
+        empty.setDefaultFont(font)
+        html = empty.toHtml()
+        body = re.search(r"<body[^>]*>\n?", html)
+        _heads[key] = html[: body.end()] if body else "<html><body>\n"
+    return _heads[key]
+
+
+def join_fragments(fragments, doc=None):
+    return document_head(doc) + "\n".join(f for f in fragments if f) + "</body></html>"
+
+
+_NESTING_OPEN = re.compile(r"<(?:table|ul|ol)\b")
+_NESTING_CLOSE = re.compile(r"</(?:table|ul|ol)>")
+
+
+# Splits Qt-generated HTML into (head, units) without building a document:
+# Qt writes one top-level block per line, and tables/lists are kept together by
+# tracking their nesting depth. Joining the units with "\n" gives the body back.
+# Works off the GUI thread; HTML without a <body> comes back as a single unit.
+def split_html(html):
+    body = re.search(r"<body[^>]*>\n?", html)
+    if not body:
+        return "", [html]
+    end = html.rfind("</body>")
+    lines = html[body.end() : end if end != -1 else len(html)].split("\n")
+    units, current, depth = [], [], 0
+    for line in lines:
+        current.append(line)
+        depth += len(_NESTING_OPEN.findall(line)) - len(_NESTING_CLOSE.findall(line))
+        if depth <= 0:
+            units.append("\n".join(current))
+            current, depth = [], 0
+    if current:
+        units.append("\n".join(current))
+    return html[: body.end()], units
+
+
+# HTML of a board file: either a plain "text" snapshot or a "blocks" list.
+def board_html(data):
+    if "text" in data:
+        return data["text"]
+    return join_fragments(data.get("blocks", []))
+
+
+# Inserted HTML starts with a paragraph holding this invisible character. It
+# merges into the block at the insertion point and is deleted right away, so
+# every real block of the HTML keeps its own format (inserting HTML straight
+# into a block would hand that block's format to the first inserted paragraph).
+SENTINEL = "\u2063"
+
+
+# Replaces blocks first..last (whole spans; neither end may be inside a table:
+# a table's begin marker doubles as the separator of the block before it) with
+# the blocks of `html`, a Qt HTML document or just its body. The new blocks go
+# in after `last` behind a sentinel paragraph, then everything from the start
+# of `first` up to the first new block is removed.
+def replace_blocks(doc, first, last, html):
+    match = _BODY.search(html)
+    body = match.group(1) if match else html
+    start = doc.findBlockByNumber(first).position()
+    end_block = doc.findBlockByNumber(last)
+    end = end_block.position() + end_block.length() - 1
+    cursor = QtGui.QTextCursor(doc)
+    cursor.beginEditBlock()
+    cursor.setPosition(end)
+    cursor.insertFragment(
+        QtGui.QTextDocumentFragment.fromHtml("<p>" + SENTINEL + "</p>\n" + body)
+    )
+    cursor.setPosition(start)
+    cursor.setPosition(end + 2, QtGui.QTextCursor.MoveMode.KeepAnchor)
+    cursor.removeSelectedText()
+    cursor.endEditBlock()
+
+
+def replace_block(doc, number, html):
+    replace_blocks(doc, number, number, html)
+
+
+# Per-block fragments (see document_fragments) as top-level units: returns
+# (first block of every unit, unit html).
+def fragment_units(fragments):
+    starts = [i for i, f in enumerate(fragments) if f]
+    return starts, [fragments[i] for i in starts]
+
+
+# Edits (see apply_unit_edits) that turn the unit list `units` into
+# `new_units`.
+def unit_edits(units, new_units):
+    matcher = difflib.SequenceMatcher(None, units, new_units, autojunk=False)
+    return [
+        (i1, i2, new_units[j1:j2])
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != "equal"
+    ]
+
+
+def apply_unit_edits_to_list(units, edits):
+    units = list(units)
+    for l1, l2, new in sorted(edits, reverse=True):
+        units[l1:l2] = new
+    return units
+
+
+# Applies unit edits to the document in place, touching only the blocks of the
+# changed units. Pure inserts and deletes borrow a neighbouring unit so that
+# every edit replaces a non-empty range with non-empty HTML, and an edit whose
+# old or new side starts with a table takes in the unit before it (see
+# replace_blocks).
+# Returns False, without touching the document, when an edit cannot be done
+# this way; the caller then reloads the whole board.
+def apply_unit_edits(doc, starts, units, edits):
+    count = len(units)
+    root = doc.rootFrame()
+
+    def in_table(number):
+        return QtGui.QTextCursor(doc.findBlockByNumber(number)).currentFrame() != root
+
+    normalized = []
+    for l1, l2, new in edits:
+        new = list(new)
+        if l1 == l2 or not new:
+            if l2 < count:
+                new = new + [units[l2]]
+                l2 += 1
+            elif l1 > 0:
+                l1 -= 1
+                new = [units[l1]] + new
+            else:
+                return False
+            if l1 == l2 or not new:
+                return False
+        while in_table(starts[l1]) or new[0].startswith("<table"):
+            if l1 == 0:
+                return False
+            l1 -= 1
+            new = [units[l1]] + new
+        normalized.append((l1, l2, new))
+    normalized.sort(reverse=True)
+    for (a1, a2, _), (b1, b2, _) in zip(normalized[1:], normalized):
+        if a2 > b1:
+            return False
+    ranges = []
+    for l1, l2, new in normalized:
+        first = starts[l1]
+        last = starts[l2] - 1 if l2 < count else doc.blockCount() - 1
+        if in_table(last):
+            return False
+        ranges.append((first, last, new))
+    for first, last, new in ranges:
+        replace_blocks(doc, first, last, "\n".join(new))
+    return True
+
+
+def apply_block_record(fragments, record):
+    at = record["at"]
+    fragments[at : at + record["remove"]] = record["blocks"]
+
+
+class _CachedHtml(QtGui.QTextBlockUserData):
+    def __init__(self, generation, length, html):
+        super().__init__()
+        self.generation = generation
+        self.length = length
+        self.html = html
+
+
+# Per-block HTML cache. The fragment of a span is kept in the user data of its
+# first block together with the span length; contentsChange drops the entries
+# of every span it touches, so serializing the board only exports the spans
+# edited since the last call. A change of the default font (which the
+# fragments are relative to) invalidates everything.
+class BlockHtmlCache(QtCore.QObject):
+    # Emitted when a warm() pass has gone through the whole board.
+    warmed = QtCore.pyqtSignal()
+
+    def __init__(self, document, parent=None):
+        super().__init__(parent)
+        self.document = document
+        self.generation = 0
+        self.font_key = document.defaultFont().toString()
+        self.hits = 0
+        self.misses = 0
+        self.is_warm = False
+        self._warm_next = 0
+        self._warm_step = 100
+        self._warm_timer = QtCore.QTimer(self)
+        self._warm_timer.setInterval(0)
+        self._warm_timer.timeout.connect(self._warm_tick)
+        document.contentsChange.connect(self.on_contents_change)
+
+    def on_contents_change(self, position, removed, added):
+        doc = self.document
+        first = doc.findBlock(position)
+        last = doc.findBlock(position + added)
+        if not first.isValid():
+            first = doc.begin()
+        if not last.isValid():
+            last = doc.lastBlock()
+        start = block_span(first)[0]
+        end = block_span(last)[1]
+        # A span that started before the change and used to reach into it
+        # (e.g. a list that has just been split) is stale as well.
+        block = doc.findBlockByNumber(start).previous()
+        while block.isValid() and block.userData() is None:
+            block = block.previous()
+        if block.isValid() and block.blockNumber() + block.userData().length >= start:
+            block.setUserData(None)
+        block = doc.findBlockByNumber(start)
+        while block.isValid() and block.blockNumber() <= end:
+            if block.userData() is not None:
+                block.setUserData(None)
+            block = block.next()
+
+    def _check_font(self):
+        font_key = self.document.defaultFont().toString()
+        if font_key != self.font_key:
+            self.font_key = font_key
+            self.generation += 1
+
+    # Yields (block number, html, span length) for the spans from `block` on.
+    # A valid entry is trusted as is: on_contents_change has dropped every
+    # entry whose span could have changed, so only misses need block_span.
+    def _spans(self, block):
+        doc = self.document
+        while block.isValid():
+            data = block.userData()
+            if isinstance(data, _CachedHtml) and data.generation == self.generation:
+                html, length = data.html, data.length
+                self.hits += 1
+            else:
+                span_first, span_last = block_span(block)
+                length = span_last - span_first
+                html = span_html(doc, span_first, span_last)
+                block.setUserData(_CachedHtml(self.generation, length, html))
+                self.misses += 1
+            yield block.blockNumber(), html, length
+            for _ in range(length + 1):
+                block = block.next()
+
+    def range_fragments(self, first, last):
+        self._check_font()
+        fragments = []
+        for number, html, length in self._spans(self.document.findBlockByNumber(first)):
+            if number > last:
+                break
+            fragments.append(html)
+            fragments.extend([""] * length)
+        return fragments
+
+    # Fills the cache from the event loop, `spans_per_tick` spans at a time,
+    # so the first save after loading does not export the whole board at once.
+    def warm(self, spans_per_tick=100):
+        self._warm_next = 0
+        self._warm_step = spans_per_tick
+        self.is_warm = False
+        self._warm_timer.start()
+
+    def _warm_tick(self):
+        self._check_font()
+        doc = self.document
+        block = doc.findBlockByNumber(self._warm_next)
+        if not block.isValid():
+            self._warm_timer.stop()
+            self.is_warm = True
+            self.warmed.emit()
+            return
+        block = doc.findBlockByNumber(block_span(block)[0])
+        self._warm_next = doc.blockCount()
+        for count, (number, _, length) in enumerate(self._spans(block)):
+            if count >= self._warm_step:
+                self._warm_next = number
+                break
+
+    def fragments(self):
+        return self.range_fragments(0, self.document.blockCount() - 1)
+
+    def html(self):
+        return join_fragments(self.fragments(), self.document)
+
+
+# Turns QTextDocument.contentsChange into block-level records:
+#   {"op": "insert"|"delete"|"replace", "at": n, "remove": k, "blocks": [...]}
+# meaning "replace k blocks starting at block n with these fragments". The
+# changed range is widened to whole tables/lists on both the old and the new
+# side so the fragments list stays consistent with the document.
+class BlockChangeTracker(QtCore.QObject):
+    changed = QtCore.pyqtSignal(dict)
+
+    # With a BlockHtmlCache, create the cache first: its slot has to drop the
+    # stale entries before the tracker reads the changed range.
+    def __init__(self, document, parent=None, cache=None):
+        super().__init__(parent)
+        self.document = document
+        self.cache = cache
+        self.suspended = 0
+        self.reset()
+        document.contentsChange.connect(self.on_contents_change)
+
+    def reset(self):
+        self.spans = document_spans(self.document)
+
+    def suspend(self):
+        self.suspended += 1
+
+    def resume(self, reset=True):
+        self.suspended -= 1
+        if reset and not self.suspended:
+            self.reset()
+
+    def _old_span(self, index):
+        head = index
+        while head > 0 and self.spans[head] == 0:
+            head -= 1
+        return head, head + max(1, self.spans[head]) - 1
+
+    def on_contents_change(self, position, removed, added):
+        if self.suspended:
+            return
+        doc = self.document
+        delta = doc.blockCount() - len(self.spans)
+        first = doc.findBlock(position).blockNumber()
+        last_block = doc.findBlock(position + added)
+        last = last_block.blockNumber() if last_block.isValid() else doc.blockCount() - 1
+        first = max(0, first)
+        while True:
+            new_first = block_span(doc.findBlockByNumber(first))[0]
+            new_last = block_span(doc.findBlockByNumber(last))[1]
+            old_last = min(max(new_last - delta, new_first - 1), len(self.spans) - 1)
+            if self.spans and new_first < len(self.spans):
+                new_first = min(new_first, self._old_span(new_first)[0])
+            if old_last >= new_first:
+                old_last = max(old_last, self._old_span(old_last)[1])
+            new_last = max(new_last, min(old_last + delta, doc.blockCount() - 1))
+            if (new_first, new_last) == (first, last):
+                break
+            first, last = new_first, new_last
+        remove = max(0, last - first + 1 - delta)
+        blocks = range_fragments(doc, first, last, self.cache)
+        self.spans[first : first + remove] = [1 if f else 0 for f in blocks]
+        self._fix_spans(first, len(blocks))
+        if remove == 0:
+            op = "insert"
+        elif not blocks:
+            op = "delete"
+        else:
+            op = "replace"
+        self.changed.emit(
+            {"op": op, "at": first, "remove": remove, "blocks": blocks}
+        )
+
+    # Span lengths inside the replaced range, recomputed from the fragments
+    # (a head is followed by its "" continuation blocks).
+    def _fix_spans(self, start, count):
+        i = start
+        end = start + count
+        while i < end:
+            j = i + 1
+            while j < end and self.spans[j] == 0:
+                j += 1
+            self.spans[i] = j - i
+            i = j
@@ -1,11 +1,16 @@
 # Clipboard functions
-import base64, re, os, requests
+import base64, hashlib, re, os, requests
 from PyQt6 import QtGui, QtCore
 from functions.youtube import show_youtube_preview_dialog, show_youtube_playlist_dialog
+from functions.blobstore import store_inline_images
+from functions.dirsize import placeholder_html
 from urllib.parse import urlparse
 
 
-def has_image(image_data):
+def has_image(image_data, store=None):
+    if store is not None:
+        src = store.put_image(image_data)
+        return f'<img src="{src}" width="{image_data.width()}" height="{image_data.height()}">'
     buffer = QtCore.QBuffer()
     buffer.open(QtCore.QIODevice.OpenModeFlag.WriteOnly)
     image_data.save(buffer, "PNG")
@@ -34,14 +39,37 @@ def get_folder_size(path):
                 pass
     return total_size
 
+# Folder sizes come from the editor's DirSizeScanner when there is one: a
+# placeholder that fills in as the scan goes, instead of walking the folder
+# here on the GUI thread.
+def size_html(self, path):
+    info = QtCore.QFileInfo(path)
+    if not info.isDir():
+        return human_readable_size(info.size())
+    scanner = getattr(self, "dir_scanner", None)
+    if scanner is None:
+        return human_readable_size(get_folder_size(path))
+    return placeholder_html(scanner.scan(path), path, "scanning…")
+
+
+# One line per dropped or copied file: link, path and size.
+def files_html(self, urls, suffix=""):
+    return "<br>".join(
+        f'<a href="{url.toLocalFile()}"> {url.fileName()}</a> {url.toLocalFile() if url.isLocalFile() else "(remote)"} / {size_html(self, url.toLocalFile())}{suffix}'
+        for url in urls
+    )
+
+
 # This function replaces external image URLs in HTML with embedded base64 images.
-def embed_external_images(html):
+def embed_external_images(html, store=None):
     def replacer(match):
         url = match.group(1)
         try:
-            response = requests.get(url)
+            response = requests.get(url, timeout=(3.05, 10))
             if response.ok:
                 img_data = response.content
+                if store is not None:
+                    return f'<img src="{store.url(store.put(img_data))}"'
                 base64_data = base64.b64encode(img_data).decode("utf-8")
                 return f'<img src="data:image/png;base64,{base64_data}"'
         except:
@@ -51,6 +79,14 @@ def embed_external_images(html):
     return re.sub(r'<img\s+[^>]*src="(http[^"]+)"', replacer, html)
 
 
+# External images are left to the editor's ImageFetcher when there is one
+# (placeholders now, images as they arrive), otherwise embedded right away.
+def external_images(html, store=None, fetcher=None):
+    if fetcher is not None:
+        return fetcher.defer_images(html)
+    return embed_external_images(html, store)
+
+
 # This function sanitizes font sizes in HTML, replacing 0px and negative sizes with a default size.
 def sanitize_font_sizes(html):
     html = re.sub(r"font-size\s*:\s*0px", "font-size:10px", html, flags=re.IGNORECASE)
@@ -69,16 +105,17 @@ def clipboard_output(self, clipboard):
     files_data = clipboard.mimeData().urls() if clipboard.mimeData().hasUrls() else None
     text = clipboard.mimeData().text() if clipboard.mimeData().hasText() else None
     image = QtGui.QImage(image_data) if image_data else None
+    store = getattr(self, "blob_store", None)
+    fetcher = getattr(self, "image_fetcher", None)
     self.moveCursor(QtGui.QTextCursor.MoveOperation.End)
     if image_data:
-        content = has_image(image_data)
+        content = has_image(image_data, store)
     elif html_data:
-        content = sanitize_font_sizes(embed_external_images(html_data))
-    elif files_data:
-        content = "<br>".join(
-            f'<a href="{url.toLocalFile()}"> {url.fileName()}</a> {url.toLocalFile() if url.isLocalFile() else "(remote)"} / {(human_readable_size(get_folder_size(url.toLocalFile())) if QtCore.QFileInfo(url.toLocalFile()).isDir() else human_readable_size(QtCore.QFileInfo(url.toLocalFile()).size()))} '
-            for url in files_data
+        content = sanitize_font_sizes(
+            store_inline_images(external_images(html_data, store, fetcher), store)
         )
+    elif files_data:
+        content = files_html(self, files_data, " ")
     else:
         content = clipboard.mimeData().text()
     return content
@@ -87,19 +124,30 @@ def clipboard_output(self, clipboard):
 # This function wraps text in HTML to ensure no line exceeds 80 characters, replacing URLs with shortened links.
 
 
+# Inserts HTML that may hold placeholders (fetched images, folder sizes) and
+# lets the editor track them.
+def _insert_tracked(self, cursor, html):
+    start = cursor.selectionStart()
+    cursor.insertHtml(html)
+    track = getattr(self, "track_placeholders", None)
+    if track is not None:
+        track(start, cursor.position())
+
+
 def insert_to_cursor(self, source, cursor):
+    store = getattr(self, "blob_store", None)
     if source.hasText():
         text = source.text().strip()
         if "youtube.com/playlist" in text or "list=" in text and "yt" in text:
             previews = show_youtube_playlist_dialog(text)
             if previews:
                 for preview in previews:
-                    cursor.insertHtml(preview + "<br>")
+                    cursor.insertHtml(store_inline_images(preview, store) + "<br>")
                 return
         elif "youtube.com/watch" in text or "youtu.be/" in text:
             preview = show_youtube_preview_dialog(text)
             if preview:
-                cursor.insertHtml(preview)
+                cursor.insertHtml(store_inline_images(preview, store))
                 return
         elif "http:" in text or "https:" in text:
             if "?" in text:
@@ -129,32 +177,20 @@ def insert_to_cursor(self, source, cursor):
     if source.hasImage():
         image = QtGui.QImage(source.imageData())
         if not image.isNull():
-            buffer = QtCore.QBuffer()
-            buffer.open(QtCore.QIODevice.OpenModeFlag.WriteOnly)
-            image.save(buffer, "PNG")
-            base64_data = base64.b64encode(buffer.data()).decode("utf-8")
-            html = f'<img src="data:image/png;base64,{base64_data}" width="{image.width()}" height="{image.height()}">'
-            cursor.insertHtml(html)
+            cursor.insertHtml(has_image(image, store))
             return
 
     if source.hasHtml():
         html = source.html()
-        html = embed_external_images(html)
+        html = external_images(html, store, getattr(self, "image_fetcher", None))
+        html = store_inline_images(html, store)
         html = sanitize_font_sizes(html)
-        cursor.insertHtml(html)
+        _insert_tracked(self, cursor, html)
         return
     if source.hasUrls():
         urls = source.urls()
         if urls:
-            content = (
-                "<br>".join(
-                    f'<a href="{url.toLocalFile()}"> {url.fileName()}</a> {url.toLocalFile() if url.isLocalFile() else "(remote)"} / '
-                    f"{human_readable_size(get_folder_size(url.toLocalFile())) if QtCore.QFileInfo(url.toLocalFile()).isDir() else human_readable_size(QtCore.QFileInfo(url.toLocalFile()).size())}"
-                    for url in urls
-                )
-                + "<br>"
-            )
-            cursor.insertHtml(content)
+            _insert_tracked(self, cursor, files_html(self, urls) + "<br>")
         return
     if source.hasText():
         text = source.text()
@@ -163,3 +199,92 @@ def insert_to_cursor(self, source, cursor):
         cursor.insertText(text)
         return
     return source
+
+
+# What the fingerprint covers. With an external clipboard owner every
+# mime.data() call is a conversion or transfer, so only these are read (the
+# formats clipboard_output uses), plus one image payload.
+TEXT_FORMATS = ("text/html", "text/plain", "text/uri-list")
+IMAGE_FORMATS = ("image/png", "image/bmp", "image/jpeg", "image/tiff", "image/gif")
+
+
+def _update(digest, name, data):
+    digest.update(name.encode("utf-8") + b"\0")
+    digest.update(data.size().to_bytes(8, "little"))
+    digest.update(data)
+
+
+# A 16-byte BLAKE2b digest of the clipboard's text formats and its image,
+# hashed once and never kept. The image is hashed from the first encoded
+# payload the owner offers, or from the QImage's pixel buffer in place when
+# there is none (e.g. an image set by this process).
+def clipboard_fingerprint(mime):
+    if mime is None:
+        return None
+    digest = hashlib.blake2b(digest_size=16)
+    formats = set(mime.formats())
+    for fmt in TEXT_FORMATS:
+        if fmt in formats:
+            _update(digest, fmt, mime.data(fmt))
+    if not mime.hasImage():
+        return digest.digest()
+    for fmt in IMAGE_FORMATS:
+        if fmt in formats:
+            data = mime.data(fmt)
+            if data.size():
+                _update(digest, fmt, data)
+                return digest.digest()
+    image = QtGui.QImage(mime.imageData())
+    bits = image.constBits()
+    if bits is not None:
+        bits.setsize(image.sizeInBytes())
+        digest.update(f"image:{image.width()}x{image.height()}:{image.format().value}\0".encode())
+        digest.update(bits)
+    return digest.digest()
+
+
+# Clipboard catch driven by QClipboard.dataChanged: nothing runs while the
+# clipboard is untouched (or while the catcher is off). Apps that publish
+# several formats one after another fire dataChanged for each, so the check
+# runs `delay_ms` after the first notification and sees the final contents;
+# contents whose fingerprint matches the last caught one are skipped. `caught` carries the
+# rendered content (see clipboard_output).
+class ClipboardCatcher(QtCore.QObject):
+    caught = QtCore.pyqtSignal(str)
+
+    def __init__(self, editor, delay_ms=50, parent=None):
+        super().__init__(parent or editor)
+        self.editor = editor
+        self.enabled = False
+        self.last = None
+        self.clipboard = QtGui.QGuiApplication.clipboard()
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay_ms)
+        self.timer.timeout.connect(self.check)
+
+    def set_enabled(self, enabled):
+        if enabled == self.enabled:
+            return
+        self.enabled = enabled
+        if enabled:
+            self.clipboard.dataChanged.connect(self.on_data_changed)
+            # Whatever is on the clipboard when catching starts is caught too.
+            self.last = None
+            self.timer.start()
+        else:
+            self.clipboard.dataChanged.disconnect(self.on_data_changed)
+            self.timer.stop()
+
+    def on_data_changed(self):
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def check(self):
+        if not self.enabled:
+            return
+        fingerprint = clipboard_fingerprint(self.clipboard.mimeData())
+        if fingerprint is None or fingerprint == self.last:
+            return
+        self.last = fingerprint
+        self.caught.emit(clipboard_output(self.editor, self.clipboard))
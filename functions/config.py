@@ -0,0 +1,107 @@
+import os
+from PyQt6 import QtCore
+from functions.persistence import read_json
+
+# Settings with their defaults; the type of the default is the type the value
+# is read back as, whatever ended up in the file.
+DEFAULTS = {
+    "font": "Consolas,15,-1,5,50,0,0,0,0,0",
+    "history_file": "textboard_history.json",
+    "last_search": "",
+    "last_replace_find": "",
+    "last_replace_replace": "",
+    "opacity": 1.0,
+    "disable_transparency": False,
+    "storage_format": "json",
+    "compression": "none",
+    "archive_max_age_days": 7,
+    "archive_max_kb": 4096,
+    "undo_budget_mb": 8,
+    "undo_log_mb": 64,
+    "image_cache_mb": 64,
+    # Theme sources outside Windows (see theme_providers.LinuxThemeProvider).
+    "wallpaper_path": "",
+    "theme_settings_file": "",
+}
+
+
+def _coerce(value, default):
+    if isinstance(default, bool):
+        if isinstance(value, str):
+            return value.strip().lower() in ("1", "true", "yes", "on")
+        return bool(value)
+    return type(default)(value)
+
+
+# The config file held in memory. Setting a value emits `changed` and
+# schedules a write; writes within `delay_ms` of each other are coalesced into
+# one atomic rewrite on the persistence worker, so typing into the search box
+# or holding Alt+Arrow no longer rewrites the file on every step. flush()
+# writes right away (on exit).
+class ConfigStore(QtCore.QObject):
+    changed = QtCore.pyqtSignal(str, object)
+
+    def __init__(self, path, worker, delay_ms=1000, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.worker = worker
+        self.values = {}
+        self.dirty = False
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay_ms)
+        self.timer.timeout.connect(self.flush)
+
+    # Reads the file; a missing file leaves the defaults. Errors are raised to
+    # the caller, the values read so far are kept.
+    def load(self):
+        self.values = {}
+        if os.path.exists(self.path):
+            data = read_json(self.path)
+            if not isinstance(data, dict):
+                raise ValueError(f"{self.path} does not hold a JSON object")
+            self.values = data
+
+    def get(self, key):
+        default = DEFAULTS[key]
+        value = self.values.get(key, default)
+        try:
+            return _coerce(value, default)
+        except (TypeError, ValueError):
+            return default
+
+    def get_str(self, key):
+        return str(self.get(key))
+
+    def get_int(self, key):
+        return int(self.get(key))
+
+    def get_float(self, key):
+        return float(self.get(key))
+
+    def get_bool(self, key):
+        return bool(self.get(key))
+
+    def set(self, key, value):
+        if key not in DEFAULTS:
+            raise KeyError(key)
+        if key in self.values and self.values[key] == value:
+            return
+        self.values[key] = value
+        self.dirty = True
+        self.timer.start()
+        self.changed.emit(key, value)
+
+    def update(self, values):
+        for key, value in values.items():
+            self.set(key, value)
+
+    def flush(self):
+        self.timer.stop()
+        if not self.dirty:
+            return
+        self.dirty = False
+        data = {key: self.get(key) for key in DEFAULTS}
+        # Keys written by newer versions survive a round trip.
+        data.update({k: v for k, v in self.values.items() if k not in DEFAULTS})
+        self.worker.write_json(self.path, data)
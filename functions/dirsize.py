@@ -0,0 +1,257 @@
+import os, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, unquote
+from PyQt6 import QtCore, QtGui
+from functions.blocks import fragment_cursors, selection_format
+
+# Folder sizes for pasted or caught folders, computed off the GUI thread.
+# Directories are listed with os.scandir and every file is stat'ed once
+# through its DirEntry (free on Windows, where the listing already carries
+# it). The folder's first two levels of subdirectories are scanned as separate
+# tasks on a small pool; deeper ones are walked by the task that found them.
+#
+# Each directory's own total (the files directly inside it) and its
+# subdirectories are cached by the directory's mtime, which changes whenever
+# an entry is added, removed or renamed. Rescanning an unchanged tree costs
+# one stat per directory instead of one per file. Files rewritten in place
+# keep the directory's mtime, so their new size is only seen once something
+# else in that directory changes.
+#
+# In the board a size being scanned is a placeholder link,
+# dirsize:<job id>?<quoted path>, holding the size found so far. It is filled
+# in through cursors kept since the paste (see placeholder_cursors), outside
+# undo and at most once per interval; once final it becomes plain text. A
+# placeholder that outlives its scan (the app crashed) names its folder, so
+# the editor can scan it again on the next start.
+
+PLACEHOLDER_PREFIX = "dirsize:"
+# Levels below the scanned folder whose subdirectories get a task of their own.
+SPLIT_DEPTH = 2
+
+
+class DirSizeCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dirs = {}
+
+    # (own bytes, [subdirectory names]) if `path` still has mtime `mtime_ns`.
+    def get(self, path, mtime_ns):
+        with self._lock:
+            entry = self._dirs.get(path)
+        if entry is None or entry[0] != mtime_ns:
+            return None
+        return entry[1], entry[2]
+
+    def put(self, path, mtime_ns, own, subdirs):
+        with self._lock:
+            self._dirs[path] = (mtime_ns, own, subdirs)
+
+
+def _list_dir(path):
+    own, subdirs = 0, []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append((entry.name, entry.stat(follow_symlinks=False).st_mtime_ns))
+                    elif entry.is_file(follow_symlinks=False):
+                        own += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    pass
+    except OSError:
+        pass
+    return own, subdirs
+
+
+class _Job:
+    def __init__(self, job_id, path):
+        self.id = job_id
+        self.path = path
+        self.total = 0
+        self.pending = 0
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self.pending == 0
+
+
+# scan(path) returns a job id; `progress` (id, bytes so far, finished) follows
+# on the GUI thread every `interval_ms` while the job runs and as soon as it
+# ends. A cancelled job reports nothing more.
+class DirSizeScanner(QtCore.QObject):
+    progress = QtCore.pyqtSignal(object, object, bool)
+    _finished = QtCore.pyqtSignal(object)
+
+    def __init__(self, parent=None, max_workers=4, interval_ms=1000, cache=None):
+        super().__init__(parent)
+        self.cache = cache or DirSizeCache()
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix="dirsize")
+        self._jobs = {}
+        # Ids start at the session's start time, so a placeholder left in a
+        # saved board by an earlier session is never taken for a new job.
+        self._next_id = time.time_ns() // 1000000
+        self._timer = QtCore.QTimer(self)
+        self._timer.setInterval(interval_ms)
+        self._timer.timeout.connect(self._report)
+        self._finished.connect(self._finish)
+
+    def scan(self, path):
+        self._next_id += 1
+        job = self._jobs[self._next_id] = _Job(self._next_id, os.path.abspath(path))
+        try:
+            mtime_ns = os.stat(job.path).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        self._submit(job, job.path, mtime_ns, 0)
+        if not self._timer.isActive():
+            self._timer.start()
+        return self._next_id
+
+    # Bytes counted so far, None if the job is not running.
+    def cancel(self, job_id):
+        job = self._jobs.pop(job_id, None)
+        if job is None:
+            return None
+        job.cancelled.set()
+        with job.lock:
+            return job.total
+
+    # Cancels every job; returns {job id: bytes counted so far} of those that
+    # were still running.
+    def stop(self):
+        partial = {job_id: self.cancel(job_id) for job_id in list(self._jobs)}
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        return partial
+
+    def _submit(self, job, path, mtime_ns, depth):
+        with job.lock:
+            job.pending += 1
+        try:
+            self._pool.submit(self._walk, job, path, mtime_ns, depth)
+        except RuntimeError:
+            # Shut down.
+            with job.lock:
+                job.pending -= 1
+
+    def _walk(self, job, path, mtime_ns, depth):
+        try:
+            stack = [(path, mtime_ns, depth)]
+            while stack and not job.cancelled.is_set():
+                path, mtime_ns, depth = stack.pop()
+                cached = self.cache.get(path, mtime_ns) if mtime_ns is not None else None
+                if cached is None:
+                    own, subdirs = _list_dir(path)
+                    if mtime_ns is not None:
+                        self.cache.put(path, mtime_ns, own, [name for name, _ in subdirs])
+                else:
+                    own, names = cached
+                    subdirs = []
+                    for name in names:
+                        try:
+                            subdirs.append((name, os.stat(os.path.join(path, name)).st_mtime_ns))
+                        except OSError:
+                            pass
+                with job.lock:
+                    job.total += own
+                for name, sub_mtime in subdirs:
+                    child = (os.path.join(path, name), sub_mtime, depth + 1)
+                    if depth < SPLIT_DEPTH:
+                        self._submit(job, *child)
+                    else:
+                        stack.append(child)
+        finally:
+            with job.lock:
+                job.pending -= 1
+                done = job.done
+            if done:
+                self._finished.emit(job.id)
+
+    def _finish(self, job_id):
+        job = self._jobs.pop(job_id, None)
+        if job is not None and not job.cancelled.is_set():
+            self.progress.emit(job_id, job.total, True)
+
+    def _report(self):
+        for job_id, job in list(self._jobs.items()):
+            with job.lock:
+                total, done = job.total, job.done
+            if done:
+                del self._jobs[job_id]
+            self.progress.emit(job_id, total, done)
+        if not self._jobs:
+            self._timer.stop()
+
+
+def placeholder_href(job_id, path):
+    return f"{PLACEHOLDER_PREFIX}{job_id}?{quote(path, safe='')}"
+
+
+# (job id, path) of a placeholder href, None for any other link. The path is
+# empty for placeholders saved before it was part of the href.
+def parse_placeholder(href):
+    if not href.startswith(PLACEHOLDER_PREFIX):
+        return None
+    job_id, _, path = href[len(PLACEHOLDER_PREFIX) :].partition("?")
+    try:
+        return int(job_id), unquote(path)
+    except ValueError:
+        return None
+
+
+# Marked as a link because an anchor's href, unlike its name, covers all of
+# its text.
+def placeholder_html(job_id, path, text):
+    return (
+        f'<a href="{placeholder_href(job_id, path)}" style="color: gray; text-decoration: none">'
+        f"{text}</a>"
+    )
+
+
+def _is_placeholder(fmt):
+    return fmt.isAnchor() and parse_placeholder(fmt.anchorHref()) is not None
+
+
+# Placeholders between positions start and end as {job id: [cursors]} (see
+# blocks.fragment_cursors).
+def placeholder_cursors(document, start=0, end=None):
+    found = {}
+    for cursor in fragment_cursors(document, _is_placeholder, start, end):
+        job_id, _ = parse_placeholder(selection_format(cursor).anchorHref())
+        found.setdefault(job_id, []).append(cursor)
+    return found
+
+
+# Replaces the text of the placeholders under `cursors` that still belong to
+# `job_id`, leaving each cursor on the new text for the next update. Once
+# `final`, the marker is dropped and the text stays as plain text. Returns how
+# many were filled; none means the placeholder is gone.
+def update_placeholder(cursors, job_id, text, final=False):
+    filled = 0
+    for cursor in cursors:
+        if not cursor.hasSelection():
+            continue
+        fmt = selection_format(cursor)
+        found = parse_placeholder(fmt.anchorHref()) if fmt.isAnchor() else None
+        if found is None or found[0] != job_id:
+            continue
+        if final:
+            fmt.setAnchor(False)
+            fmt.setAnchorHref("")
+            fmt.clearForeground()
+            fmt.setFontUnderline(False)
+        start = cursor.selectionStart()
+        cursor.insertText(text, fmt)
+        cursor.setPosition(start, QtGui.QTextCursor.MoveMode.KeepAnchor)
+        filled += 1
+    return filled
+
+
+# Points the placeholders under `cursors` at a new job.
+def retarget_placeholder(cursors, job_id, path):
+    fmt = QtGui.QTextCharFormat()
+    fmt.setAnchorHref(placeholder_href(job_id, path))
+    for cursor in cursors:
+        cursor.mergeCharFormat(fmt)
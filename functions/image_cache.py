@@ -0,0 +1,190 @@
+import hashlib, json, os, threading
+from collections import OrderedDict
+from functions.persistence import write_atomic
+
+# Bytes of fetched external images, kept across sessions so the same picture
+# copied again (a page copied twice, an avatar in every snippet) is not
+# downloaded again. Entries are keyed by URL and remember the ETag and
+# Last-Modified the server sent; ImageFetcher revalidates them with a
+# conditional request and only downloads on a change. The least recently used
+# entries are evicted once the files add up to more than `max_bytes`. Hit,
+# miss, revalidation and eviction counts are kept with the index (see stats());
+# every request the cache does not serve, failed ones included, is a miss.
+# The index is written by the persistence worker, which drops snapshots a
+# newer one supersedes, so fetch threads never wait on the disk for it. An
+# index that cannot be read, or does not look like one, starts the cache over.
+#
+#   <root>/index.json          {"entries": [[url, meta], ...] oldest first,
+#                               "stats": {...}}
+#   <root>/<2 hex>/<sha256 of url>
+
+STATS = ("hits", "misses", "revalidated", "evictions")
+
+
+def image_cache_dir():
+    return os.path.join(os.path.expanduser("~"), ".cache_desktop_textboard_images")
+
+
+def _valid_entry(entry):
+    if not (isinstance(entry, list) and len(entry) == 2):
+        return False
+    url, meta = entry
+    return (
+        isinstance(url, str)
+        and isinstance(meta, dict)
+        and isinstance(meta.get("key"), str)
+        and len(meta["key"]) == 64
+        and isinstance(meta.get("size"), int)
+        and meta["size"] >= 0
+        and all(isinstance(meta.get(k), (str, type(None))) for k in ("etag", "last_modified"))
+    )
+
+
+class ImageCache:
+    def __init__(self, root, max_bytes=64 * 1024 * 1024, worker=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.worker = worker
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stats = dict.fromkeys(STATS, 0)
+        self._total = 0
+        self._load()
+
+    def index_path(self):
+        return os.path.join(self.root, "index.json")
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def _load(self):
+        try:
+            with open(self.index_path(), "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return
+        if not isinstance(index, dict):
+            return
+        entries = index.get("entries", [])
+        stats = index.get("stats", {})
+        if not isinstance(entries, list) or not all(_valid_entry(e) for e in entries):
+            return
+        if isinstance(stats, dict):
+            for name in STATS:
+                if isinstance(stats.get(name), int):
+                    self._stats[name] = stats[name]
+        for url, meta in entries:
+            if os.path.exists(self.path(meta["key"])):
+                self._entries[url] = meta
+                self._total += meta["size"]
+
+    # (data, meta) for `url`, None if it is not cached. Marks it as used.
+    def get(self, url):
+        with self._lock:
+            meta = self._entries.get(url)
+            if meta is None:
+                return None
+            self._entries.move_to_end(url)
+            meta = dict(meta)
+        try:
+            with open(self.path(meta["key"]), "rb") as f:
+                return f.read(), meta
+        except OSError:
+            with self._lock:
+                if self._entries.pop(url, None) is not None:
+                    self._total -= meta["size"]
+            self._save()
+            return None
+
+    # Headers that ask the server whether `meta`'s copy is still current.
+    @staticmethod
+    def validators(meta):
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    # Counts one request: served from the cache ("hit"), after a 304
+    # ("revalidated"), or not at all (None, a miss).
+    def record(self, served):
+        with self._lock:
+            if served is None:
+                self._stats["misses"] += 1
+            else:
+                self._stats["hits"] += 1
+                if served == "revalidated":
+                    self._stats["revalidated"] += 1
+        self._save()
+
+    def put(self, url, data, etag=None, last_modified=None):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_atomic(path, lambda f: f.write(data), binary=True)
+        with self._lock:
+            old = self._entries.pop(url, None)
+            if old is not None:
+                self._total -= old["size"]
+            self._entries[url] = {
+                "key": key,
+                "size": len(data),
+                "etag": etag,
+                "last_modified": last_modified,
+            }
+            self._total += len(data)
+            evicted = self._evict()
+        self._remove(evicted)
+        self._save()
+
+    def set_max_bytes(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            evicted = self._evict()
+        self._remove(evicted)
+        self._save()
+
+    # Drops least recently used entries down to the budget; returns their
+    # keys. The newest entry stays even if it alone is over budget.
+    def _evict(self):
+        evicted = []
+        while self._total > self.max_bytes and len(self._entries) > 1:
+            _, meta = self._entries.popitem(last=False)
+            self._total -= meta["size"]
+            self._stats["evictions"] += 1
+            evicted.append(meta["key"])
+        return evicted
+
+    def _remove(self, keys):
+        for key in keys:
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(entries=len(self._entries), bytes=self._total, max_bytes=self.max_bytes)
+        return stats
+
+    def _save(self):
+        with self._lock:
+            index = {
+                "entries": [[url, dict(meta)] for url, meta in self._entries.items()],
+                "stats": dict(self._stats),
+            }
+        path = self.index_path()
+
+        def write():
+            os.makedirs(self.root, exist_ok=True)
+            write_atomic(path, lambda f: json.dump(index, f, separators=(",", ":")))
+
+        if self.worker is not None:
+            self.worker.submit(path, write)
+            return
+        try:
+            write()
+        except OSError:
+            pass
@@ -0,0 +1,211 @@
+import html, re, threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import requests
+from PyQt6 import QtCore, QtGui
+from functions.blocks import fragment_cursors, selection_format
+
+# External images in pasted HTML are fetched in the background. The paste is
+# inserted right away with <img src="fetch:<original url>">, which the editor
+# draws as a placeholder; a bounded pool downloads the images (a few at a time
+# per host, with connect and read timeouts) and each one is swapped for its
+# blob: copy as soon as it arrives. A failed image gets its original URL back.
+# A placeholder still in the board after a restart is fetched again when the
+# editor first draws it. With an ImageCache (see image_cache.py) known URLs
+# are revalidated instead of downloaded, and served from disk if the server
+# cannot be reached.
+
+FETCH_SCHEME = "fetch"
+_EXTERNAL_IMG = re.compile(r'(<img\s+[^>]*src=")(https?:[^"]+)(")', re.IGNORECASE)
+
+
+def placeholder_image(size=48):
+    image = QtGui.QImage(size, size, QtGui.QImage.Format.Format_ARGB32)
+    image.fill(QtGui.QColor(128, 128, 128, 60))
+    painter = QtGui.QPainter(image)
+    painter.setPen(QtGui.QPen(QtGui.QColor(128, 128, 128, 160), 1, QtCore.Qt.PenStyle.DashLine))
+    painter.drawRect(0, 0, size - 1, size - 1)
+    painter.end()
+    return image
+
+
+def placeholder_url(name):
+    return name[len(FETCH_SCHEME) + 1 :]
+
+
+def _key(name):
+    return QtCore.QUrl(name).toString()
+
+
+def _is_placeholder(fmt):
+    return fmt.isImageFormat() and fmt.toImageFormat().name().startswith(FETCH_SCHEME + ":")
+
+
+# Placeholder images between positions start and end, as {placeholder name:
+# [cursors]} (see blocks.fragment_cursors); found once when a paste goes in,
+# so an arriving image does not have to look through the whole board.
+def placeholder_cursors(document, start=0, end=None):
+    found = {}
+    for cursor in fragment_cursors(document, _is_placeholder, start, end):
+        name = _key(selection_format(cursor).toImageFormat().name())
+        found.setdefault(name, []).append(cursor)
+    return found
+
+
+# Points the placeholder images under `cursors` that are still named `old` at
+# `new`, keeping their size and other attributes. Names are compared as URLs,
+# since Qt may normalize them.
+def swap_placeholder(cursors, old, new):
+    old = _key(old)
+    swapped = 0
+    for cursor in cursors:
+        if not cursor.hasSelection():
+            continue
+        fmt = selection_format(cursor)
+        if not fmt.isImageFormat() or _key(fmt.toImageFormat().name()) != old:
+            continue
+        image = fmt.toImageFormat()
+        image.setName(new)
+        cursor.setCharFormat(image)
+        swapped += 1
+    return swapped
+
+
+# The same over the whole document, for placeholders nobody tracked (left in a
+# saved board, or brought back by an undo).
+def replace_image_source(document, old, new):
+    return swap_placeholder(placeholder_cursors(document).get(_key(old), []), old, new)
+
+
+class ImageFetcher(QtCore.QObject):
+    # (url, data) on success, (url, reason) on failure; on the GUI thread.
+    fetched = QtCore.pyqtSignal(str, bytes)
+    failed = QtCore.pyqtSignal(str, str)
+
+    def __init__(
+        self,
+        parent=None,
+        max_workers=8,
+        per_host=2,
+        timeout=(3.05, 10),
+        max_bytes=32 * 1024 * 1024,
+        cache=None,
+    ):
+        super().__init__(parent)
+        self.cache = cache
+        self.per_host = per_host
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix="image-fetch")
+        self._lock = threading.Lock()
+        # Per host: URLs being fetched, and URLs waiting for one of them to end.
+        self._active = {}
+        self._queued = {}
+        self._running = set()
+        self._local = threading.local()
+
+    # Rewrites external <img> sources in `html` to placeholders and starts
+    # fetching them.
+    def defer_images(self, html_text):
+        def replacer(match):
+            url = html.unescape(match.group(2))
+            self.request(url)
+            return f"{match.group(1)}{FETCH_SCHEME}:{match.group(2)}{match.group(3)}"
+
+        return _EXTERNAL_IMG.sub(replacer, html_text)
+
+    # Only `per_host` URLs of a host are handed to the pool at a time, the rest
+    # wait in that host's queue, so a page full of images from one server
+    # never ties up the workers other hosts' images could use.
+    def request(self, url):
+        host = urlparse(url).netloc.lower()
+        with self._lock:
+            if url in self._running:
+                return
+            self._running.add(url)
+            if self._active.get(host, 0) >= self.per_host:
+                self._queued.setdefault(host, deque()).append(url)
+                return
+            self._active[host] = self._active.get(host, 0) + 1
+        self._submit(url)
+
+    def _submit(self, url):
+        try:
+            self._pool.submit(self._run, url)
+        except RuntimeError:
+            # Shut down.
+            with self._lock:
+                self._running.discard(url)
+
+    def stop(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    # (data, how the cache served it: "hit", "revalidated" or None).
+    def _download(self, url):
+        cached = self.cache.get(url) if self.cache is not None else None
+        headers = self.cache.validators(cached[1]) if cached else {}
+        if cached and not headers:
+            # Nothing to revalidate with; the copy is as good as it gets.
+            return cached[0], "hit"
+        try:
+            response = self._session().get(url, headers=headers, timeout=self.timeout, stream=True)
+        except requests.RequestException:
+            if not cached:
+                raise
+            return cached[0], "hit"
+        with response:
+            if response.status_code == 304 and cached:
+                return cached[0], "revalidated"
+            response.raise_for_status()
+            chunks, size = [], 0
+            for chunk in response.iter_content(64 * 1024):
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise ValueError("image too large")
+                chunks.append(chunk)
+        data = b"".join(chunks)
+        if QtGui.QImage.fromData(data).isNull():
+            raise ValueError("not an image")
+        if self.cache is not None:
+            try:
+                self.cache.put(
+                    url,
+                    data,
+                    response.headers.get("ETag"),
+                    response.headers.get("Last-Modified"),
+                )
+            except OSError:
+                pass
+        return data, None
+
+    def _run(self, url):
+        served = None
+        try:
+            data, served = self._download(url)
+        except Exception as e:
+            self.failed.emit(url, str(e))
+        else:
+            self.fetched.emit(url, data)
+        finally:
+            if self.cache is not None:
+                self.cache.record(served)
+            host = urlparse(url).netloc.lower()
+            with self._lock:
+                self._running.discard(url)
+                queue = self._queued.get(host)
+                following = queue.popleft() if queue else None
+                if not queue:
+                    self._queued.pop(host, None)
+                if following is None:
+                    self._active[host] -= 1
+                    if not self._active[host]:
+                        del self._active[host]
+            if following is not None:
+                self._submit(following)
@@ -0,0 +1,130 @@
+import json, os
+from datetime import datetime
+from PyQt6 import QtCore, QtGui
+from functions.blocks import apply_block_record, document_fragments, join_fragments
+from functions.persistence import file_lock, write_atomic, write_json_atomic
+
+
+def journal_path_for(history_file):
+    return history_file + ".journal"
+
+
+def append_lines(path, text):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# Reads journal records newer than `after_seq`. A torn last line (crash in the
+# middle of an append) is ignored.
+def read_journal(path, after_seq=0):
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if record.get("seq", 0) > after_seq:
+                records.append(record)
+    return records
+
+
+# Checkpoint `data` as written by save_file/compact plus the journal tail.
+# Returns (html, fragments, seq, replayed, pending). Safe off the GUI thread:
+# a checkpoint saved without its fragments needs a QTextDocument to be split
+# into blocks, so it comes back as is with its tail in `pending`, for
+# finish_replay() on the GUI thread.
+def replay_journal(data, journal_path):
+    seq = data.get("seq", 0)
+    records = read_journal(journal_path, seq)
+    fragments = data.get("blocks")
+    if fragments is None:
+        return data.get("text", ""), None, seq, 0, records
+    for record in records:
+        apply_block_record(fragments, record)
+        seq = record["seq"]
+    return join_fragments(fragments), fragments, seq, len(records), []
+
+
+# Applies `records` to checkpoint `html`; GUI thread only. Returns (html,
+# fragments, seq).
+def finish_replay(html, records):
+    doc = QtGui.QTextDocument()
+    doc.setHtml(html)
+    fragments = document_fragments(doc)
+    for record in records:
+        apply_block_record(fragments, record)
+    return join_fragments(fragments), fragments, records[-1]["seq"]
+
+
+# Append-only persistence: every block-level change from the tracker becomes a
+# journal record, flushed by the autosaver in one append+fsync. After
+# `compact_every` records the whole board is written as a checkpoint into the
+# history file and the journal is truncated.
+class BoardJournal(QtCore.QObject):
+    def __init__(
+        self, editor, history_file, worker, seq=0, compact_every=500, compression="none"
+    ):
+        super().__init__(editor)
+        self.editor = editor
+        self.history_file = history_file
+        self.compression = compression
+        self.journal_path = journal_path_for(history_file)
+        self.worker = worker
+        self.seq = seq
+        self.compact_every = compact_every
+        self.pending = []
+        self.since_checkpoint = 0
+
+    def attach(self, tracker):
+        tracker.changed.connect(self.on_change)
+
+    def detach(self, tracker):
+        tracker.changed.disconnect(self.on_change)
+
+    def on_change(self, record):
+        self.seq += 1
+        self.pending.append(dict(record, seq=self.seq))
+
+    def flush(self):
+        if self.pending:
+            text = "".join(
+                json.dumps(r, ensure_ascii=False) + "\n" for r in self.pending
+            )
+            self.since_checkpoint += len(self.pending)
+            self.pending = []
+            path = self.journal_path
+            history_file = self.history_file
+
+            def append():
+                with file_lock(history_file):
+                    append_lines(path, text)
+
+            self.worker.submit(None, append, path=path)
+        if self.since_checkpoint >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        self.pending = []
+        self.since_checkpoint = 0
+        data = {
+            "blocks": document_fragments(self.editor.document(), self.editor.block_cache),
+            "seq": self.seq,
+            "format": "journal",
+            "last_updated": datetime.now().isoformat(),
+            "app_version": "2.0",
+        }
+        history_file = self.history_file
+        journal_path = self.journal_path
+        compression = self.compression
+
+        def write_checkpoint():
+            with file_lock(history_file):
+                write_json_atomic(history_file, data, compression)
+                write_atomic(journal_path, lambda f: None)
+
+        self.worker.submit(history_file, write_checkpoint)
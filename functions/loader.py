@@ -0,0 +1,148 @@
+import threading
+from PyQt6 import QtCore, QtGui, QtWidgets
+from functions.blocks import SENTINEL
+
+
+# Loads the board without blocking startup. `read` runs on a worker thread and
+# returns a dict with the board's "head" and top-level "units" (see
+# blocks.split_html) plus whatever the caller needs afterwards. The first
+# `first_units` units are shown with setHtml; the rest is appended from the
+# event loop, about `chunk_bytes` of HTML per tick, so the editor stays usable
+# while the tail is loading. `finished` carries the dict (None on error).
+# `prepare`, if given, gets the dict on the GUI thread before anything is
+# shown and returns the one to show, for work that needs a QTextDocument.
+class BoardLoader(QtCore.QObject):
+    parsed = QtCore.pyqtSignal()
+    finished = QtCore.pyqtSignal(object)
+
+    def __init__(self, editor, read, first_units=80, chunk_bytes=64 * 1024, prepare=None):
+        super().__init__(editor)
+        self.editor = editor
+        self.read = read
+        self.prepare = prepare
+        self.first_units = first_units
+        self.chunk_bytes = chunk_bytes
+        self.result = None
+        self.error = None
+        self.units = []
+        self.head = ""
+        self.tail = ""
+        self.next_unit = 0
+        self.total_bytes = 0
+        self.loaded_bytes = 0
+        self.shown = False
+        self.done = False
+        # Set when the user edits the board before it has finished loading.
+        self.user_edited = False
+        self._appending = False
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self.append_chunk)
+        self.progress = QtWidgets.QProgressBar(editor)
+        self.progress.setTextVisible(False)
+        self.progress.setFixedHeight(4)
+        self.progress.setRange(0, 1000)
+        self.progress.hide()
+        self.parsed.connect(self.show_first)
+        editor.document().contentsChanged.connect(self._on_contents_changed)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        try:
+            self.result = self.read()
+        except Exception as e:
+            self.error = str(e)
+        self.parsed.emit()
+
+    def _on_contents_changed(self):
+        if not self._appending:
+            self.user_edited = True
+
+    def show_first(self):
+        if self.shown:
+            return
+        self.shown = True
+        if self.error is None and self.prepare is not None:
+            try:
+                self.result = self.prepare(self.result)
+            except Exception as e:
+                self.error = str(e)
+        if self.error is not None:
+            self.editor.setHtml(
+                f"<p style='color: red;'>Error loading file: {self.error}</p>"
+            )
+            self.result = None
+            self._finish()
+            return
+        self.head = self.result["head"]
+        self.tail = "</body></html>" if self.head else ""
+        self.units = self.result["units"]
+        first = self.units[: self.first_units]
+        self._appending = True
+        self.editor.setHtml(self.head + "\n".join(first) + self.tail)
+        self._appending = False
+        self.next_unit = len(first)
+        if self.next_unit >= len(self.units):
+            self._finish()
+            return
+        # Undo would otherwise record every appended chunk.
+        self.editor.document().setUndoRedoEnabled(False)
+        self.total_bytes = sum(len(u) for u in self.units[self.next_unit :])
+        self._place_progress()
+        self.progress.show()
+        self.timer.start()
+
+    def append_chunk(self, limit=None):
+        limit = self.chunk_bytes if limit is None else limit
+        end = self.next_unit
+        size = 0
+        while end < len(self.units) and (size < limit or end == self.next_unit):
+            size += len(self.units[end])
+            end += 1
+        # The chunk is glued onto the last block with a sentinel paragraph
+        # (see blocks.SENTINEL).
+        html = self.head + "<p>" + SENTINEL + "</p>\n"
+        html += "\n".join(self.units[self.next_unit : end]) + self.tail
+        cursor = QtGui.QTextCursor(self.editor.document())
+        cursor.movePosition(QtGui.QTextCursor.MoveOperation.End)
+        start = cursor.position()
+        self._appending = True
+        cursor.insertFragment(QtGui.QTextDocumentFragment.fromHtml(html))
+        cursor.setPosition(start)
+        cursor.setPosition(start + 1, QtGui.QTextCursor.MoveMode.KeepAnchor)
+        if cursor.selectedText() == SENTINEL:
+            cursor.removeSelectedText()
+        self._appending = False
+        self.next_unit = end
+        self.loaded_bytes += size
+        self.progress.setValue(int(1000 * self.loaded_bytes / max(1, self.total_bytes)))
+        self._place_progress()
+        if self.next_unit >= len(self.units):
+            self._finish()
+
+    def _place_progress(self):
+        self.progress.setGeometry(
+            0, self.editor.height() - 4, self.editor.width(), 4
+        )
+
+    # Loads whatever is left right now; used before anything that needs the
+    # whole board (an explicit save, closing, switching storage).
+    def finish_now(self):
+        if self.done:
+            return
+        self._thread.join()
+        self.show_first()
+        if not self.done:
+            self.append_chunk(limit=float("inf"))
+
+    def _finish(self):
+        self.done = True
+        self.timer.stop()
+        self.editor.document().contentsChanged.disconnect(self._on_contents_changed)
+        self.progress.hide()
+        self.progress.deleteLater()
+        self.editor.document().setUndoRedoEnabled(True)
+        self.finished.emit(self.result)
@@ -1,12 +1,13 @@
 from PyQt6 import QtCore, QtGui, QtWidgets
-from functions.wallpaper_color import get_desktop_base_color, windows_is_dark_mode
+from functions.theme import shared_theme
+from functions.persistence import available_compressions
+from functions.tray_icon import TrayIconRenderer
+from functions.clipboard import human_readable_size
 import ctypes
 class FindReplaceDialog(QtWidgets.QDialog):
     def __init__(self, parent, editor=None, mode="search"):
         super().__init__(parent)
-        self._style_timer = QtCore.QTimer(self)
-        self._style_timer.timeout.connect(self.update_style)
-        self._style_timer.start(3000)
+        shared_theme().changed.connect(self.update_style)
 
         resolved_editor = None
         if editor and hasattr(editor, "document") and callable(getattr(editor, "document")):
@@ -104,22 +105,20 @@ class FindReplaceDialog(QtWidgets.QDialog):
         if self.mode == "replace":
             self.input_replace.textChanged.connect(self._persist_replace_text)
 
-        if hasattr(self.editor, "_last_search"):
-            self.input_find.setText(self.editor._last_search)
-        if self.mode == "replace" and hasattr(self.editor, "_last_replace_replace"):
-            self.input_replace.setText(self.editor._last_replace_replace)
+        self.config = getattr(self.editor, "config", None)
+        if self.config is not None:
+            self.input_find.setText(self.config.get_str("last_search"))
+            if self.mode == "replace":
+                self.input_replace.setText(self.config.get_str("last_replace_replace"))
 
+    # The ConfigStore coalesces these into one write once typing stops.
     def _persist_find_text(self):
-        if hasattr(self.editor, "_last_search"):
-            self.editor._last_search = self.input_find.text()
-        if hasattr(self.editor, "save_config"):
-            self.editor.save_config()
+        if self.config is not None:
+            self.config.set("last_search", self.input_find.text())
 
     def _persist_replace_text(self):
-        if hasattr(self.editor, "_last_replace_replace"):
-            self.editor._last_replace_replace = self.input_replace.text()
-        if hasattr(self.editor, "save_config"):
-            self.editor.save_config()
+        if self.config is not None:
+            self.config.set("last_replace_replace", self.input_replace.text())
 
     def _handle_return(self):
         modifiers = QtWidgets.QApplication.keyboardModifiers()
@@ -240,12 +239,9 @@ class FindReplaceDialog(QtWidgets.QDialog):
         self.focus_input()
 
     def closeEvent(self, event):
-        if hasattr(self.editor, "_last_search"):
-            self.editor._last_search = self.input_find.text()
-        if self.mode == "replace" and hasattr(self.editor, "_last_replace_replace"):
-            self.editor._last_replace_replace = self.input_replace.text()
-        if hasattr(self.editor, "save_config"):
-            self.editor.save_config()
+        self._persist_find_text()
+        if self.mode == "replace":
+            self._persist_replace_text()
         super().closeEvent(event)
         if self._restore_focus_widget:
             QtCore.QTimer.singleShot(0, self._restore_focus_widget.setFocus)
@@ -255,90 +251,9 @@ class FindReplaceDialog(QtWidgets.QDialog):
             QtCore.QTimer.singleShot(0, self._restore_focus_widget.setFocus)
 
     def update_style(self):
-        desktop_color = get_desktop_base_color()
-        is_dark_mode = windows_is_dark_mode()
-        red = desktop_color.red()
-        green = desktop_color.green()
-        blue = desktop_color.blue()
-
-        new_style_key = (red, green, blue, is_dark_mode)
-        if getattr(self, "_last_style_key", None) == new_style_key:
-            return
-        self._last_style_key = new_style_key
-
-        if is_dark_mode:
-            self.setAttribute(QtCore.Qt.WidgetAttribute.WA_TranslucentBackground, True)
-            border_color = "rgba(255, 255, 255, 0.2)"
-            self.setStyleSheet(f"""
-                QDialog {{
-                    background: rgba({red}, {green}, {blue}, 0.88);
-                    border-radius: 6px;
-                    border: 1px solid {border_color};
-                }}
-
-                QLineEdit {{
-                    background: #222;
-                    color: #fff;
-                    border: none;
-                    padding: 4px 8px;
-                    min-width: 120px;
-                }}
-                QPushButton {{
-                    background: transparent;
-                    border: none;
-                    min-width: 24px;
-                    min-height: 24px;
-                }}
-                QPushButton:hover {{
-                    background-color: #444;
-                    border-radius: 4px;
-                }}
-                QtWidgets.QLabel{{
-                    color: rgba(255, 255, 255, 0.8);
-                    min-width: 48px;
-                }}
-                QtWidgets.QLabel:hover {{
-                    color: rgba(255, 255, 255, 1.0);
-                    min-width: 48px;
-                }}
-
-            """)
-        else:
-            self.setAttribute(QtCore.Qt.WidgetAttribute.WA_TranslucentBackground, False)
-            border_color = "rgba(0, 0, 0, 0.2)"
-            self.setStyleSheet(f"""
-                QDialog {{
-                    background: rgb(255, 255, 255);
-                    border-radius: 6px;
-                    border: 1px solid {border_color};
-                }}
-                QLineEdit {{
-                    background: #fff;
-                    color: #000;
-                    border: 1px solid #ccc;
-                    padding: 4px 8px;
-                    min-width: 120px;
-                }}
-                QPushButton {{
-                    background: transparent;
-                    border: none;
-                    min-width: 24px;
-                    min-height: 24px;
-                }}
-                QPushButton:hover {{
-                    background-color: #ddd;
-                    border-radius: 4px;
-                }}
-                QtWidgets.QLabel{{
-                    color: rgba(255, 255, 255, 0.8);
-                    min-width: 48px;
-                }}
-                QtWidgets.QLabel:hover {{
-                    color: rgba(0, 0, 0, 0.8);
-                    min-width: 48px;
-                }}
-            """)
-
+        theme = shared_theme()
+        self.setAttribute(QtCore.Qt.WidgetAttribute.WA_TranslucentBackground, theme.dark)
+        self.setStyleSheet(theme.stylesheet("dialog"))
 
     def eventFilter(self, obj, event):
         if obj == self.input_find and hasattr(self, "opacity_effect_find"):
@@ -375,41 +290,26 @@ class TrayManager(QtWidgets.QSystemTrayIcon):
     def __init__(self, editor, parent=None):
         super().__init__(parent)
         self.editor = editor
+        editor.tray = self
         self.clipboard_action = None
-        self.create_icon(show_red_dot=self.editor.is_clipboard_catch_enabled())
+        self.icons = TrayIconRenderer()
+        self.update_icon()
+        editor.activity.changed.connect(self.update_icon)
         self.create_menu()
         self.setup_signals()
         self.show()
 
-    def create_icon(self, show_red_dot=False, change_color_to_gray=False):
-        pixmap = QtGui.QPixmap(32, 32)
-        pixmap.fill(QtCore.Qt.GlobalColor.transparent)
-        painter = QtGui.QPainter(pixmap)
-        painter.setRenderHint(QtGui.QPainter.RenderHint.Antialiasing)
-        painter.setPen(QtGui.QPen(QtCore.Qt.GlobalColor.green, 4))
-        painter.setBrush(QtGui.QBrush(QtCore.Qt.GlobalColor.darkGreen))
-        painter.drawRect(4, 4, 24, 24)
-        if show_red_dot:
-            painter.setPen(QtCore.Qt.PenStyle.NoPen)
-            painter.setBrush(QtGui.QBrush(QtCore.Qt.GlobalColor.red))
-            painter.drawEllipse(11, 11, 10, 10)
-        painter.end()
-        self.setIcon(QtGui.QIcon(pixmap))
-        if self.editor.show_raw:
-            gray_pixmap = pixmap.toImage().convertToFormat(
-                QtGui.QImage.Format.Format_ARGB32
-            )
-            for x in range(gray_pixmap.width()):
-                for y in range(gray_pixmap.height()):
-                    color = gray_pixmap.pixelColor(x, y)
-                    gray_color = QtGui.QColor(
-                        color.red() // 2, color.green() // 2, color.blue() // 2
-                    )
-                    gray_pixmap.setPixelColor(x, y, gray_color)
-            self.setIcon(QtGui.QIcon(QtGui.QPixmap.fromImage(gray_pixmap)))
-
+    # The icon follows the clipboard catch toggle, raw mode and the editor's
+    # activity (snippet running, upload, unsaved edits); every variant is
+    # prerendered, so this is a lookup.
     def update_icon(self):
-        self.create_icon(show_red_dot=self.editor.is_clipboard_catch_enabled())
+        self.setIcon(
+            self.icons.icon(
+                self.editor.is_clipboard_catch_enabled(),
+                self.editor.show_raw,
+                self.editor.activity.active(),
+            )
+        )
 
     def toggle_clipboard_catch(self):
         enabled = not self.editor.is_clipboard_catch_enabled()
@@ -430,21 +330,33 @@ class TrayManager(QtWidgets.QSystemTrayIcon):
         self.show_raw_action.triggered.connect(self.toggle_show_raw)
         self.show_raw_action.hovered.connect(self.handle_show_raw_hover)
         menu.addSeparator()
+        versions_action = menu.addAction("🕒 Versions")
+        versions_action.triggered.connect(self.editor.timeline.show)
+        undo_history_action = menu.addAction("↶ Undo history")
+        undo_history_action.triggered.connect(self.editor.show_undo_history)
         settings_action = menu.addAction("⚙️ Settings")
         settings_action.triggered.connect(self.show_settings)
         menu.addSeparator()
         exit_action = menu.addAction("❌ Exit")
         exit_action.triggered.connect(self.exit_app)
+        self.menu = menu
+        self.update_menu_style()
+        shared_theme().changed.connect(self.update_menu_style)
         self.setContextMenu(menu)
 
+    def update_menu_style(self):
+        self.menu.setStyleSheet(shared_theme().stylesheet("menu"))
+
     def toggle_show_raw(self):
         self.editor.set_show_raw(not self.editor.show_raw)
         self.show_raw_action.setChecked(self.editor.show_raw)
+        self.update_icon()
 
     def handle_show_raw_hover(self):
         if ctypes.windll.user32.GetAsyncKeyState(0x02):
             self.editor.set_show_raw(False)
             self.show_raw_action.setChecked(False)
+            self.update_icon()
 
     def setup_signals(self):
         self.activated.connect(self.on_tray_activated)
@@ -461,7 +373,18 @@ class TrayManager(QtWidgets.QSystemTrayIcon):
         dlg = SettingsDialog(self.editor, self.editor.font(), self.editor.history_file)
         if dlg.exec():
             self.editor.setFont(dlg.font)
-            self.editor.history_file = dlg.path_edit.text()
+            self.editor.set_history_file(dlg.path_edit.text())
+            self.editor.compression = dlg.compression_combo.currentData()
+            self.editor.set_storage_format(dlg.storage_combo.currentData())
+            self.editor.archive_max_age_days = dlg.archive_age_spin.value()
+            self.editor.archive_max_kb = dlg.archive_size_spin.value()
+            self.editor.archive.max_age_days = self.editor.archive_max_age_days
+            self.editor.archive.max_live_kb = self.editor.archive_max_kb
+            self.editor.image_cache_mb = dlg.image_cache_spin.value()
+            if self.editor.image_fetcher.cache is not None:
+                self.editor.image_fetcher.cache.set_max_bytes(
+                    self.editor.image_cache_mb * 1024 * 1024
+                )
             self.editor.save_config(font=dlg.font, history_file=dlg.path_edit.text())
 
     def on_tray_activated(self, reason):
@@ -469,8 +392,12 @@ class TrayManager(QtWidgets.QSystemTrayIcon):
             self.toggle_editor_visibility()
 
     def exit_app(self):
-        self.editor.save_file()
+        self.editor.stop_dir_sizes()
+        self.editor.flush_file()
         self.editor.save_config()
+        self.editor.config.flush()
+        self.editor.persistence.flush()
+        self.editor.image_fetcher.stop()
         QtWidgets.QApplication.quit()
 
     def get_clipboard_action_label(self):
@@ -480,6 +407,16 @@ class TrayManager(QtWidgets.QSystemTrayIcon):
             else "Enable Clipboard Catch"
         )
     
+def image_cache_summary(stats):
+    requests = stats["hits"] + stats["misses"]
+    rate = f"{100 * stats['hits'] / requests:.0f}%" if requests else "-"
+    return (
+        f"{human_readable_size(stats['bytes'])} in {stats['entries']} images, "
+        f"{stats['hits']} hits / {stats['misses']} misses ({rate}), "
+        f"{stats['revalidated']} revalidated, {stats['evictions']} evicted"
+    )
+
+
 class SettingsDialog(QtWidgets.QDialog):
     def __init__(self, parent, current_font, current_history_file):
         super().__init__(parent)
@@ -509,6 +446,42 @@ class SettingsDialog(QtWidgets.QDialog):
         path_layout.addWidget(self.path_edit)
         path_layout.addWidget(self.browse_button)
         layout.addRow("Save File Location:", path_layout)
+        self.storage_combo = QtWidgets.QComboBox()
+        self.storage_combo.addItem("JSON snapshot", "json")
+        self.storage_combo.addItem("Block journal", "journal")
+        self.storage_combo.addItem("SQLite database", "sqlite")
+        self.storage_combo.setCurrentIndex(
+            max(0, self.storage_combo.findData(getattr(parent, "storage_format", "json")))
+        )
+        layout.addRow("Storage Format:", self.storage_combo)
+        self.compression_combo = QtWidgets.QComboBox()
+        for name in available_compressions():
+            self.compression_combo.addItem(name, name)
+        self.compression_combo.setCurrentIndex(
+            max(0, self.compression_combo.findData(getattr(parent, "compression", "none")))
+        )
+        layout.addRow("Compression:", self.compression_combo)
+        self.archive_age_spin = QtWidgets.QSpinBox()
+        self.archive_age_spin.setRange(0, 3650)
+        self.archive_age_spin.setSpecialValueText("never")
+        self.archive_age_spin.setSuffix(" days")
+        self.archive_age_spin.setValue(getattr(parent, "archive_max_age_days", 7))
+        layout.addRow("Archive Clipboard After:", self.archive_age_spin)
+        self.archive_size_spin = QtWidgets.QSpinBox()
+        self.archive_size_spin.setRange(0, 1024 * 1024)
+        self.archive_size_spin.setSpecialValueText("unlimited")
+        self.archive_size_spin.setSuffix(" KB")
+        self.archive_size_spin.setValue(getattr(parent, "archive_max_kb", 4096))
+        layout.addRow("Live Clipboard Budget:", self.archive_size_spin)
+        self.image_cache_spin = QtWidgets.QSpinBox()
+        self.image_cache_spin.setRange(1, 64 * 1024)
+        self.image_cache_spin.setSuffix(" MB")
+        self.image_cache_spin.setValue(getattr(parent, "image_cache_mb", 64))
+        layout.addRow("Image Cache Budget:", self.image_cache_spin)
+        fetcher = getattr(parent, "image_fetcher", None)
+        if fetcher is not None and fetcher.cache is not None:
+            summary = QtWidgets.QLabel(image_cache_summary(fetcher.cache.stats()))
+            layout.addRow("Image Cache:", summary)
         self.button_box = QtWidgets.QDialogButtonBox(
             QtWidgets.QDialogButtonBox.StandardButton.Ok
             | QtWidgets.QDialogButtonBox.StandardButton.Cancel
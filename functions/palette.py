@@ -0,0 +1,220 @@
+import colorsys, threading
+from PyQt6 import QtCore, QtGui
+from functions.color_average import (
+    PYTHON_MAX_SIDE,
+    average_color,
+    downscale,
+    numpy,
+    pixel_array,
+    read_scaled,
+    to_rgbx,
+)
+from functions.wallpaper_color import FingerprintCache, color_cache, wallpaper_fingerprint
+
+# Wallpaper palettes by median cut: the pixels of a downscaled copy are split
+# into boxes along their widest channel until there are `count` boxes; each
+# box's mean is a palette color, weighted by its pixel count. Boxes are cut in
+# the middle of their range rather than at the median pixel, so a small patch
+# of a distinct color ends up in a box of its own and the weights reflect
+# real areas; boxes whose colors end up close are merged again. From those:
+#   dominant  the heaviest color
+#   accent    a saturated color far from the dominant hue (even a small patch)
+#   text_on_* black or white tinted towards the dominant hue, whichever reads
+#             better on that color (WCAG contrast ratio >= 4.5 guaranteed)
+# Extraction runs on a worker thread and is cached per wallpaper fingerprint.
+
+MIN_CONTRAST = 4.5
+palette_cache = FingerprintCache("palettes")
+
+
+def _pixels(image):
+    image = to_rgbx(image)
+    if numpy is not None:
+        return pixel_array(image).reshape(-1, 3).astype(numpy.int32)
+    data = image.constBits().asstring(image.sizeInBytes())
+    width = image.width() * 4
+    line = image.bytesPerLine()
+    rows = (data[y * line : y * line + width] for y in range(image.height()))
+    return [tuple(row[x : x + 3]) for row in rows for x in range(0, width, 4)]
+
+
+def _split(box):
+    if numpy is not None:
+        low, high = box.min(axis=0), box.max(axis=0)
+        channel = int((high - low).argmax())
+        middle = (int(low[channel]) + int(high[channel])) / 2
+        below = box[:, channel] <= middle
+        return box[below], box[~below], int(high[channel] - low[channel])
+    lows = [min(p[c] for p in box) for c in range(3)]
+    ranges = [max(p[c] for p in box) - lows[c] for c in range(3)]
+    channel = ranges.index(max(ranges))
+    middle = lows[channel] + ranges[channel] / 2
+    return (
+        [p for p in box if p[channel] <= middle],
+        [p for p in box if p[channel] > middle],
+        ranges[channel],
+    )
+
+
+def _distance(rgb1, rgb2):
+    return sum((a - b) ** 2 for a, b in zip(rgb1, rgb2)) ** 0.5
+
+
+def _mean(box):
+    if numpy is not None:
+        return tuple(float(v) for v in box.mean(axis=0))
+    return tuple(sum(p[c] for p in box) / len(box) for c in range(3))
+
+
+# [(r, g, b), weight] for up to `count` colors, heaviest first.
+def median_cut(pixels, count=8, merge_distance=24):
+    boxes = [pixels]
+    while len(boxes) < count:
+        # Split the box with the widest spread; boxes of one pixel are done.
+        best = None
+        for i, box in enumerate(boxes):
+            if len(box) < 2:
+                continue
+            low, high, spread = _split(box)
+            if spread and (best is None or spread * len(box) > best[0]):
+                best = (spread * len(box), i, low, high)
+        if best is None:
+            break
+        _, i, low, high = best
+        boxes[i : i + 1] = [low, high]
+    total = sum(len(box) for box in boxes)
+    colors = []
+    for rgb, weight in sorted(
+        ((_mean(box), len(box) / total) for box in boxes if len(box)), key=lambda c: -c[1]
+    ):
+        for i, (other, other_weight) in enumerate(colors):
+            if _distance(rgb, other) < merge_distance:
+                merged = other_weight + weight
+                colors[i] = (
+                    tuple((a * other_weight + b * weight) / merged for a, b in zip(other, rgb)),
+                    merged,
+                )
+                break
+        else:
+            colors.append((rgb, weight))
+    return sorted(colors, key=lambda c: -c[1])
+
+
+def _luminance(rgb):
+    def channel(v):
+        v /= 255
+        return v / 12.92 if v <= 0.03928 else ((v + 0.055) / 1.055) ** 2.4
+
+    r, g, b = (channel(v) for v in rgb)
+    return 0.2126 * r + 0.7152 * g + 0.0722 * b
+
+
+def contrast_ratio(rgb1, rgb2):
+    l1, l2 = sorted((_luminance(rgb1), _luminance(rgb2)), reverse=True)
+    return (l1 + 0.05) / (l2 + 0.05)
+
+
+def _from_hls(h, l, s):
+    return tuple(v * 255 for v in colorsys.hls_to_rgb(h, l, s))
+
+
+# Text color for `background`: a light or dark shade of `tint`'s hue,
+# whichever contrasts more; pure white/black if the tinted one falls short.
+def text_color(background, tint):
+    h, _, s = colorsys.rgb_to_hls(*(v / 255 for v in tint))
+    s = min(s, 0.25)
+    candidates = [_from_hls(h, 0.93, s), _from_hls(h, 0.1, s)]
+    best = max(candidates, key=lambda c: contrast_ratio(c, background))
+    if contrast_ratio(best, background) < MIN_CONTRAST:
+        best = max(((255, 255, 255), (0, 0, 0)), key=lambda c: contrast_ratio(c, background))
+    return best
+
+
+def _saturation(rgb):
+    return colorsys.rgb_to_hls(*(v / 255 for v in rgb))[2]
+
+
+# 0 for the same hue, 1 for opposite hues.
+def _hue_distance(rgb1, rgb2):
+    h1 = colorsys.rgb_to_hls(*(v / 255 for v in rgb1))[0]
+    h2 = colorsys.rgb_to_hls(*(v / 255 for v in rgb2))[0]
+    d = abs(h1 - h2) % 1
+    return min(d, 1 - d) * 2
+
+
+def _accent_score(rgb, weight, dominant):
+    return _saturation(rgb) * (0.25 + _hue_distance(rgb, dominant)) * weight ** 0.25
+
+
+def _name(rgb):
+    return QtGui.QColor(*(max(0, min(255, int(round(v)))) for v in rgb)).name()
+
+
+# The palette of `image` as color names (JSON-friendly, see palette_cache).
+def extract_palette(image, count=8):
+    image = downscale(image, 128 if numpy is not None else PYTHON_MAX_SIDE)
+    colors = median_cut(_pixels(image), count)
+    dominant = colors[0][0]
+    others = [
+        (rgb, weight)
+        for rgb, weight in colors[1:]
+        if weight >= 0.01 and _distance(rgb, dominant) > 60
+    ]
+    if others:
+        accent = max(others, key=lambda c: _accent_score(c[0], c[1], dominant))[0]
+    else:
+        # A near-uniform wallpaper: take the dominant hue, shifted and livelier.
+        h, l, s = colorsys.rgb_to_hls(*(v / 255 for v in dominant))
+        accent = _from_hls((h + 0.08) % 1, min(0.7, max(0.35, l)), max(0.45, s))
+    return {
+        "dominant": _name(dominant),
+        "accent": _name(accent),
+        "text_on_dominant": _name(text_color(dominant, dominant)),
+        "text_on_accent": _name(text_color(accent, dominant)),
+        "colors": [[_name(rgb), round(weight, 4)] for rgb, weight in colors],
+    }
+
+
+# Computes wallpaper palettes (and average colors, from the same decode) on a
+# worker thread. cached() answers from the fingerprint caches right away;
+# request() starts the work and `extracted` (fingerprint, palette) follows on
+# the GUI thread, or `failed` (path, reason) if the wallpaper cannot be read.
+class PaletteExtractor(QtCore.QObject):
+    extracted = QtCore.pyqtSignal(str, object)
+    failed = QtCore.pyqtSignal(str, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._running = set()
+        self._lock = threading.Lock()
+
+    def cached(self, path):
+        key = wallpaper_fingerprint(path)
+        return palette_cache.get(key) if key else None
+
+    def request(self, path):
+        key = wallpaper_fingerprint(path)
+        if key is None:
+            return
+        with self._lock:
+            if key in self._running:
+                return
+            self._running.add(key)
+        threading.Thread(target=self._run, args=(key, path), daemon=True).start()
+
+    def _run(self, key, path):
+        try:
+            image = read_scaled(path)
+            if image.isNull():
+                self.failed.emit(path, "cannot decode the image")
+                return
+            palette = extract_palette(image)
+            palette["average"] = average_color(image).name()
+            color_cache.put(key, palette["average"])
+            palette_cache.put(key, palette)
+            self.extracted.emit(key, palette)
+        except (OSError, ValueError, MemoryError) as e:
+            self.failed.emit(path, str(e))
+        finally:
+            with self._lock:
+                self._running.discard(key)
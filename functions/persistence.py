@@ -0,0 +1,208 @@
+import contextlib, gzip, io, json, os, tempfile, threading, time
+from PyQt6 import QtCore
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+# Board files may be wrapped in a gzip or zstd stream. The container is
+# recognised by its magic bytes, so plain JSON files keep loading as before.
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def available_compressions():
+    return ["none", "gzip"] + (["zstd"] if zstandard is not None else [])
+
+
+def detect_compression(path):
+    with open(path, "rb") as f:
+        head = f.read(4)
+    if head.startswith(GZIP_MAGIC):
+        return "gzip"
+    if head.startswith(ZSTD_MAGIC):
+        return "zstd"
+    return "none"
+
+
+# Opens `path` as a decompressing text stream; data is inflated as it is read,
+# never held in compressed and decompressed form at the same time.
+def open_text_reader(path):
+    compression = detect_compression(path)
+    if compression == "none":
+        return open(path, "r", encoding="utf-8")
+    raw = open(path, "rb")
+    if compression == "gzip":
+        stream = gzip.GzipFile(fileobj=raw, mode="rb")
+    elif zstandard is not None:
+        stream = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+    else:
+        raw.close()
+        raise RuntimeError(f"{path} is zstd-compressed but 'zstandard' is not installed")
+    return io.TextIOWrapper(stream, encoding="utf-8")
+
+
+def read_json(path):
+    with open_text_reader(path) as f:
+        return json.load(f)
+
+
+# Writes through a temp file in the target directory, fsyncs it and swaps it
+# into place with os.replace, so a crash mid-write never truncates `path`.
+def write_atomic(path, write, binary=False):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(
+        prefix="." + os.path.basename(path) + ".", suffix=".tmp", dir=directory
+    )
+    try:
+        if binary:
+            f = os.fdopen(fd, "wb")
+        else:
+            f = os.fdopen(fd, "w", encoding="utf-8")
+        with f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+# Advisory lock on <path>.lock, held while a board file is written or read so
+# two instances sharing a save file never interleave. Waits up to `timeout`.
+@contextlib.contextmanager
+def file_lock(path, timeout=5.0):
+    f = open(path + ".lock", "a+")
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                elif msvcrt is not None:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"{path} is locked by another process")
+                time.sleep(0.05)
+        yield
+    finally:
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        except OSError:
+            pass
+        f.close()
+
+
+def write_json_atomic(path, data, compression="none"):
+    if compression == "zstd" and zstandard is None:
+        compression = "gzip"
+    if compression == "none":
+        write_atomic(path, lambda f: json.dump(data, f, ensure_ascii=False, indent=2))
+        return
+
+    def write(f):
+        if compression == "gzip":
+            stream = gzip.GzipFile(fileobj=f, mode="wb", compresslevel=6)
+        else:
+            stream = zstandard.ZstdCompressor(level=6).stream_writer(f, closefd=False)
+        with io.TextIOWrapper(stream, encoding="utf-8") as text:
+            json.dump(data, text, ensure_ascii=False)
+
+    write_atomic(path, write, binary=True)
+
+
+# Background write-behind queue. The GUI thread hands over immutable snapshots
+# (plain dicts of strings/numbers) and returns immediately; encoding and disk
+# I/O happen on the worker thread. Tasks are keyed by target path: submitting
+# a newer snapshot for a path drops the stale one still waiting in the queue.
+# `written` and `failed` report the file a task wrote (the `path` it was
+# submitted with, or its key) and are emitted from the worker thread.
+class PersistenceWorker(QtCore.QObject):
+    failed = QtCore.pyqtSignal(str, str)
+    written = QtCore.pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._cond = threading.Condition()
+        self._tasks = []
+        self._busy = False
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, key, task, path=None):
+        with self._cond:
+            if key is not None:
+                self._tasks = [t for t in self._tasks if t[0] != key]
+            self._tasks.append((key, task, path))
+            self._cond.notify_all()
+
+    def write_json(self, path, data, compression="none", lock=False):
+        if lock:
+            def task():
+                with file_lock(path):
+                    write_json_atomic(path, data, compression)
+        else:
+            def task():
+                write_json_atomic(path, data, compression)
+        self.submit(path, task)
+
+    def pending(self):
+        with self._cond:
+            return len(self._tasks) + (1 if self._busy else 0)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._tasks and not self._stopped:
+                    self._cond.wait()
+                if not self._tasks:
+                    return
+                key, task, path = self._tasks.pop(0)
+                self._busy = True
+            try:
+                task()
+                if path is not None or key is not None:
+                    self.written.emit(str(path if path is not None else key))
+            except Exception as e:
+                self.failed.emit(str(path if path is not None else key), str(e))
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    # Blocks until everything queued so far has hit the disk.
+    def flush(self, timeout=None):
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._tasks and not self._busy, timeout
+            )
+
+    def stop(self, timeout=None):
+        self.flush(timeout)
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
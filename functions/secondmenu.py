@@ -1,36 +1,9 @@
 from PyQt6 import QtWidgets, QtGui, QtCore
-from functions.wallpaper_color import get_desktop_base_color, windows_is_dark_mode
+from functions.theme import shared_theme
 
 def show_rich_context_menu(parent, event):
     menu = QtWidgets.QMenu(parent)
-    desktop_color = get_desktop_base_color()
-    is_dark = windows_is_dark_mode()
-    border_color = desktop_color.darker(150) if is_dark else desktop_color.lighter(150)
-    font_color = QtGui.QColor(220, 220, 220) if is_dark else QtGui.QColor(30, 30, 30)
-    def blend(color1, color2, ratio):
-        return QtGui.QColor(
-            int(color1.red() * (1 - ratio) + color2.red() * ratio),
-            int(color1.green() * (1 - ratio) + color2.green() * ratio),
-            int(color1.blue() * (1 - ratio) + color2.blue() * ratio),
-        )
-    accent_hover = blend(desktop_color, QtGui.QColor(255,255,255) if is_dark else QtGui.QColor(0,0,0), 0.18)
-    accent_hover_text = QtGui.QColor(30,30,30) if is_dark else QtGui.QColor(240,240,240)
-    menu.setStyleSheet(f'''
-        QMenu {{
-            background: {desktop_color.name()};
-            color: {font_color.name()};
-            border: 1.5px solid {border_color.name()};
-        }}
-        QMenu::item:selected {{
-            background: {accent_hover.name()};
-            color: {accent_hover_text.name()};
-        }}
-        QMenu::separator {{
-            height: 1px;
-            background: {border_color.name()};
-            margin: 4px 0 4px 0;
-        }}
-    ''')
+    menu.setStyleSheet(shared_theme().stylesheet("menu"))
 
     cursor = parent.textCursor()
     has_selection = cursor.hasSelection()
@@ -146,18 +119,6 @@ def change_highlight(parent):
         fmt.setBackground(QtGui.QBrush(color))
         cursor.mergeCharFormat(fmt)
 
-def start_clipboard_catcher(parent, callback):
-    """
-    Starts a clipboard catcher that calls `callback(text)` whenever the clipboard text changes.
-    `parent` should be a QWidget or QApplication instance.
-    `callback` is a function that takes a single string argument (the clipboard text).
-    """
-    clipboard = QtWidgets.QApplication.clipboard()
-    def on_clipboard_change():
-        text = clipboard.text()
-        callback(text)
-    clipboard.dataChanged.connect(on_clipboard_change)
-
 def update_tray_state(parent):
     tray = getattr(parent, 'tray', None)
     if tray:
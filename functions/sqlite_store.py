@@ -0,0 +1,158 @@
+import os, sqlite3, threading, time
+from datetime import datetime
+from PyQt6 import QtCore
+from functions.blocks import document_fragments
+
+# One row per block: `pos` orders the rows (fractional keys, so inserting a
+# block between two others never renumbers the table), `html` is the block
+# fragment ("" for blocks covered by a table/list on an earlier row).
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks (
+    id INTEGER PRIMARY KEY,
+    pos REAL NOT NULL,
+    html TEXT NOT NULL,
+    modified REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blocks_pos ON blocks(pos);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+POS_STEP = 1024.0
+
+
+def sqlite_path_for(history_file):
+    return os.path.splitext(history_file)[0] + ".sqlite3"
+
+
+class SqliteBoardStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    # One connection per thread: the GUI thread only reads at startup, the
+    # persistence worker does all the writing.
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def read_fragments(self):
+        rows = self.connection().execute("SELECT html FROM blocks ORDER BY pos")
+        return [html for (html,) in rows]
+
+    def _rows(self, conn, offset, limit):
+        return conn.execute(
+            "SELECT id, pos, html FROM blocks ORDER BY pos LIMIT ? OFFSET ?",
+            (limit, offset),
+        ).fetchall()
+
+    def _pos_at(self, conn, offset):
+        if offset < 0:
+            return None
+        row = self._rows(conn, offset, 1)
+        return row[0][1] if row else None
+
+    def _renumber(self, conn):
+        ids = [row[0] for row in conn.execute("SELECT id FROM blocks ORDER BY pos")]
+        conn.executemany(
+            "UPDATE blocks SET pos = ? WHERE id = ?",
+            [((i + 1) * POS_STEP, row_id) for i, row_id in enumerate(ids)],
+        )
+
+    def _apply(self, conn, record, now):
+        at = record["at"]
+        blocks = record["blocks"]
+        old_rows = self._rows(conn, at, record["remove"]) if record["remove"] else []
+        for (row_id, _, html), new_html in zip(old_rows, blocks):
+            if html != new_html:
+                conn.execute(
+                    "UPDATE blocks SET html = ?, modified = ? WHERE id = ?",
+                    (new_html, now, row_id),
+                )
+        for row_id, _, _ in old_rows[len(blocks):]:
+            conn.execute("DELETE FROM blocks WHERE id = ?", (row_id,))
+        extra = blocks[len(old_rows):]
+        if not extra:
+            return
+        start = at + len(old_rows)
+        low = self._pos_at(conn, start - 1)
+        high = self._pos_at(conn, start)
+        if low is None:
+            low = (high if high is not None else POS_STEP * (len(extra) + 1)) - POS_STEP * (len(extra) + 1)
+        if high is None:
+            high = low + POS_STEP * (len(extra) + 1)
+        step = (high - low) / (len(extra) + 1)
+        if step < 1e-6:
+            self._renumber(conn)
+            return self._apply(conn, dict(record, remove=0, at=start, blocks=extra), now)
+        conn.executemany(
+            "INSERT INTO blocks (pos, html, modified) VALUES (?, ?, ?)",
+            [(low + step * (i + 1), html, now) for i, html in enumerate(extra)],
+        )
+
+    # Applies block records from the change tracker in one transaction,
+    # touching only the rows of the blocks that changed.
+    def apply_records(self, records):
+        conn = self.connection()
+        now = time.time()
+        with conn:
+            for record in records:
+                self._apply(conn, record, now)
+            self._touch(conn)
+
+    def replace_all(self, fragments):
+        conn = self.connection()
+        now = time.time()
+        with conn:
+            conn.execute("DELETE FROM blocks")
+            conn.executemany(
+                "INSERT INTO blocks (pos, html, modified) VALUES (?, ?, ?)",
+                [((i + 1) * POS_STEP, html, now) for i, html in enumerate(fragments)],
+            )
+            self._touch(conn)
+
+    def _touch(self, conn):
+        conn.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            [("last_updated", datetime.now().isoformat()), ("app_version", "2.0")],
+        )
+
+
+# Incremental board store backed by SqliteBoardStore; same interface as
+# BoardJournal (attach/detach/flush/compact).
+class SqliteBoard(QtCore.QObject):
+    def __init__(self, editor, history_file, worker):
+        super().__init__(editor)
+        self.editor = editor
+        self.store = SqliteBoardStore(sqlite_path_for(history_file))
+        self.worker = worker
+        self.pending = []
+
+    def attach(self, tracker):
+        tracker.changed.connect(self.on_change)
+
+    def detach(self, tracker):
+        tracker.changed.disconnect(self.on_change)
+
+    def on_change(self, record):
+        self.pending.append(record)
+
+    def flush(self):
+        if self.pending:
+            records = self.pending
+            self.pending = []
+            self.worker.submit(
+                None, lambda: self.store.apply_records(records), path=self.store.path
+            )
+
+    def compact(self):
+        self.pending = []
+        fragments = document_fragments(self.editor.document(), self.editor.block_cache)
+        self.worker.submit(
+            None, lambda: self.store.replace_all(fragments), path=self.store.path
+        )
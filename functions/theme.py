@@ -0,0 +1,293 @@
+import os, sys
+from PyQt6 import QtCore, QtGui, QtWidgets
+from functions.palette import PaletteExtractor, text_color
+from functions.theme_providers import default_theme_provider
+from functions.wallpaper_color import peek_wallpaper_color
+
+
+def _shift(color, amount):
+    return QtGui.QColor(
+        max(0, min(255, color.red() + amount)),
+        max(0, min(255, color.green() + amount)),
+        max(0, min(255, color.blue() + amount)),
+    )
+
+
+def _blend(color1, color2, ratio):
+    return QtGui.QColor(
+        int(color1.red() * (1 - ratio) + color2.red() * ratio),
+        int(color1.green() * (1 - ratio) + color2.green() * ratio),
+        int(color1.blue() * (1 - ratio) + color2.blue() * ratio),
+    )
+
+
+# Every color the UI derives from the desktop color and the dark mode flag,
+# refined by the wallpaper's extracted palette (see palette.py) once known:
+# text that is guaranteed to be readable and the accent for highlights.
+def build_palette(base, dark, extracted=None):
+    shift = -1 if dark else 1
+    palette = {
+        "base": base,
+        "dark": dark,
+        "background": _shift(base, 30 * shift),
+        "border": _shift(base, 50 * shift),
+        "text": QtGui.QColor(200, 200, 200) if dark else QtGui.QColor(30, 30, 30),
+        "selection": _shift(base, 80 * shift),
+        "selection_bg": QtGui.QColor(30, 30, 30) if dark else QtGui.QColor(240, 240, 240),
+        "menu_border": base.darker(150) if dark else base.lighter(150),
+        "menu_text": QtGui.QColor(220, 220, 220) if dark else QtGui.QColor(30, 30, 30),
+        "menu_hover": _blend(
+            base, QtGui.QColor(255, 255, 255) if dark else QtGui.QColor(0, 0, 0), 0.18
+        ),
+        "menu_hover_text": QtGui.QColor(30, 30, 30) if dark else QtGui.QColor(240, 240, 240),
+    }
+    if extracted:
+        dominant = QtGui.QColor(extracted["dominant"])
+        accent = QtGui.QColor(extracted["accent"])
+        background = palette["background"]
+        tint = (dominant.red(), dominant.green(), dominant.blue())
+        palette["text"] = _rgb_color(
+            text_color((background.red(), background.green(), background.blue()), tint)
+        )
+        palette["menu_text"] = _rgb_color(
+            text_color((base.red(), base.green(), base.blue()), tint)
+        )
+        palette["menu_hover"] = accent
+        palette["menu_hover_text"] = QtGui.QColor(extracted["text_on_accent"])
+        palette["selection_bg"] = accent
+        palette["selection"] = QtGui.QColor(extracted["text_on_accent"])
+    return palette
+
+
+def _rgb_color(rgb):
+    return QtGui.QColor(*(int(round(v)) for v in rgb))
+
+
+def _editor_style(p):
+    return f"""
+            QTextEdit {{
+                background: {p["background"].name()};
+                color: {p["text"].name()};
+                font-family: 'Consolas', 'Courier New', monospace;
+                font-size: 15px;
+                padding: 12px;
+                border: 1.5px solid {p["border"].name()};
+                selection-background-color: {p["selection_bg"].name()};
+                selection-color: {p["selection"].name()};
+            }}
+        """
+
+
+def _tooltip_style(p):
+    return (
+        f"QToolTip {{ background-color: {p['background'].name()}; color: {p['text'].name()}; "
+        f"border: 1px solid {p['border'].name()}; padding: 5px; }}"
+    )
+
+
+def _menu_style(p):
+    return f"""
+        QMenu {{
+            background: {p["base"].name()};
+            color: {p["menu_text"].name()};
+            border: 1.5px solid {p["menu_border"].name()};
+        }}
+        QMenu::item:selected {{
+            background: {p["menu_hover"].name()};
+            color: {p["menu_hover_text"].name()};
+        }}
+        QMenu::separator {{
+            height: 1px;
+            background: {p["menu_border"].name()};
+            margin: 4px 0 4px 0;
+        }}
+    """
+
+
+def _dialog_style(p):
+    base = p["base"]
+    if p["dark"]:
+        border_color = "rgba(255, 255, 255, 0.2)"
+        return f"""
+                QDialog {{
+                    background: rgba({base.red()}, {base.green()}, {base.blue()}, 0.88);
+                    border-radius: 6px;
+                    border: 1px solid {border_color};
+                }}
+
+                QLineEdit {{
+                    background: #222;
+                    color: #fff;
+                    border: none;
+                    padding: 4px 8px;
+                    min-width: 120px;
+                }}
+                QPushButton {{
+                    background: transparent;
+                    border: none;
+                    min-width: 24px;
+                    min-height: 24px;
+                }}
+                QPushButton:hover {{
+                    background-color: #444;
+                    border-radius: 4px;
+                }}
+                QtWidgets.QLabel{{
+                    color: rgba(255, 255, 255, 0.8);
+                    min-width: 48px;
+                }}
+                QtWidgets.QLabel:hover {{
+                    color: rgba(255, 255, 255, 1.0);
+                    min-width: 48px;
+                }}
+
+            """
+    border_color = "rgba(0, 0, 0, 0.2)"
+    return f"""
+                QDialog {{
+                    background: rgb(255, 255, 255);
+                    border-radius: 6px;
+                    border: 1px solid {border_color};
+                }}
+                QLineEdit {{
+                    background: #fff;
+                    color: #000;
+                    border: 1px solid #ccc;
+                    padding: 4px 8px;
+                    min-width: 120px;
+                }}
+                QPushButton {{
+                    background: transparent;
+                    border: none;
+                    min-width: 24px;
+                    min-height: 24px;
+                }}
+                QPushButton:hover {{
+                    background-color: #ddd;
+                    border-radius: 4px;
+                }}
+                QtWidgets.QLabel{{
+                    color: rgba(255, 255, 255, 0.8);
+                    min-width: 48px;
+                }}
+                QtWidgets.QLabel:hover {{
+                    color: rgba(0, 0, 0, 0.8);
+                    min-width: 48px;
+                }}
+            """
+
+
+STYLES = {
+    "editor": _editor_style,
+    "tooltip": _tooltip_style,
+    "menu": _menu_style,
+    "dialog": _dialog_style,
+}
+
+
+# What the theme is computed from, cheap to read: the wallpaper file's
+# identity (not its pixels) and the dark mode flag.
+def _source_key(provider):
+    path = provider.wallpaper_path()
+    try:
+        st = os.stat(path)
+        wallpaper = (path, st.st_mtime_ns, st.st_size)
+    except (OSError, ValueError):
+        wallpaper = provider.default_color().name()
+    return wallpaper, provider.is_dark_mode()
+
+
+# One theme for the whole app. The palette is computed once and again only
+# when the provider (see theme_providers) reports a change that actually
+# alters the wallpaper or the dark mode setting; `changed` is emitted then and
+# only then. Stylesheets are built on first request per palette, so the
+# editor, dialogs, menus and tray all share the same strings and nobody calls
+# setStyleSheet unless something actually changed.
+class ThemeService(QtCore.QObject):
+    changed = QtCore.pyqtSignal()
+
+    def __init__(self, provider, parent=None):
+        super().__init__(parent)
+        self.provider = provider
+        self.palette = None
+        self.extracted = None
+        self._key = None
+        self._styles = {}
+        self.extractor = PaletteExtractor(self)
+        self.extractor.extracted.connect(self.on_extracted)
+        self.extractor.failed.connect(self.on_extract_failed)
+        self.refresh()
+        provider.changed.connect(self.refresh)
+        provider.start()
+
+    # Returns True if the theme changed.
+    def refresh(self):
+        key = _source_key(self.provider)
+        if key == self._key:
+            return False
+        self._key = key
+        extracted = None
+        if isinstance(key[0], tuple):
+            path = key[0][0]
+            extracted = self.extractor.cached(path)
+            if extracted is None:
+                # Decoding happens on the extractor's thread; until it is done
+                # the last known color of this file, or the current look, is
+                # kept.
+                self.extractor.request(path)
+                base = peek_wallpaper_color(path)
+                if base is None:
+                    base = self.palette["base"] if self.palette else self.provider.default_color()
+                    extracted = self.extracted
+            else:
+                base = QtGui.QColor(extracted["average"])
+        else:
+            base = QtGui.QColor(key[0])
+        self.extracted = extracted
+        return self._apply(build_palette(base, key[1], extracted))
+
+    def on_extracted(self, fingerprint, extracted):
+        key = self._key
+        if key is None or not isinstance(key[0], tuple):
+            return
+        path, mtime, size = key[0]
+        if fingerprint.endswith(f"|{mtime}|{size}"):
+            self.extracted = extracted
+            self._apply(build_palette(QtGui.QColor(extracted["average"]), key[1], extracted))
+
+    # The theme stays on the average color (or the current look); say why.
+    def on_extract_failed(self, path, reason):
+        print(f"Wallpaper palette for {path} failed: {reason}", file=sys.stderr)
+
+    def _apply(self, palette):
+        if self.palette is not None and all(
+            palette[name] == self.palette[name] for name in palette
+        ):
+            return False
+        self.palette = palette
+        self._styles = {}
+        self.changed.emit()
+        return True
+
+    @property
+    def dark(self):
+        return self.palette["dark"]
+
+    def stylesheet(self, name):
+        style = self._styles.get(name)
+        if style is None:
+            style = self._styles[name] = STYLES[name](self.palette)
+        return style
+
+
+_shared = None
+
+
+# The app's ThemeService; the first caller may pick the provider (the editor
+# does, from its config), later ones get the same instance.
+def shared_theme(provider=None):
+    global _shared
+    if _shared is None:
+        app = QtWidgets.QApplication.instance()
+        _shared = ThemeService(provider or default_theme_provider(parent=app), app)
+    return _shared
@@ -0,0 +1,187 @@
+import ctypes, os, sys
+from PyQt6 import QtCore, QtGui, QtWidgets
+from functions.wallpaper_color import (
+    get_default_desktop_color,
+    get_wallpaper_path,
+    windows_is_dark_mode,
+)
+
+# Where the theme comes from: the current wallpaper file, the dark mode flag,
+# a fallback color when there is no wallpaper, and a `changed` signal when any
+# of those may have changed. ThemeService only recomputes when a provider
+# says so; nothing polls.
+
+
+class ThemeProvider(QtCore.QObject):
+    changed = QtCore.pyqtSignal()
+
+    def __init__(self, parent=None, debounce_ms=300):
+        super().__init__(parent)
+        self._fs = QtCore.QFileSystemWatcher(self)
+        self._fs.fileChanged.connect(self._schedule)
+        self._fs.directoryChanged.connect(self._schedule)
+        self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(debounce_ms)
+        self._timer.timeout.connect(self._emit_changed)
+
+    def wallpaper_path(self):
+        return ""
+
+    def is_dark_mode(self):
+        return False
+
+    def default_color(self):
+        return QtGui.QColor(0, 0, 0)
+
+    # Files whose changes mean the theme may have changed. Their directories
+    # are watched too: a replaced file drops out of QFileSystemWatcher.
+    def watched_files(self):
+        return [self.wallpaper_path()]
+
+    def start(self):
+        self.rewatch()
+
+    def rewatch(self):
+        for paths in (self._fs.files(), self._fs.directories()):
+            if paths:
+                self._fs.removePaths(paths)
+        files = [os.path.abspath(p) for p in self.watched_files() if p]
+        dirs = {os.path.dirname(p) for p in files}
+        existing = [p for p in files if os.path.exists(p)] + [d for d in dirs if os.path.isdir(d)]
+        if existing:
+            self._fs.addPaths(existing)
+
+    def _schedule(self, *args):
+        self._timer.start()
+
+    def _emit_changed(self):
+        # The wallpaper path itself may have changed.
+        self.rewatch()
+        self.changed.emit()
+
+
+class _SettingChangeFilter(QtCore.QAbstractNativeEventFilter):
+    WM_SETTINGCHANGE = 0x001A
+    WM_SYSCOLORCHANGE = 0x0015
+
+    def __init__(self, callback):
+        super().__init__()
+        self.callback = callback
+
+    def nativeEventFilter(self, event_type, message):
+        if event_type == b"windows_generic_MSG" and message:
+            from ctypes import wintypes
+
+            msg = wintypes.MSG.from_address(int(message))
+            if msg.message in (self.WM_SETTINGCHANGE, self.WM_SYSCOLORCHANGE):
+                self.callback()
+        return False, 0
+
+
+# Wallpaper from SystemParametersInfo, dark mode from the registry. Windows
+# broadcasts WM_SETTINGCHANGE to top-level windows when either changes; the
+# wallpaper file is watched as well for slideshows that rewrite it in place.
+class WindowsThemeProvider(ThemeProvider):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._filter = _SettingChangeFilter(self._schedule)
+
+    def wallpaper_path(self):
+        return get_wallpaper_path()
+
+    def is_dark_mode(self):
+        return windows_is_dark_mode()
+
+    def default_color(self):
+        return get_default_desktop_color()
+
+    def start(self):
+        app = QtCore.QCoreApplication.instance()
+        if app is not None:
+            app.installNativeEventFilter(self._filter)
+        super().start()
+
+
+DARK_KEYS = ("gtk-application-prefer-dark-theme", "gtk-theme-name", "ColorScheme", "color-scheme")
+
+
+# True if an ini-style settings file (gtk settings.ini, kdeglobals) asks for a
+# dark theme.
+def settings_say_dark(text):
+    for line in text.splitlines():
+        key, sep, value = line.partition("=")
+        if sep and key.strip() in DARK_KEYS:
+            value = value.strip().strip("'\"").lower()
+            if value in ("1", "true") or "dark" in value:
+                return True
+    return False
+
+
+# There is no portable way to ask a Linux desktop for its wallpaper, so the
+# file is configured (wallpaper_path in the config file); dark mode is read
+# from a settings file, ~/.config/gtk-3.0/settings.ini unless configured
+# (theme_settings_file). Both are watched.
+class LinuxThemeProvider(ThemeProvider):
+    DEFAULT_SETTINGS = os.path.join("~", ".config", "gtk-3.0", "settings.ini")
+
+    def __init__(self, wallpaper="", settings_file="", parent=None):
+        super().__init__(parent)
+        self.wallpaper = os.path.expanduser(wallpaper) if wallpaper else ""
+        self.settings_file = os.path.expanduser(settings_file or self.DEFAULT_SETTINGS)
+
+    def wallpaper_path(self):
+        return self.wallpaper
+
+    def is_dark_mode(self):
+        try:
+            with open(self.settings_file, "r", encoding="utf-8", errors="replace") as f:
+                return settings_say_dark(f.read())
+        except OSError:
+            return False
+
+    def default_color(self):
+        app = QtWidgets.QApplication.instance()
+        if app is None:
+            return QtGui.QColor(0, 0, 0)
+        return app.palette().color(QtGui.QPalette.ColorRole.Window)
+
+    def watched_files(self):
+        return [self.wallpaper, self.settings_file]
+
+
+# For tests and headless runs: holds its values and emits `changed` right away
+# when they are set.
+class FakeThemeProvider(ThemeProvider):
+    def __init__(self, wallpaper="", dark=False, color=None, parent=None):
+        super().__init__(parent)
+        self.wallpaper = wallpaper
+        self.dark = dark
+        self.color = color or QtGui.QColor(0, 0, 0)
+
+    def wallpaper_path(self):
+        return self.wallpaper
+
+    def is_dark_mode(self):
+        return self.dark
+
+    def default_color(self):
+        return self.color
+
+    def watched_files(self):
+        return []
+
+    def set(self, wallpaper=None, dark=None, color=None):
+        if wallpaper is not None:
+            self.wallpaper = wallpaper
+        if dark is not None:
+            self.dark = dark
+        if color is not None:
+            self.color = color
+        self.changed.emit()
+
+
+def default_theme_provider(wallpaper="", settings_file="", parent=None):
+    if sys.platform == "win32" and hasattr(ctypes, "windll"):
+        return WindowsThemeProvider(parent)
+    return LinuxThemeProvider(wallpaper, settings_file, parent)
@@ -0,0 +1,336 @@
+import hashlib, os, struct, threading, time, zlib
+from datetime import datetime
+from PyQt6 import QtCore, QtWidgets
+from functions.blobstore import inline_blob_images
+from functions.persistence import file_lock, write_atomic
+
+# Past versions of the board live in <history>_versions/:
+#   snapshots.dat  zlib-compressed board HTML, one blob after the other
+#   index.bin      one fixed-size record per snapshot, oldest first:
+#                  (timestamp, offset, length, first 8 bytes of the sha1)
+# Records are fixed-size and sorted by time, so finding the version at a given
+# moment is a binary search over the index file (O(log n) seeks) and nothing
+# is replayed. Thinning keeps one version per minute for the last day, one per
+# hour for the last month and one per day beyond that.
+
+RECORD = struct.Struct("<dQI8s")
+DAY = 24 * 3600
+MONTH = 30 * DAY
+
+
+def versions_dir_for(history_file):
+    return os.path.splitext(os.path.abspath(history_file))[0] + "_versions"
+
+
+def _digest(html):
+    return hashlib.sha1(html.encode("utf-8")).digest()[:8]
+
+
+# Bucket of a snapshot taken at `ts` under the retention policy; only the
+# newest snapshot of every bucket is kept.
+def retention_bucket(ts, now):
+    age = now - ts
+    if age < DAY:
+        return ("minute", int(ts // 60))
+    if age < MONTH:
+        return ("hour", int(ts // 3600))
+    return ("day", datetime.fromtimestamp(ts).date())
+
+
+# Indices (into the sorted `timestamps`) of the snapshots to keep.
+def retained(timestamps, now):
+    keep = []
+    last_bucket = None
+    for i in range(len(timestamps) - 1, -1, -1):
+        bucket = retention_bucket(timestamps[i], now)
+        if bucket != last_bucket:
+            keep.append(i)
+            last_bucket = bucket
+    keep.reverse()
+    return keep
+
+
+class VersionStore:
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+
+    @property
+    def data_path(self):
+        return os.path.join(self.root, "snapshots.dat")
+
+    @property
+    def index_path(self):
+        return os.path.join(self.root, "index.bin")
+
+    def count(self):
+        try:
+            return os.path.getsize(self.index_path) // RECORD.size
+        except OSError:
+            return 0
+
+    def _record(self, f, i):
+        f.seek(i * RECORD.size)
+        return RECORD.unpack(f.read(RECORD.size))
+
+    # (timestamp, offset, length, digest) of snapshot `i`.
+    def record(self, i):
+        with self._lock, open(self.index_path, "rb") as f:
+            return self._record(f, i)
+
+    # Index of the last snapshot taken at or before `ts` (the first one if
+    # they are all newer), or None when there are no snapshots.
+    def find(self, ts):
+        with self._lock:
+            count = self.count()
+            if not count:
+                return None
+            low, high = 0, count
+            with open(self.index_path, "rb") as f:
+                while low < high:
+                    mid = (low + high) // 2
+                    if self._record(f, mid)[0] <= ts:
+                        low = mid + 1
+                    else:
+                        high = mid
+        return max(0, low - 1)
+
+    # The board HTML of snapshot `i`, None if it cannot be read back.
+    def read(self, i):
+        with self._lock:
+            with open(self.index_path, "rb") as f:
+                _, offset, length, digest = self._record(f, i)
+            with open(self.data_path, "rb") as f:
+                f.seek(offset)
+                data = f.read(length)
+        try:
+            html = zlib.decompress(data).decode("utf-8")
+        except (zlib.error, UnicodeDecodeError):
+            return None
+        return html if _digest(html) == digest else None
+
+    # Appends a snapshot unless the board is the same as in the last one.
+    # Returns True if one was written.
+    def append(self, ts, html):
+        digest = _digest(html)
+        data = zlib.compress(html.encode("utf-8"), 6)
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock, file_lock(self.index_path):
+            count = self.count()
+            if count:
+                with open(self.index_path, "rb") as f:
+                    if self._record(f, count - 1)[3] == digest:
+                        return False
+            # Data first: a crash in between leaves an unreferenced blob, never
+            # a record pointing past the end of the data file.
+            with open(self.data_path, "ab") as f:
+                offset = f.tell()
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self.index_path, "r+b" if count else "wb") as f:
+                # Drops a torn record left by a crash.
+                f.truncate(count * RECORD.size)
+                f.seek(count * RECORD.size)
+                f.write(RECORD.pack(ts, offset, len(data), digest))
+                f.flush()
+                os.fsync(f.fileno())
+        return True
+
+    # Applies the retention policy, rewriting both files when anything goes.
+    # Returns the number of snapshots dropped.
+    def thin(self, now=None):
+        now = time.time() if now is None else now
+        if not self.count():
+            return 0
+        with self._lock, file_lock(self.index_path):
+            count = self.count()
+            if not count:
+                return 0
+            with open(self.index_path, "rb") as f:
+                records = [self._record(f, i) for i in range(count)]
+            keep = retained([r[0] for r in records], now)
+            if len(keep) == count:
+                return 0
+            blobs = []
+            with open(self.data_path, "rb") as f:
+                for i in keep:
+                    _, offset, length, _ = records[i]
+                    f.seek(offset)
+                    blobs.append(f.read(length))
+            index = []
+            offset = 0
+            for i, blob in zip(keep, blobs):
+                ts, _, length, digest = records[i]
+                index.append(RECORD.pack(ts, offset, length, digest))
+                offset += length
+
+            def write_data(f):
+                for blob in blobs:
+                    f.write(blob)
+
+            # A crash between the two replaces leaves records whose digest no
+            # longer matches; read() returns None for those.
+            write_atomic(self.data_path, write_data, binary=True)
+            write_atomic(self.index_path, lambda f: f.write(b"".join(index)), binary=True)
+        return count - len(keep)
+
+
+# Takes a snapshot of the board at most every `interval_s` on save (see
+# DesktopTextBoard.save_file) and thins the store on the persistence worker
+# at startup and then hourly.
+class BoardTimeline(QtCore.QObject):
+    # From the worker once the snapshots queued before show() are written.
+    _caught_up = QtCore.pyqtSignal()
+
+    def __init__(self, editor, root, worker, interval_s=60, thin_every_s=3600):
+        super().__init__(editor)
+        self.editor = editor
+        self.store = VersionStore(root)
+        self.worker = worker
+        self.interval_s = interval_s
+        self.thin_every_s = thin_every_s
+        self.last_snapshot = 0.0
+        self.last_thin = 0.0
+        self._caught_up.connect(self._show)
+
+    def start(self):
+        self.thin()
+
+    def due(self):
+        return time.time() - self.last_snapshot >= self.interval_s
+
+    def snapshot(self, html):
+        now = time.time()
+        self.last_snapshot = now
+        store = self.store
+        self.worker.submit(None, lambda: store.append(now, html))
+        if now - self.last_thin >= self.thin_every_s:
+            self.thin()
+
+    def thin(self):
+        self.last_thin = time.time()
+        store = self.store
+        self.worker.submit(("thin", store.root), store.thin)
+
+    # New versions go to `root`; the old ones stay where they are.
+    def relocate(self, root):
+        self.store = VersionStore(root)
+        self.last_snapshot = 0.0
+
+    # The dialog opens when the worker reaches this request, behind any
+    # snapshot still queued, so the GUI never waits on the disk for it.
+    def show(self):
+        self.worker.submit(("timeline-show", self.store.root), self._caught_up.emit)
+
+    def _show(self):
+        if not self.store.count():
+            QtWidgets.QMessageBox.information(
+                self.editor, "Versions", "No earlier versions of this board yet."
+            )
+            return
+        dialog = TimelineDialog(self.editor, self.store, getattr(self.editor, "blob_store", None))
+        if dialog.exec() and dialog.html is not None:
+            self.editor.restore_version(dialog.html)
+
+
+# Scrub through the stored versions with the slider, or jump to a moment with
+# the date field; Restore puts the shown version back on the board (one undo
+# step), Copy puts it (or the selection in the preview) on the clipboard.
+class TimelineDialog(QtWidgets.QDialog):
+    def __init__(self, parent, store, blob_store=None):
+        super().__init__(parent)
+        self.store = store
+        self.blob_store = blob_store
+        self.html = None
+        self.setWindowTitle("Versions")
+        self.resize(760, 560)
+        layout = QtWidgets.QVBoxLayout(self)
+        count = store.count()
+        self.slider = QtWidgets.QSlider(QtCore.Qt.Orientation.Horizontal)
+        self.slider.setRange(0, count - 1)
+        self.slider.setPageStep(max(1, count // 20))
+        self.time_edit = QtWidgets.QDateTimeEdit()
+        self.time_edit.setCalendarPopup(True)
+        self.time_edit.setDisplayFormat("yyyy-MM-dd HH:mm:ss")
+        self.time_edit.setMinimumDateTime(self._datetime(store.record(0)[0]))
+        self.time_edit.setMaximumDateTime(self._datetime(store.record(count - 1)[0]))
+        self.label = QtWidgets.QLabel()
+        seek_layout = QtWidgets.QHBoxLayout()
+        seek_layout.addWidget(self.slider, 1)
+        seek_layout.addWidget(self.time_edit)
+        layout.addLayout(seek_layout)
+        layout.addWidget(self.label)
+        self.view = QtWidgets.QTextBrowser()
+        self.view.setOpenExternalLinks(True)
+        layout.addWidget(self.view, 1)
+        self.button_box = QtWidgets.QDialogButtonBox(
+            QtWidgets.QDialogButtonBox.StandardButton.Close
+        )
+        copy_button = self.button_box.addButton(
+            "Copy", QtWidgets.QDialogButtonBox.ButtonRole.ActionRole
+        )
+        copy_button.clicked.connect(self.copy)
+        self.restore_button = self.button_box.addButton(
+            "Restore", QtWidgets.QDialogButtonBox.ButtonRole.AcceptRole
+        )
+        self.restore_button.clicked.connect(self.accept)
+        self.button_box.rejected.connect(self.reject)
+        layout.addWidget(self.button_box)
+        # Scrubbing only loads the version the slider rests on.
+        self.load_timer = QtCore.QTimer(self)
+        self.load_timer.setSingleShot(True)
+        self.load_timer.setInterval(120)
+        self.load_timer.timeout.connect(self.load_current)
+        self.slider.valueChanged.connect(self.on_slider_moved)
+        self.time_edit.dateTimeChanged.connect(self.on_time_changed)
+        self.slider.setValue(count - 1)
+        self.on_slider_moved(count - 1)
+        self.load_current()
+
+    @staticmethod
+    def _datetime(ts):
+        return QtCore.QDateTime.fromMSecsSinceEpoch(int(ts * 1000))
+
+    def on_slider_moved(self, i):
+        ts = self.store.record(i)[0]
+        self.time_edit.blockSignals(True)
+        self.time_edit.setDateTime(self._datetime(ts))
+        self.time_edit.blockSignals(False)
+        self.label.setText(
+            f"Version {i + 1} of {self.slider.maximum() + 1}, "
+            f"{datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')}"
+        )
+        self.load_timer.start()
+
+    def on_time_changed(self, value):
+        i = self.store.find(value.toMSecsSinceEpoch() / 1000)
+        if i is not None and i != self.slider.value():
+            self.slider.blockSignals(True)
+            self.slider.setValue(i)
+            self.slider.blockSignals(False)
+            self.on_slider_moved(i)
+
+    def load_current(self):
+        self.html = self.store.read(self.slider.value())
+        if self.html is None:
+            self.view.setHtml("<p style='color: red;'>This version could not be read.</p>")
+        else:
+            self.view.setHtml(inline_blob_images(self.html, self.blob_store))
+        self.restore_button.setEnabled(self.html is not None)
+
+    def copy(self):
+        cursor = self.view.textCursor()
+        if cursor.hasSelection():
+            self.view.copy()
+            return
+        mime = QtCore.QMimeData()
+        mime.setHtml(self.view.toHtml())
+        mime.setText(self.view.toPlainText())
+        QtWidgets.QApplication.clipboard().setMimeData(mime)
+
+    def accept(self):
+        if self.load_timer.isActive():
+            self.load_timer.stop()
+            self.load_current()
+        super().accept()
@@ -0,0 +1,103 @@
+import itertools
+from PyQt6 import QtCore, QtGui
+
+# Tray icon variants, all painted once up front: the base square with or
+# without the clipboard catch dot, dimmed or not for raw mode, and any mix of
+# the activity overlays below. Switching the icon is a dictionary lookup.
+
+SIZE = 32
+# name -> (corner, color) of a small dot drawn over the base icon.
+OVERLAYS = {
+    "snippet": ((22, 0), QtGui.QColor(255, 200, 0)),
+    "upload": ((22, 22), QtGui.QColor(40, 150, 255)),
+    "save": ((0, 22), QtGui.QColor(255, 255, 255)),
+}
+
+
+def _paint_base(catch):
+    pixmap = QtGui.QPixmap(SIZE, SIZE)
+    pixmap.fill(QtCore.Qt.GlobalColor.transparent)
+    painter = QtGui.QPainter(pixmap)
+    painter.setRenderHint(QtGui.QPainter.RenderHint.Antialiasing)
+    painter.setPen(QtGui.QPen(QtCore.Qt.GlobalColor.green, 4))
+    painter.setBrush(QtGui.QBrush(QtCore.Qt.GlobalColor.darkGreen))
+    painter.drawRect(4, 4, 24, 24)
+    if catch:
+        painter.setPen(QtCore.Qt.PenStyle.NoPen)
+        painter.setBrush(QtGui.QBrush(QtCore.Qt.GlobalColor.red))
+        painter.drawEllipse(11, 11, 10, 10)
+    painter.end()
+    return pixmap
+
+
+# Halves every channel of the painted pixels in one composition pass (what
+# raw mode used to do pixel by pixel); transparent pixels stay transparent.
+def _dim(pixmap):
+    pixmap = QtGui.QPixmap(pixmap)
+    painter = QtGui.QPainter(pixmap)
+    painter.setCompositionMode(QtGui.QPainter.CompositionMode.CompositionMode_SourceAtop)
+    painter.fillRect(pixmap.rect(), QtGui.QColor(0, 0, 0, 128))
+    painter.end()
+    return pixmap
+
+
+def _overlay(pixmap, names):
+    pixmap = QtGui.QPixmap(pixmap)
+    painter = QtGui.QPainter(pixmap)
+    painter.setRenderHint(QtGui.QPainter.RenderHint.Antialiasing)
+    painter.setPen(QtGui.QPen(QtGui.QColor(0, 0, 0), 1))
+    for name in names:
+        (x, y), color = OVERLAYS[name]
+        painter.setBrush(QtGui.QBrush(color))
+        painter.drawEllipse(x + 1, y + 1, 8, 8)
+    painter.end()
+    return pixmap
+
+
+class TrayIconRenderer:
+    def __init__(self):
+        self._icons = {}
+        for catch, raw in itertools.product((False, True), repeat=2):
+            base = _paint_base(catch)
+            if raw:
+                base = _dim(base)
+            for count in range(len(OVERLAYS) + 1):
+                for names in itertools.combinations(OVERLAYS, count):
+                    pixmap = _overlay(base, names) if names else base
+                    self._icons[(catch, raw, frozenset(names))] = QtGui.QIcon(pixmap)
+
+    def icon(self, catch=False, raw=False, activity=()):
+        return self._icons[(bool(catch), bool(raw), frozenset(activity))]
+
+
+# What the app is busy with, by name (see OVERLAYS). begin()/end() nest and
+# may be called from any thread; counts are kept and `changed` is emitted on
+# the GUI thread.
+class Activity(QtCore.QObject):
+    changed = QtCore.pyqtSignal()
+    _update = QtCore.pyqtSignal(str, int, bool)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._counts = {}
+        self._update.connect(self._apply)
+
+    def begin(self, name):
+        self._update.emit(name, 1, False)
+
+    def end(self, name):
+        self._update.emit(name, -1, False)
+
+    # On or off regardless of begin()/end(), for states that are flags.
+    def set(self, name, active):
+        self._update.emit(name, 1 if active else 0, True)
+
+    def active(self):
+        return frozenset(name for name, count in self._counts.items() if count > 0)
+
+    def _apply(self, name, value, absolute):
+        before = self.active()
+        count = value if absolute else self._counts.get(name, 0) + value
+        self._counts[name] = max(0, count)
+        if self.active() != before:
+            self.changed.emit()
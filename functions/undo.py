@@ -0,0 +1,678 @@
+import contextlib, html, json, os, re, time
+from datetime import datetime
+from PyQt6 import QtCore, QtWidgets
+from functions.blocks import apply_unit_edits, fragment_units, join_fragments, unit_edits
+from functions.persistence import write_atomic
+
+# Undo history kept as reversible block deltas instead of document snapshots.
+# The history mirrors the board as per-block fragments (see
+# blocks.document_fragments) and turns every BlockChangeTracker record into a
+# change (at, old fragments, new fragments). Changes emitted in the same event
+# loop turn form one step; typing inside the same blocks within `merge_ms` is
+# coalesced into the previous step. Every `keyframe_every` steps a copy of the
+# mirror is kept so goto() can jump far without walking every delta. Once the
+# history takes more than `budget_bytes`, steps already in the UndoLog are
+# unloaded (read back when needed) and the oldest others are dropped.
+#
+# Edits made inside background() (a folder size or a fetched image filled into
+# its placeholder) are not steps; the blocks they rewrite are rewritten the
+# same way in the recorded steps and keyframes, so undoing across them still
+# finds the board the steps expect.
+
+
+def _size(fragments):
+    return sum(len(f) for f in fragments)
+
+
+def _step_size(changes):
+    return sum(_size(old) + _size(new) for _, old, new in changes)
+
+
+_TAG = re.compile(r"<[^>]*>")
+
+
+# Text of a fragment; styling may be serialized differently from one session
+# to the next (the default font ends up on the spans), the text may not.
+def _text(fragment):
+    return html.unescape(_TAG.sub("", fragment))
+
+
+def undo_log_path_for(history_file):
+    return history_file + ".undo"
+
+
+# Folds changes that rewrite the same blocks one after the other into one.
+def fold_changes(changes):
+    folded = []
+    for at, old, new in changes:
+        if folded:
+            last_at, last_old, last_new = folded[-1]
+            if last_at == at and list(last_new) == list(old):
+                folded[-1] = (at, last_old, new)
+                continue
+        folded.append((at, old, new))
+    return folded
+
+
+# Append-only undo log next to the save file. One line per record:
+#   S <n> <json>       step n: {"ts", "cursor", "changes": [[at, old, new], ...]}
+#   T <n>              steps n and later are gone (undone, then edited)
+#   I <base> <index>   the oldest step kept and the first step not applied
+# A later S line for the same n replaces the earlier one. At startup the log is
+# compacted on the persistence worker (dead lines dropped, adjacent small steps
+# merged, the oldest steps dropped past `max_bytes`) and only an index of line
+# offsets is handed to the GUI; step payloads are read when undo reaches them.
+class UndoLog(QtCore.QObject):
+    indexed = QtCore.pyqtSignal(object)
+
+    SMALL_STEP = 4096
+    MERGED_STEP = 16384
+    MERGE_SECONDS = 300
+
+    def __init__(self, path, worker, max_bytes=64 * 1024 * 1024, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.worker = worker
+        self.max_bytes = max_bytes
+
+    # Compacts and indexes the log in the background; `indexed` carries
+    # {"steps": [(offset, length), ...], "base": n, "index": k}.
+    def open(self):
+        path = self.path
+        self.worker.submit(("undo-index", path), lambda: self.indexed.emit(self._open(path)))
+
+    def _open(self, path):
+        scan = self.scan(path)
+        if scan["dead"] > len(scan["steps"]) // 2 or scan["bytes"] > self.max_bytes:
+            self.compact(path, scan)
+            scan = self.scan(path)
+        return scan
+
+    @staticmethod
+    def scan(path):
+        entries = {}
+        base = index = 0
+        lines = 0
+        offset = 0
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    lines += 1
+                    kind, _, rest = line.partition(b" ")
+                    try:
+                        if kind == b"S":
+                            entries[int(rest.split(b" ", 1)[0])] = (offset, len(line))
+                        elif kind == b"T":
+                            cut = int(rest)
+                            entries = {n: ref for n, ref in entries.items() if n < cut}
+                        elif kind == b"I":
+                            base, index = (int(v) for v in rest.split())
+                    except ValueError:
+                        break
+                    offset += len(line)
+        steps = []
+        while base + len(steps) in entries:
+            steps.append(entries[base + len(steps)])
+        return {
+            "steps": steps,
+            "base": base,
+            "index": max(0, min(index - base, len(steps))),
+            "dead": lines - len(steps),
+            "bytes": offset,
+        }
+
+    @staticmethod
+    def read_line(path, ref):
+        with open(path, "rb") as f:
+            f.seek(ref[0])
+            line = f.read(ref[1])
+        return json.loads(line.split(b" ", 2)[2])
+
+    def read(self, ref):
+        payload = self.read_line(self.path, ref)
+        payload["changes"] = [tuple(c) for c in payload["changes"]]
+        return payload
+
+    # Rewrites the log with only the live steps, merging neighbours that are
+    # both small and close in time (never across the applied/undone boundary).
+    def compact(self, path, scan):
+        steps = [self.read_line(path, ref) for ref in scan["steps"]]
+        index = scan["index"]
+        merged = []
+        merged_index = 0
+        for number, step in enumerate(steps):
+            size = _step_size(step["changes"])
+            if merged:
+                last, last_number = merged[-1]
+                last_size = _step_size(last["changes"])
+                if (
+                    (last_number < index) == (number < index)
+                    and size < self.SMALL_STEP
+                    and last_size < self.SMALL_STEP
+                    and last_size + size < self.MERGED_STEP
+                    and step["ts"] - last["ts"] < self.MERGE_SECONDS
+                ):
+                    last["changes"] = fold_changes(last["changes"] + step["changes"])
+                    last["ts"] = step["ts"]
+                    last["cursor"] = step["cursor"]
+                    continue
+            merged.append((step, number))
+            if number < index:
+                merged_index = len(merged)
+        lines = [
+            f"S {n} {json.dumps(step, ensure_ascii=False)}\n".encode("utf-8")
+            for n, (step, _) in enumerate(merged)
+        ]
+        first = 0
+        total = sum(len(line) for line in lines)
+        while total > self.max_bytes and first < merged_index:
+            total -= len(lines[first])
+            first += 1
+        lines.append(f"I {first} {merged_index}\n".encode("utf-8"))
+
+        def write(f):
+            for line in lines[first:]:
+                f.write(line)
+
+        write_atomic(path, write, binary=True)
+
+    # Appends `records` (("S", n, payload, on_written) / ("T", n) / ("I", base,
+    # index)) on the worker; on_written gets the (offset, length) of S lines.
+    def append(self, records):
+        path = self.path
+
+        def write():
+            with open(path, "ab") as f:
+                offset = f.tell()
+                written = []
+                for record in records:
+                    if record[0] == "S":
+                        line = f"S {record[1]} {json.dumps(record[2], ensure_ascii=False)}\n"
+                    else:
+                        line = " ".join(str(v) for v in record) + "\n"
+                    data = line.encode("utf-8")
+                    f.write(data)
+                    if record[0] == "S":
+                        written.append((record[3], (offset, len(data))))
+                    offset += len(data)
+                f.flush()
+                os.fsync(f.fileno())
+            for on_written, ref in written:
+                on_written(ref)
+
+        self.worker.submit(None, write, path=path)
+
+    # Starts an empty log at `path` (the save file moved).
+    def relocate(self, path):
+        self.path = path
+        self.worker.submit(None, lambda: write_atomic(path, lambda f: None), path=path)
+
+
+class UndoHistory(QtCore.QObject):
+    # Emitted after every new step, undo, redo or goto.
+    changed = QtCore.pyqtSignal()
+
+    def __init__(
+        self,
+        editor,
+        tracker,
+        budget_bytes=8 * 1024 * 1024,
+        keyframe_every=50,
+        merge_ms=1000,
+        log=None,
+    ):
+        super().__init__(editor)
+        self.editor = editor
+        self.budget_bytes = budget_bytes
+        self.keyframe_every = keyframe_every
+        self.merge_ms = merge_ms
+        self.log = log
+        self.mirror = None
+        self.steps = []
+        # steps[:index] are applied, steps[index:] can be redone.
+        self.index = 0
+        # Number of steps dropped from the front; step i is `base + i` overall.
+        self.base = 0
+        self.keyframes = {}
+        self.used = 0
+        self.applying = False
+        self._in_background = False
+        # Fragments written by background edits that the steps loaded from
+        # the log could not be brought up to date with.
+        self.background_fragments = set()
+        self._open_step = None
+        # Steps numbered below saved_upto are in the log as they are now.
+        self.saved_upto = 0
+        self.saved_position = None
+        self.truncate_at = None
+        tracker.changed.connect(self.on_change)
+
+    @property
+    def ready(self):
+        return self.mirror is not None
+
+    # Starts recording from the current document, picking up the steps of an
+    # indexed UndoLog (see UndoLog.open) if given. Qt's own undo stack is
+    # switched off from here on, it would keep a second copy of every edit.
+    def start(self, fragments, persisted=None):
+        self.mirror = list(fragments)
+        self.steps = []
+        self.index = 0
+        self.base = 0
+        if persisted:
+            self.steps = [{"ref": ref, "closed": True} for ref in persisted["steps"]]
+            self.base = persisted["base"]
+            self.index = persisted["index"]
+        self.saved_upto = self.base + len(self.steps)
+        self.saved_position = (self.base, self.base + self.index) if persisted else None
+        # Starting over: whatever the log holds does not belong to this board.
+        self.truncate_at = None if persisted or self.log is None else 0
+        self.used = 8 * len(self.mirror)
+        self.background_fragments = set()
+        self.keyframes = {self.base + self.index: tuple(self.mirror)}
+        self.editor.document().setUndoRedoEnabled(False)
+        self.changed.emit()
+
+    def stop(self):
+        self.mirror = None
+        self.steps = []
+        self.index = 0
+        self.keyframes = {}
+        self.used = 0
+        self.editor.document().setUndoRedoEnabled(True)
+
+    # Edits made inside this (a fetched image or a folder size filled into its
+    # placeholder) update the board but are not undo steps of their own.
+    @contextlib.contextmanager
+    def background(self):
+        applying, in_background = self.applying, self._in_background
+        self.applying = self._in_background = True
+        try:
+            yield
+        finally:
+            self.applying, self._in_background = applying, in_background
+
+    # Rewrites fragments `old` to `new` wherever the history holds them.
+    def _rebase(self, old, new):
+        if len(old) != len(new):
+            self.background_fragments.update(new)
+            return
+        swap = {o: n for o, n in zip(old, new) if o != n}
+        if not swap:
+            return
+        for i, step in enumerate(self.steps):
+            if "changes" not in step:
+                # Only in the log; _fits lets the new text through instead.
+                self.background_fragments.update(swap.values())
+                continue
+            changes = [
+                (at, [swap.get(f, f) for f in before], [swap.get(f, f) for f in after])
+                for at, before, after in step["changes"]
+            ]
+            if changes == step["changes"]:
+                continue
+            step["changes"] = changes
+            size = _step_size(changes)
+            self.used += size - step["size"]
+            step["size"] = size
+            # The logged copy (if any) is stale now.
+            step["ref"] = None
+            step["version"] = step.get("version", 0) + 1
+            self.saved_upto = min(self.saved_upto, self.base + i)
+        for key, frame in self.keyframes.items():
+            self.keyframes[key] = tuple(swap.get(f, f) for f in frame)
+
+    def _load(self, step):
+        if "changes" not in step:
+            payload = self.log.read(step["ref"])
+            step["changes"] = payload["changes"]
+            step["cursor"] = payload["cursor"]
+            step["timestamp"] = payload["ts"]
+            step["size"] = _step_size(step["changes"])
+            self.used += step["size"]
+        return step
+
+    def on_change(self, record):
+        if self.mirror is None:
+            return
+        at = record["at"]
+        old = self.mirror[at : at + record["remove"]]
+        new = record["blocks"]
+        self.mirror[at : at + record["remove"]] = new
+        if self.applying:
+            if self._in_background:
+                self._rebase(old, new)
+            return
+        now = time.monotonic()
+        if self._open_step is not None:
+            changes = self._open_step["changes"]
+            last_at, last_old, last_new = changes[-1]
+            if last_at == at and len(last_new) == len(old) == len(new):
+                changes[-1] = (at, last_old, new)
+                self._account([], new, last_new)
+            else:
+                changes.append((at, old, new))
+                self._account(old, new)
+            self._open_step["time"] = now
+            return
+        if self.index < len(self.steps):
+            for step in self.steps[self.index :]:
+                if "changes" in step:
+                    self.used -= step["size"]
+            del self.steps[self.index :]
+            for key in [k for k in self.keyframes if k > self.base + self.index]:
+                del self.keyframes[key]
+            if self.base + self.index < self.saved_upto:
+                self.saved_upto = self.base + self.index
+                if self.truncate_at is None or self.saved_upto < self.truncate_at:
+                    self.truncate_at = self.saved_upto
+        last = self.steps[-1] if self.steps else None
+        if (
+            last is not None
+            and not last.get("closed")
+            and now - last["time"] < self.merge_ms / 1000
+            and len(last["changes"]) == 1
+            and last["changes"][0][0] == at
+            and len(last["changes"][0][2]) == len(old) == len(new)
+        ):
+            last_at, last_old, last_new = last["changes"][0]
+            last["changes"][0] = (last_at, last_old, new)
+            last["size"] += _size(new) - _size(last_new)
+            self.used += _size(new) - _size(last_new)
+            last["time"] = now
+            # The logged copy (if any) is stale now.
+            last["ref"] = None
+            last["version"] = last.get("version", 0) + 1
+            self.saved_upto = min(self.saved_upto, self.base + len(self.steps) - 1)
+            # So is a keyframe taken when the step was closed.
+            number = self.base + len(self.steps)
+            if number in self.keyframes:
+                self.keyframes[number] = tuple(self.mirror)
+            self._trim()
+            self.changed.emit()
+            return
+        step = {
+            "changes": [(at, old, new)],
+            "time": now,
+            "timestamp": time.time(),
+            "cursor": self.editor.textCursor().position(),
+            "size": 0,
+        }
+        self.steps.append(step)
+        self.index = len(self.steps)
+        self._open_step = step
+        self._account(old, new)
+        QtCore.QTimer.singleShot(0, self._close_step)
+
+    def _account(self, old, new, replaced=()):
+        size = _size(old) + _size(new) - _size(replaced)
+        self._open_step["size"] += size
+        self.used += size
+
+    def _close_step(self):
+        step = self._open_step
+        self._open_step = None
+        if step is None:
+            return
+        if len(step["changes"]) > 1:
+            # Several records from one action (a paste, an archive run) are
+            # never merged with the typing that follows.
+            step["closed"] = True
+        number = self.base + self.index
+        if number % self.keyframe_every == 0:
+            self.keyframes[number] = tuple(self.mirror)
+            self.used += 8 * len(self.mirror)
+        self._trim()
+        self.changed.emit()
+
+    def _trim(self):
+        if self.used <= self.budget_bytes:
+            return
+        for step in self.steps[: max(0, self.index - 1)]:
+            if self.used <= self.budget_bytes:
+                return
+            if "changes" in step and step.get("ref"):
+                del step["changes"]
+                self.used -= step["size"]
+        while self.used > self.budget_bytes and self.index > 1:
+            step = self.steps.pop(0)
+            if "changes" in step:
+                self.used -= step["size"]
+            self.base += 1
+            self.index -= 1
+            for key in [k for k in self.keyframes if k < self.base]:
+                self.used -= 8 * len(self.keyframes.pop(key))
+
+    # Appends the steps that are not in the log yet (and the current position)
+    # to the UndoLog; called by the editor on every save.
+    def persist(self):
+        if self.log is None or not self.ready:
+            return
+        self._close_step()
+        records = []
+        if self.truncate_at is not None:
+            records.append(("T", self.truncate_at))
+            self.truncate_at = None
+        for i in range(max(0, self.saved_upto - self.base), len(self.steps)):
+            step = self.steps[i]
+            payload = {
+                "ts": step["timestamp"],
+                "cursor": step["cursor"],
+                "changes": step["changes"],
+            }
+            version = step.get("version", 0)
+
+            def on_written(ref, step=step, version=version):
+                # Runs on the worker; a step coalesced meanwhile is rewritten
+                # by the next persist().
+                if step.get("version", 0) == version:
+                    step["ref"] = ref
+
+            records.append(("S", self.base + i, payload, on_written))
+        self.saved_upto = self.base + len(self.steps)
+        position = (self.base, self.base + self.index)
+        if records or position != self.saved_position:
+            records.append(("I",) + position)
+            self.saved_position = position
+            self.log.append(records)
+
+    # Moves the log with the save file; everything still in memory is written
+    # to the new place on the next persist().
+    def relocate_log(self, path):
+        if self.log is None or path == self.log.path:
+            return
+        for step in self.steps:
+            if "changes" not in step:
+                self._load(step)
+            step["ref"] = None
+        self.log.relocate(path)
+        self.saved_upto = self.base
+        self.saved_position = None
+        self.truncate_at = None
+
+    def can_undo(self):
+        return self.ready and self.index > 0
+
+    def can_redo(self):
+        return self.ready and self.index < len(self.steps)
+
+    # Replaces mirror blocks at..at+count-1 with `fragments` in the document;
+    # returns False if the document did not end up where the history expects.
+    def _replace(self, at, count, fragments):
+        expected = len(self.mirror) - count + len(fragments)
+        target = self.mirror[:at] + list(fragments) + self.mirror[at + count :]
+        self._apply_target(target)
+        return len(self.mirror) == expected
+
+    # Brings the document to `target` (per-block fragments) by replacing only
+    # the units that differ.
+    def _apply_target(self, target):
+        starts, units = fragment_units(self.mirror)
+        edits = unit_edits(units, fragment_units(target)[1])
+        if not edits:
+            return
+        doc = self.editor.document()
+        self.applying = True
+        try:
+            if not apply_unit_edits(doc, starts, units, edits):
+                self.editor.setHtml(join_fragments(target, doc))
+        finally:
+            self.applying = False
+
+    def _move_cursor(self, position):
+        cursor = self.editor.textCursor()
+        cursor.setPosition(min(position, self.editor.document().characterCount() - 1))
+        self.editor.setTextCursor(cursor)
+        self.editor.ensureCursorVisible()
+
+    # True if the board holds what the first change to apply expects; steps
+    # read back from the log may not fit a board that was edited elsewhere.
+    # Blocks last written by a background edit are taken as they are.
+    def _fits(self, change, undo):
+        at, old, new = change
+        expected = new if undo else old
+        actual = self.mirror[at : at + len(expected)]
+        return len(actual) == len(expected) and all(
+            a in self.background_fragments or _text(a) == _text(e)
+            for a, e in zip(actual, expected)
+        )
+
+    def undo(self):
+        if not self.can_undo():
+            return False
+        self._close_step()
+        step = self._load(self.steps[self.index - 1])
+        if not self._fits(step["changes"][-1], undo=True):
+            # Nothing before this point can be undone on this board.
+            self._drop_before(self.index)
+            return False
+        ok = True
+        for at, old, new in reversed(step["changes"]):
+            ok = self._replace(at, len(new), old) and ok
+        self.index -= 1
+        self._after_move(ok, step["cursor"])
+        return True
+
+    def redo(self):
+        if not self.can_redo():
+            return False
+        self._close_step()
+        step = self._load(self.steps[self.index])
+        if not self._fits(step["changes"][0], undo=False):
+            for dropped in self.steps[self.index :]:
+                if "changes" in dropped:
+                    self.used -= dropped["size"]
+            del self.steps[self.index :]
+            for key in [k for k in self.keyframes if k > self.base + self.index]:
+                del self.keyframes[key]
+            self.truncate_at = self.base + self.index
+            self.saved_upto = min(self.saved_upto, self.truncate_at)
+            self.changed.emit()
+            return False
+        ok = True
+        for at, old, new in step["changes"]:
+            ok = self._replace(at, len(old), new) and ok
+        self.index += 1
+        self._after_move(ok, step["cursor"])
+        return True
+
+    def _drop_before(self, count):
+        for step in self.steps[:count]:
+            if "changes" in step:
+                self.used -= step["size"]
+        del self.steps[:count]
+        self.base += count
+        self.index -= count
+        for key in [k for k in self.keyframes if k < self.base]:
+            self.used -= 8 * len(self.keyframes.pop(key))
+        self.changed.emit()
+
+    def _after_move(self, ok, cursor):
+        if not ok:
+            # The document no longer lines up with the recorded deltas.
+            self.start(self.editor.block_cache.fragments())
+            return
+        if self.index:
+            # Typing after an undo/redo starts a step of its own.
+            self.steps[self.index - 1]["closed"] = True
+        self._move_cursor(cursor)
+        self.changed.emit()
+
+    # Fragments of the board after the first `number - base` steps, walked
+    # from the nearest keyframe or from the current state.
+    def state_at(self, number):
+        index = number - self.base
+        if not 0 <= index <= len(self.steps):
+            raise IndexError(number)
+        start, fragments = self.base + self.index, list(self.mirror)
+        for key, frame in self.keyframes.items():
+            if abs(key - number) < abs(start - number):
+                start, fragments = key, list(frame)
+        position = start - self.base
+        while position > index:
+            position -= 1
+            for at, old, new in reversed(self._load(self.steps[position])["changes"]):
+                fragments[at : at + len(new)] = old
+        while position < index:
+            for at, old, new in self._load(self.steps[position])["changes"]:
+                fragments[at : at + len(old)] = new
+            position += 1
+        return fragments
+
+    # Jumps to the state after step `number` (counted from the first step ever
+    # recorded) with a single block-level edit of the document.
+    def goto(self, number):
+        self._close_step()
+        target = self.state_at(number)
+        self._apply_target(target)
+        self.index = number - self.base
+        if len(self.mirror) != len(target):
+            self.start(self.editor.block_cache.fragments())
+            return
+        self.changed.emit()
+
+
+# Lists the states the undo history can jump to, newest first; Go to puts the
+# chosen one on the board in a single edit (see UndoHistory.goto). Steps only
+# in the log show no time, reading them back just for the list would cost a
+# seek each.
+class UndoHistoryDialog(QtWidgets.QDialog):
+    def __init__(self, parent, history):
+        super().__init__(parent)
+        self.number = None
+        self.setWindowTitle("Undo history")
+        self.resize(360, 420)
+        layout = QtWidgets.QVBoxLayout(self)
+        self.list = QtWidgets.QListWidget()
+        current = history.base + history.index
+        for number in range(history.base + len(history.steps), history.base - 1, -1):
+            if number == history.base:
+                text = "Start of history"
+            else:
+                ts = history.steps[number - history.base - 1].get("timestamp")
+                when = datetime.fromtimestamp(ts).strftime("%H:%M:%S") if ts else "saved"
+                text = f"Step {number} ({when})"
+            if number == current:
+                text += "  ← now"
+            item = QtWidgets.QListWidgetItem(text)
+            item.setData(QtCore.Qt.ItemDataRole.UserRole, number)
+            self.list.addItem(item)
+            if number == current:
+                self.list.setCurrentItem(item)
+        self.list.itemDoubleClicked.connect(self.accept)
+        layout.addWidget(self.list, 1)
+        button_box = QtWidgets.QDialogButtonBox(
+            QtWidgets.QDialogButtonBox.StandardButton.Close
+        )
+        go_button = button_box.addButton("Go to", QtWidgets.QDialogButtonBox.ButtonRole.AcceptRole)
+        go_button.clicked.connect(self.accept)
+        button_box.rejected.connect(self.reject)
+        layout.addWidget(button_box)
+
+    def accept(self):
+        item = self.list.currentItem()
+        if item is not None:
+            self.number = item.data(QtCore.Qt.ItemDataRole.UserRole)
+        super().accept()
@@ -1,9 +1,75 @@
-import ctypes
-from PyQt6.QtGui import QImage, QColor
+import ctypes, json, os, threading
+from PyQt6.QtGui import QColor
 from PyQt6.QtCore import QFileInfo
-import winreg
+
+# The Windows calls below are only made by WindowsThemeProvider (see
+# theme_providers); elsewhere they fall back to "no wallpaper, light mode".
+try:
+    import winreg
+except ImportError:
+    winreg = None
+from functions.color_average import average_color, read_scaled
+from functions.persistence import write_atomic
+
+# Values computed from a wallpaper image (its average color, its palette),
+# keyed by the file's fingerprint: path, mtime and size. Kept in memory and in
+# ~/.cache_desktop_textboard_<name>.json, so the same image is never decoded
+# twice, not even across restarts. Safe to use from worker threads.
+class FingerprintCache:
+    def __init__(self, name, max_entries=32):
+        self.name = name
+        self.max_entries = max_entries
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def path(self):
+        return os.path.join(os.path.expanduser("~"), f".cache_desktop_textboard_{self.name}.json")
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path(), "r", encoding="utf-8") as f:
+                    self._entries = dict(json.load(f))
+            except (OSError, ValueError, TypeError):
+                self._entries = {}
+        return self._entries
+
+    def get(self, key):
+        with self._lock:
+            entries = self._load()
+            value = entries.pop(key, None)
+            if value is not None:
+                # Most recently used last, so trimming drops the oldest first.
+                entries[key] = value
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            entries = self._load()
+            entries.pop(key, None)
+            entries[key] = value
+            while len(entries) > self.max_entries:
+                del entries[next(iter(entries))]
+            data = dict(entries)
+        try:
+            write_atomic(self.path(), lambda f: json.dump(data, f, indent=2))
+        except OSError:
+            pass
+
+
+def wallpaper_fingerprint(image_path):
+    try:
+        st = os.stat(image_path)
+    except OSError:
+        return None
+    return f"{os.path.abspath(image_path)}|{st.st_mtime_ns}|{st.st_size}"
+
+
+color_cache = FingerprintCache("colors")
 
 def windows_is_dark_mode():
+    if winreg is None:
+        return False
     try:
         reg = winreg.ConnectRegistry(None, winreg.HKEY_CURRENT_USER)
         key = winreg.OpenKey(reg, r"Software\Microsoft\Windows\CurrentVersion\Themes\Personalize")
@@ -15,25 +81,35 @@ def windows_is_dark_mode():
         return False
 
 def get_wallpaper_path():
+    if not hasattr(ctypes, "windll"):
+        return ""
     buffer = ctypes.create_unicode_buffer(260)
     ctypes.windll.user32.SystemParametersInfoW(0x0073, 260, buffer, 0)  # SPI_GETDESKWALLPAPER
     return buffer.value
 
 def get_average_wallpaper_color(image_path):
-    image = QImage(image_path)
-    if image.isNull():
-        return QColor(0, 0, 0)
-    r = g = b = count = 0
-    step = max(1, image.width() // 100)
-    for x in range(0, image.width(), step):
-        for y in range(0, image.height(), step):
-            r += image.pixelColor(x, y).red()
-            g += image.pixelColor(x, y).green()
-            b += image.pixelColor(x, y).blue()
-            count += 1
-    return QColor(r // count, g // count, b // count) if count > 0 else QColor(0, 0, 0)
+    return average_color(read_scaled(image_path))
+
+# The cached average color of `image_path`, None if it was never computed.
+def peek_wallpaper_color(image_path):
+    key = wallpaper_fingerprint(image_path)
+    name = color_cache.get(key) if key else None
+    return QColor(name) if name else None
+
+def cached_wallpaper_color(image_path):
+    key = wallpaper_fingerprint(image_path)
+    if key is None:
+        return get_average_wallpaper_color(image_path)
+    name = color_cache.get(key)
+    if name is not None:
+        return QColor(name)
+    color = get_average_wallpaper_color(image_path)
+    color_cache.put(key, color.name())
+    return color
 
 def get_default_desktop_color():
+    if not hasattr(ctypes, "windll"):
+        return QColor(0, 0, 0)
     COLOR_DESKTOP = 1
     colorref = ctypes.windll.user32.GetSysColor(COLOR_DESKTOP)
     r = colorref & 0xFF
@@ -44,7 +120,7 @@ def get_default_desktop_color():
 def get_desktop_base_color():
     path = get_wallpaper_path()
     if QFileInfo(path).exists():
-        return get_average_wallpaper_color(path)
+        return cached_wallpaper_color(path)
     else:
         return get_default_desktop_color()
 
@@ -0,0 +1,115 @@
+import difflib, os, threading
+from PyQt6 import QtCore
+from functions.blocks import fragment_units
+
+
+# Watches the board files for changes made by another process (a second
+# instance, a sync client). Writes of our own are reported by the persistence
+# worker and their stat signature is remembered, so only foreign writes emit
+# `changed`. The directories are watched too: an atomic replace swaps the
+# inode and QFileSystemWatcher silently drops the file.
+class BoardWatcher(QtCore.QObject):
+    changed = QtCore.pyqtSignal()
+
+    def __init__(self, parent, worker, delay_ms=300):
+        super().__init__(parent)
+        self.paths = []
+        self.known = {}
+        self._lock = threading.Lock()
+        self.fs = QtCore.QFileSystemWatcher(self)
+        self.fs.fileChanged.connect(self.on_fs_event)
+        self.fs.directoryChanged.connect(self.on_fs_event)
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay_ms)
+        self.timer.timeout.connect(self.check)
+        # Direct: runs on the worker thread right after the write, before the
+        # change notification reaches us.
+        worker.written.connect(self.note_written, QtCore.Qt.ConnectionType.DirectConnection)
+
+    @staticmethod
+    def signature(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def watch(self, paths):
+        if self.fs.files():
+            self.fs.removePaths(self.fs.files())
+        if self.fs.directories():
+            self.fs.removePaths(self.fs.directories())
+        self.paths = [os.path.abspath(p) for p in paths]
+        with self._lock:
+            self.known = {p: self.signature(p) for p in self.paths}
+        dirs = {os.path.dirname(p) for p in self.paths}
+        self.fs.addPaths([d for d in dirs if os.path.isdir(d)])
+        self.fs.addPaths([p for p in self.paths if os.path.exists(p)])
+
+    # Also covers the files a write drags along: sqlite's -wal next to the db,
+    # the journal a checkpoint truncates.
+    def note_written(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            for p in self.paths:
+                if p.startswith(path):
+                    self.known[p] = self.signature(p)
+
+    def on_fs_event(self, path):
+        self.timer.start()
+
+    def check(self):
+        watched = set(self.fs.files())
+        changed = False
+        for path in self.paths:
+            if path not in watched and os.path.exists(path):
+                self.fs.addPath(path)
+            signature = self.signature(path)
+            with self._lock:
+                if signature != self.known.get(path):
+                    self.known[path] = signature
+                    changed = True
+        if changed:
+            self.changed.emit()
+
+
+# The board as top-level units: returns (first block of every unit, unit html).
+def local_units(cache):
+    return fragment_units(cache.fragments())
+
+
+# Three-way merge of unit lists. `base` is what the file held when we last
+# read or wrote it (None when unknown), `local` the document, `remote` the
+# file now. Returns (edits, conflict): edits are (l1, l2, units) meaning
+# "replace local units l1..l2-1 with these", for every remote change whose
+# units we have not touched ourselves. Remote changes overlapping local ones
+# are left out and flagged; the local version wins.
+def merge_units(base, local, remote):
+    if base is None:
+        return [], remote != local
+    matcher = difflib.SequenceMatcher(None, base, local, autojunk=False)
+    mapping = {}
+    for a, b, size in matcher.get_matching_blocks():
+        for k in range(size):
+            mapping[a + k] = b + k
+    edits = []
+    conflict = False
+    remote_ops = difflib.SequenceMatcher(None, base, remote, autojunk=False).get_opcodes()
+    for tag, i1, i2, j1, j2 in remote_ops:
+        if tag == "equal":
+            continue
+        if i1 < i2:
+            ok = all(i in mapping for i in range(i1, i2))
+            ok = ok and mapping[i2 - 1] - mapping[i1] == i2 - 1 - i1
+            if ok:
+                edits.append((mapping[i1], mapping[i2 - 1] + 1, remote[j1:j2]))
+                continue
+        else:
+            left = mapping.get(i1 - 1) if i1 > 0 else -1
+            right = mapping.get(i1) if i1 < len(base) else len(local)
+            if left is not None and right is not None and right == left + 1:
+                edits.append((right, right, remote[j1:j2]))
+                continue
+        conflict = True
+    return edits, conflict